@@ -1,34 +1,57 @@
 from dotenv import load_dotenv, find_dotenv
 from langchain_core.messages import AIMessage, HumanMessage
-from langchain_community.utilities import SQLDatabase
 import streamlit as st
 import pandas as pd
-import pymongo
 from bson import ObjectId
 import os
 import json
+from utilities.runtime import get_mongo_client, warm_up
 from utilities.SQL import SQLChain
+from utilities.engine_registry import get_database
+from utilities.query_executor import deserialize_result, serialize_result
+from utilities.message_store import get_message_store
+from utilities.tracing import span, start_trace
 
 # Load environment variables
 ENV_FILE = find_dotenv()
 if ENV_FILE:
     load_dotenv(ENV_FILE)
 
-# MongoDB connection
-client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+# Build the LLM client, Langfuse handler and DB drivers in the background while the page renders
+warm_up()
+
+# MongoDB connection. The page needs the conversation before it can render anything, so the
+# client is built on the first run rather than deferred; later reruns reuse the process-wide one
+client = get_mongo_client(os.getenv("MONGO_URI"))
 db = client[os.getenv("MONGO_DB_NAME")]
 conversations_collection = db["conversations"]
+message_store = get_message_store(db)
 
 # Page configuration
 st.set_page_config(page_title="Chat with QueryBot", page_icon=":speech_balloon:", layout="wide")
 
-def message_to_dict(message):
-    return {
-        "role": "AI" if isinstance(message, AIMessage) else "Human",
-        "content": message.content
-    }
+def dict_to_message(message):
+    message_class = AIMessage if message["role"] == "AI" else HumanMessage
+    return message_class(content=message["content"], additional_kwargs={"seq": message["seq"]})
+
+def stored_result(seq, result):
+    # Results are parsed into frames once per session instead of on every rerun
+    key = (conversation_id, seq)
+    if key not in st.session_state.result_frames:
+        st.session_state.result_frames[key] = deserialize_result(result)
+    return st.session_state.result_frames[key]
+
+def show_row_count(frame):
+    if frame.attrs.get("truncated"):
+        row_count = frame.attrs.get("row_count")
+        total = f"{row_count:,}" if row_count is not None else "more"
+        st.caption(f"Showing the first {len(frame):,} of {total} rows.")
 
-def init_database(db_type: str, user: str, password: str, host: str, port: str, database: str) -> SQLDatabase:
+def stream_with_icon(tokens):
+    yield "💡 "
+    yield from tokens
+
+def init_database(db_type: str, user: str, password: str, host: str, port: str, database: str):
     if db_type == 'MySQL':
         db_uri = f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
     elif db_type == 'PostgreSQL':
@@ -39,7 +62,7 @@ def init_database(db_type: str, user: str, password: str, host: str, port: str,
         db_uri = f"mssql+pyodbc://{user}:{password}@{host}:{port}/{database}?driver=ODBC+Driver+17+for+SQL+Server"
     else:
         raise ValueError("Unsupported database type")
-    return SQLDatabase.from_uri(db_uri)
+    return get_database(db_uri)
 
 # Extract URL parameters
 conversation_id = st.query_params.to_dict()['conversation_id']
@@ -50,6 +73,9 @@ if "chat_history" not in st.session_state:
 
 if "db" not in st.session_state:
     st.session_state.db = None
+
+if "result_frames" not in st.session_state:
+    st.session_state.result_frames = {}
     
 st.button("⚙️ Settings")
 
@@ -58,14 +84,14 @@ st.button("⚙️ Settings")
 if conversation_id:
     conversation = conversations_collection.find_one({"_id": ObjectId(conversation_id)})
     if conversation:
-        # Load existing chat history
-        if "messages" in conversation:
-            st.session_state.chat_history = []
-            for msg in conversation["messages"]:
-                if msg["role"] == "AI":
-                    st.session_state.chat_history.append(AIMessage(content=msg["content"]))
-                else:
-                    st.session_state.chat_history.append(HumanMessage(content=msg["content"]))
+        # Load the latest page of history once per session; older pages load on demand
+        if st.session_state.get("history_conversation_id") != conversation_id:
+            with span("mongo_history_load") as tags:
+                messages, has_more = message_store.load_page(conversation_id)
+                tags["messages"] = len(messages)
+            st.session_state.chat_history = [dict_to_message(msg) for msg in messages]
+            st.session_state.history_has_more = has_more
+            st.session_state.history_conversation_id = conversation_id
 
         db_type = conversation["db_type"]
         host = conversation["host"]
@@ -79,7 +105,11 @@ if conversation_id:
             st.session_state.db = init_database(db_type, user, password, host, port, database)
             if st.session_state.db.get_usable_table_names():
                 st.success("Connected to database!")
-                st.session_state.chain = SQLChain(st.session_state.db)
+                # The registry hands back the same SQLDatabase across reruns, so only
+                # rebuild the chain when the conversation points at a different one
+                if st.session_state.get("chain_db") is not st.session_state.db:
+                    st.session_state.chain = SQLChain(st.session_state.db)
+                    st.session_state.chain_db = st.session_state.db
         except Exception as e:
             st.error('An error occurred. Check database connection and credentials')
             print(e)
@@ -102,8 +132,15 @@ with st.sidebar:
         st.write(f"**Database:** {database}")
     else:
         st.write("No database information available")
+    show_timings = st.toggle("Show timing breakdown", key="show_timings")
 
 # Display chat history
+if st.session_state.get("history_has_more") and st.button("Load earlier messages"):
+    first_seq = st.session_state.chat_history[0].additional_kwargs["seq"]
+    messages, has_more = message_store.load_page(conversation_id, before_seq=first_seq)
+    st.session_state.chat_history = [dict_to_message(msg) for msg in messages] + st.session_state.chat_history
+    st.session_state.history_has_more = has_more
+
 for message in st.session_state.chat_history:
     if isinstance(message, AIMessage):
         try:
@@ -112,10 +149,12 @@ for message in st.session_state.chat_history:
                 if ai_content.get('query') and ai_content.get('query') != 'N/A':
                     st.markdown(f"```sql\n{ai_content.get('query')}\n```")
                 if ai_content.get('result'):
-                    if isinstance(ai_content.get('result'), str):
-                        st.text(ai_content['result'])
+                    result_frame = stored_result(message.additional_kwargs.get("seq"), ai_content['result'])
+                    if isinstance(result_frame, str):
+                        st.text(result_frame)
                     else:
-                        st.dataframe(pd.DataFrame(ai_content['result']))
+                        st.dataframe(result_frame)
+                        show_row_count(result_frame)
                 st.markdown(f"💡 {ai_content.get('rephrasedAnswer', '')}")
         except json.JSONDecodeError:
             # Fallback for older messages
@@ -135,13 +174,17 @@ specific_words_responses = {
 
 user_query = st.chat_input("Type a message...")
 if user_query:
+    trace = start_trace()
     # Append the user message to chat history
-    st.session_state.chat_history.append(HumanMessage(content=user_query))
+    with span("mongo_write"):
+        seq = message_store.append(conversation_id, "Human", user_query)
+    st.session_state.chat_history.append(HumanMessage(content=user_query, additional_kwargs={"seq": seq}))
 
     with st.chat_message("Human"):
         st.markdown(f"✍️ {user_query}")
 
     response = None
+    result_frame = None
     with st.chat_message("AI"):
         if user_query.lower() in specific_words_responses:
             response = specific_words_responses[user_query.lower()]
@@ -149,22 +192,34 @@ if user_query:
             rephrased_answer = response
             result = None
         else:
-            response = st.session_state.chain.invoke_chain(user_query, st.session_state.chat_history)
-            query_text = response['query']
-            rephrased_answer = response['rephrasedAnswer']
-            if isinstance(response['result'], pd.DataFrame):
-                result = response['result'].to_dict()
-            else:
-                result = response['result']
-        
-        if query_text and query_text != 'N/A':
-            st.markdown(f"```sql\n{query_text}\n```")
-        if result:
-            if isinstance(result, str):
-                st.text(result)
-            else:
-                st.dataframe(pd.DataFrame(result))
-        st.markdown(f"💡 {rephrased_answer}")
+            # Render each stage as soon as the chain produces it
+            result_table = None
+            for key, value in st.session_state.chain.stream_chain(user_query, st.session_state.chat_history):
+                if key == "query":
+                    query_text = value
+                    st.markdown(f"```sql\n{query_text}\n```")
+                elif key == "resultPage":
+                    if result_table is None:
+                        result_table = st.dataframe(value)
+                    else:
+                        result_table.add_rows(value)
+                elif key == "result":
+                    if isinstance(value, pd.DataFrame):
+                        with span("result_serialize", rows=len(value)):
+                            result = serialize_result(value)
+                        result_frame = value
+                        if result_table is None:
+                            st.dataframe(value)
+                        show_row_count(value)
+                    else:
+                        result = value
+                        if result:
+                            st.text(result)
+                elif key == "rephrasedAnswer":
+                    rephrased_answer = st.write_stream(stream_with_icon(value)).removeprefix("💡 ")
+
+        if query_text == "N/A":
+            st.markdown(f"💡 {rephrased_answer}")
 
         # Append the AI response to chat history
         ai_message_content = {
@@ -172,10 +227,15 @@ if user_query:
             "result": result,
             "rephrasedAnswer": rephrased_answer
         }
-        st.session_state.chat_history.append(AIMessage(content=json.dumps(ai_message_content)))
+        ai_content = json.dumps(ai_message_content)
+        # Messages are appended one at a time; the conversation document is never rewritten
+        with span("mongo_write", bytes=len(ai_content)):
+            seq = message_store.append(conversation_id, "AI", ai_content)
+        st.session_state.chat_history.append(AIMessage(content=ai_content, additional_kwargs={"seq": seq}))
+        if result_frame is not None:
+            st.session_state.result_frames[(conversation_id, seq)] = result_frame
+
+        if show_timings:
+            with st.expander("⏱️ Timing breakdown"):
+                st.dataframe(pd.DataFrame(trace.breakdown()).set_index("stage"))
 
-    # Store chat history in MongoDB
-    conversations_collection.update_one(
-        {"_id": ObjectId(conversation_id)},
-        {"$set": {"messages": [message_to_dict(msg) for msg in st.session_state.chat_history]}}
-    )
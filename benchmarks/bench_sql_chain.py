@@ -0,0 +1,254 @@
+"""
+End-to-end benchmark of the text-to-SQL pipeline.
+
+Runs `SQLChain` against a generated SQLite database with a deterministic stub LLM,
+so every stage except the LLM itself is measured for real:
+
+    python benchmarks/bench_sql_chain.py --tables 200 --columns 12 --rows 50000
+    python benchmarks/bench_sql_chain.py --save baseline.json
+    python benchmarks/bench_sql_chain.py --compare baseline.json --tolerance 0.2
+
+Each stage reports median and p95 latency and the peak traced memory it allocated. `--compare`
+exits non-zero when a stage's median regressed beyond the tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORK_DIR = tempfile.mkdtemp(prefix="querybot-bench-")
+# Keep the benchmark away from the real schema and query caches
+os.environ.setdefault("SCHEMA_CACHE_DIR", os.path.join(WORK_DIR, "schema"))
+os.environ.setdefault("QUERY_CACHE_PERSIST", "false")
+
+from langchain_community.utilities import SQLDatabase
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from utilities.SQL import SQLChain, sql_prompt
+from utilities.query_cache import QueryCache
+from utilities.query_executor import deserialize_result, serialize_result
+from utilities.result_cache import ResultCache
+from utilities.schema_catalog import SchemaCatalog
+from utilities.table_selector import estimate_tokens
+
+COLUMN_TYPES = ("INTEGER", "REAL", "TEXT")
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet")
+
+
+class StubChatModel(BaseChatModel):
+    """Deterministic chat model: canned SQL for generation prompts, a canned answer otherwise."""
+
+    sql: str
+    answer: str = "There are several matching rows in the result."
+    latency: float = 0.0
+    token_latency: float = 0.0
+    prompts: list = []
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def _respond(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        self.prompts.append(prompt)
+        time.sleep(self.latency)
+        return self.sql if "SQLQuery:" in prompt else self.answer
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages)
+        for index, word in enumerate(text.split(" ")):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if index == 0 else " " + word))
+
+
+def generate_database(path, tables, columns, rows, seed=0):
+    """
+    Create a SQLite database of `tables` tables chained by foreign keys.
+
+    Each table has an `id` primary key, a foreign key to the previous table and
+    `columns` data columns cycling through INTEGER, REAL and TEXT.
+    """
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    for t in range(tables):
+        definitions = ["id INTEGER PRIMARY KEY"]
+        if t > 0:
+            definitions.append(f"t{t - 1}_id INTEGER REFERENCES t{t - 1} (id)")
+        definitions += [f"c{c} {COLUMN_TYPES[c % 3]}" for c in range(columns)]
+        connection.execute(f"CREATE TABLE t{t} ({', '.join(definitions)})")
+
+        def make_row(i):
+            row = [i]
+            if t > 0:
+                row.append(rng.randrange(rows) if rows else None)
+            for c in range(columns):
+                kind = COLUMN_TYPES[c % 3]
+                row.append(rng.randrange(1000) if kind == "INTEGER" else
+                           rng.random() * 1000 if kind == "REAL" else rng.choice(WORDS))
+            return row
+
+        placeholders = ", ".join("?" * (len(definitions)))
+        connection.executemany(f"INSERT INTO t{t} VALUES ({placeholders})", (make_row(i) for i in range(rows)))
+    connection.commit()
+    connection.close()
+
+
+def measure(name, func, timings, memory):
+    tracemalloc.reset_peak()
+    # The peak counts everything traced so far; only the growth during the stage is the stage's own
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    value = func()
+    timings[name].append(time.perf_counter() - started)
+    memory[name] = max(memory.get(name, 0), tracemalloc.get_traced_memory()[1] - baseline)
+    return value
+
+
+def run_iteration(db_uri, args, timings, memory, tokens):
+    db = measure("connect", lambda: SQLDatabase.from_uri(db_uri), timings, memory)
+    # The chain gets the catalog reflected here, so no later stage pays for a cold reflection
+    catalog = SchemaCatalog(db, cache_dir=tempfile.mkdtemp(dir=WORK_DIR), sample_rows=3)
+    measure("schema_reflection", catalog.refresh, timings, memory)
+
+    llm = StubChatModel(sql=args.sql, latency=args.llm_latency, token_latency=args.token_latency)
+    chain = SQLChain(db, llm=llm, callbacks=[], cache=QueryCache(path=None), result_cache=ResultCache(cache_dir=None),
+                     catalog=catalog)
+    config = {"callbacks": []}
+    inputs = chain.prepare_inputs(args.question, [])
+
+    def build_prompt():
+        selection = chain.table_selector.select(args.question)
+        prompt = sql_prompt.format(
+            input=args.question + "\nSQLQuery: ",
+            table_info=chain.catalog.render(selection["tables"]),
+            dialect=db.dialect,
+            top_k=10,
+            message_history=inputs["message_history"],
+        )
+        return selection, prompt
+
+    selection, prompt = measure("prompt_build", build_prompt, timings, memory)
+    tokens["sql_prompt"] = estimate_tokens(prompt)
+    tokens["schema_full"] = selection["full_tokens"]
+    tokens["schema_saved"] = selection["tokens_saved"]
+
+    state = measure("generation", lambda: chain.generate_chain.invoke(inputs, config=config), timings, memory)
+
+    def execute():
+        stats = {}
+        pages = list(chain.executor.iter_pages(state["query"], stats))
+        return chain.executor.collect(pages, stats)
+
+    result = measure("execution", execute, timings, memory)
+
+    def parse():
+        stored = json.dumps(serialize_result(result))
+        deserialize_result(json.loads(stored))
+        return chain.executor.render(result)
+
+    measure("result_parsing", parse, timings, memory)
+    state["result"] = result
+    measure("rephrase", lambda: chain.rephrase_chain.invoke(state, config=config), timings, memory)
+    tokens["answer_prompt"] = estimate_tokens(llm.prompts[-1])
+
+    measure("end_to_end", lambda: chain.invoke_chain(args.question, []), timings, memory)
+    measure("end_to_end_cached", lambda: chain.invoke_chain(args.question, []), timings, memory)
+    db._engine.dispose()
+
+
+def summarize(timings, memory, tokens, args):
+    stages = {}
+    for name, samples in timings.items():
+        ordered = sorted(samples)
+        stages[name] = {
+            "median_ms": statistics.median(ordered) * 1000,
+            "p95_ms": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))] * 1000,
+            "peak_memory_kb": memory[name] / 1024,
+        }
+    return {
+        "config": {key: getattr(args, key) for key in ("tables", "columns", "rows", "iterations", "llm_latency", "sql", "question")},
+        "stages": stages,
+        "tokens": tokens,
+    }
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for name, stage in report["stages"].items():
+        previous = baseline["stages"].get(name)
+        if previous is None:
+            continue
+        # Ignore sub-millisecond noise on very fast stages
+        if stage["median_ms"] > previous["median_ms"] * (1 + tolerance) and stage["median_ms"] - previous["median_ms"] > 1:
+            regressions.append(f"{name}: {previous['median_ms']:.1f}ms -> {stage['median_ms']:.1f}ms")
+    for name, count in report["tokens"].items():
+        previous = baseline["tokens"].get(name)
+        if previous and count > previous * (1 + tolerance):
+            regressions.append(f"{name} tokens: {previous} -> {count}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", type=int, default=50)
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM sleeps per call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds the stub LLM sleeps per streamed token")
+    parser.add_argument("--sql", default="SELECT * FROM t0", help="SQL the stub LLM returns")
+    parser.add_argument("--question", default="Show every c1 and c2 in t0")
+    parser.add_argument("--save", help="Write the report to this JSON file")
+    parser.add_argument("--compare", help="Compare against a JSON baseline written by --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+
+    db_path = os.path.join(WORK_DIR, "bench.sqlite3")
+    started = time.perf_counter()
+    generate_database(db_path, args.tables, args.columns, args.rows)
+    print(f"Generated {args.tables} tables x {args.rows} rows in {time.perf_counter() - started:.1f}s ({db_path})")
+
+    timings, memory, tokens = defaultdict(list), {}, {}
+    tracemalloc.start()
+    for _ in range(args.iterations):
+        run_iteration(f"sqlite:///{db_path}", args, timings, memory, tokens)
+    tracemalloc.stop()
+
+    report = summarize(timings, memory, tokens, args)
+    print(f"{'stage':<20}{'median ms':>12}{'p95 ms':>12}{'peak KiB':>12}")
+    for name, stage in report["stages"].items():
+        print(f"{name:<20}{stage['median_ms']:>12.1f}{stage['p95_ms']:>12.1f}{stage['peak_memory_kb']:>12.0f}")
+    print("tokens: " + ", ".join(f"{name}={count}" for name, count in tokens.items()))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Launch several Streamlit chat workers for the multi-worker deployment mode.
+
+    python run_workers.py --workers 4 --base-port 8501 --public-host chat.example.com
+
+Every worker is a separate `streamlit run app.py` process on its own port. Point
+`server.py` at them with the printed CHAT_WORKER_URLS; conversations are routed to
+workers by rendezvous hashing. Set REDIS_URL (or SHARED_STATE_BACKEND=mongo) so
+workers share the query cache and schema snapshots and any worker can pick up any
+conversation cold. Chat history already lives in MongoDB.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--base-port", type=int, default=8501)
+    parser.add_argument("--address", default="0.0.0.0", help="Address the workers listen on")
+    parser.add_argument("--public-host", default="localhost", help="Host name used in CHAT_WORKER_URLS")
+    args = parser.parse_args(argv)
+
+    processes, urls = [], []
+    for index in range(args.workers):
+        port = args.base_port + index
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", os.path.join(ROOT, "app.py"),
+             "--server.port", str(port), "--server.address", args.address, "--server.headless", "true"],
+            cwd=ROOT,
+        ))
+        urls.append(f"http://{args.public_host}:{port}")
+    print(f"CHAT_WORKER_URLS={','.join(urls)}", flush=True)
+
+    def stop(*_):
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop()
+        for process in processes:
+            process.wait()
+    return max(process.returncode or 0 for process in processes)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
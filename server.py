@@ -1,11 +1,14 @@
-from flask import Flask, request, jsonify, redirect, render_template, session, url_for
-from pymongo import MongoClient
+from flask import Flask, Response, request, jsonify, redirect, render_template, session, url_for
+from pymongo import MongoClient, DESCENDING
 from bson import ObjectId
 from os import environ as env
 from urllib.parse import quote_plus, urlencode
 from authlib.integrations.flask_client import OAuth
 from dotenv import find_dotenv, load_dotenv
 import datetime
+from utilities.message_store import get_message_store
+from utilities.tracing import collect_snapshots, render_prometheus, span
+from utilities.worker_routing import get_worker_router
 
 ENV_FILE = find_dotenv()
 if ENV_FILE:
@@ -19,6 +22,13 @@ client = MongoClient(env.get("MONGO_URI"))
 db = client[env.get("MONGO_DB_NAME")]
 users_collection = db["users"]
 conversations_collection = db["conversations"]
+message_store = get_message_store(db)
+
+# Conversations are spread over the chat workers in CHAT_WORKER_URLS
+worker_router = get_worker_router()
+
+CONVERSATION_PAGE_SIZE = int(env.get("CONVERSATION_PAGE_SIZE", 20))
+conversations_collection.create_index([("user_id", DESCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
 
 oauth = OAuth(app)
 
@@ -32,6 +42,49 @@ oauth.register(
     server_metadata_url=f'https://{env.get("AUTH0_DOMAIN")}/.well-known/openid-configuration'
 )
 
+def chat_url(conversation_id):
+    return f"{worker_router.route(conversation_id)}?conversation_id={conversation_id}"
+
+def fetch_conversations(user_id, cursor=None, limit=CONVERSATION_PAGE_SIZE):
+    """
+    Fetch one page of a user's conversations, newest first, in a single query.
+
+    Args:
+        user_id (str): Id of the owning user.
+        cursor (str or None): Opaque cursor returned with the previous page.
+        limit (int): Page size.
+
+    Returns:
+        tuple: (list of conversation dicts without messages or passwords, cursor of the next page or None)
+    """
+    query = {"user_id": ObjectId(user_id)}
+    if cursor:
+        timestamp, _, last_id = cursor.partition("_")
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": ObjectId(last_id)}},
+        ]
+    with span("mongo_conversation_list") as tags:
+        documents = list(
+            conversations_collection.find(query, projection={"messages": 0, "password": 0})
+            .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit + 1)
+        )
+        tags["conversations"] = len(documents)
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = f"{documents[-1]['timestamp'].isoformat()}_{documents[-1]['_id']}"
+
+    conversations = []
+    for conversation in documents:
+        conversation["_id"] = str(conversation["_id"])
+        conversation["user_id"] = str(conversation["user_id"])
+        conversation["url"] = chat_url(conversation["_id"])
+        conversations.append(conversation)
+    return conversations, next_cursor
+
 @app.route("/login")
 def login():
     return oauth.auth0.authorize_redirect(
@@ -87,18 +140,28 @@ def userPanel():
         if user:
             user["_id"] = str(user["_id"])
 
-            # Fetch conversations
-            conversations = []
-            if "conversations" in user:
-                for conv_id in user["conversations"]:
-                    conversation = conversations_collection.find_one({"_id": ObjectId(conv_id)})
-                    if conversation:
-                        conversation["_id"] = str(conversation["_id"])
-                        conversations.append(conversation)
+            # Fetch the first page of conversations; the panel lazy-loads the rest
+            conversations, next_cursor = fetch_conversations(user_id)
 
-            return render_template("userPanel.html", user=user, conversations=conversations)
+            return render_template("userPanel.html", user=user, conversations=conversations, next_cursor=next_cursor)
     return redirect(url_for("home"))
 
+@app.route("/conversations")
+def list_conversations():
+    user_info = session.get("user")
+    if not user_info:
+        return jsonify({"success": False, "message": "User not authenticated"}), 401
+
+    conversations, next_cursor = fetch_conversations(user_info["_id"], cursor=request.args.get("cursor"))
+    for conversation in conversations:
+        conversation["timestamp"] = str(conversation["timestamp"])
+    return jsonify({"success": True, "conversations": conversations, "next_cursor": next_cursor}), 200
+
+@app.route("/metrics")
+def prometheus_metrics():
+    # Merges the snapshots written by this server and every chat worker process
+    return Response(render_prometheus(collect_snapshots()), mimetype="text/plain; version=0.0.4")
+
 @app.route('/conversation', methods=['POST'])
 def new_conversation():
     user_info = session.get("user")
@@ -121,7 +184,7 @@ def new_conversation():
         "user": user,
         "password": password,
         "database": database,
-        "messages": [],
+        "message_seq": 0,
         "timestamp": datetime.datetime.utcnow()
     }
     conversation_id = conversations_collection.insert_one(conversation).inserted_id
@@ -131,7 +194,7 @@ def new_conversation():
         {"$push": {"conversations": conversation_id}}
     )
     
-    streamlit_url = f"http://localhost:8501?conversation_id={str(conversation_id)}"
+    streamlit_url = chat_url(str(conversation_id))
     return jsonify({"success": True, "redirect_url": streamlit_url}), 201
 
 @app.route('/conversation/<conversation_id>', methods=['DELETE'])
@@ -140,6 +203,7 @@ def delete_conversation(conversation_id):
         result = conversations_collection.delete_one({"_id": ObjectId(conversation_id)})
         
         if result.deleted_count == 1:
+            message_store.delete_conversation(conversation_id)
             user = users_collection.find_one({"conversations": ObjectId(conversation_id)})
             
             if user:
@@ -19,7 +19,7 @@ $('#saveConversationBtn').click(function() {
     });
 });
 
-$('.delete-conversation').click(function() {
+$('#conversationsUl').on('click', '.delete-conversation', function() {
     var conversationId = $(this).data('id');
     if (confirm('Are you sure you want to delete this conversation?')) {
         $.ajax({
@@ -35,4 +35,35 @@ $('.delete-conversation').click(function() {
         });
     }
 });
+
+$('#loadMoreConversationsBtn').click(function() {
+    var button = $(this);
+    button.prop('disabled', true);
+    $.getJSON('/conversations', { cursor: button.data('cursor') }, function(response) {
+        if (!response.success) {
+            alert('Error: ' + response.message);
+            return;
+        }
+        response.conversations.forEach(function(conversation) {
+            var item = $('<li class="list-group-item"></li>');
+            var link = $('<a class="list-group-item-action"></a>').attr('href', conversation.url);
+            [['Database Type', conversation.db_type], ['Host', conversation.host], ['Port', conversation.port],
+             ['User', conversation.user], ['Database', conversation.database], ['Timestamp', conversation.timestamp]
+            ].forEach(function(field, index) {
+                if (index > 0) {
+                    link.append('<br>');
+                }
+                link.append($('<strong></strong>').text(field[0] + ':'), document.createTextNode(' ' + field[1]));
+            });
+            var deleteButton = $('<button class="btn btn-danger btn-sm float-right delete-conversation">Delete</button>')
+                .attr('data-id', conversation._id);
+            $('#conversationsUl').append(item.append(link, deleteButton));
+        });
+        if (response.next_cursor) {
+            button.data('cursor', response.next_cursor).prop('disabled', false);
+        } else {
+            button.remove();
+        }
+    });
 });
+});
\ No newline at end of file
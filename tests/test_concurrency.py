@@ -0,0 +1,75 @@
+import asyncio
+import threading
+
+import pytest
+
+from utilities.concurrency import ConcurrencyLimiter
+
+
+def test_threads_and_coroutines_share_one_cap():
+    limiter = ConcurrencyLimiter(1)
+    entered = []
+
+    async def run():
+        async with limiter:
+            entered.append("coroutine")
+
+    async def main():
+        limiter.acquire()
+        task = asyncio.create_task(run())
+        await asyncio.sleep(0.05)
+        assert entered == []
+        # Released from another thread, like a Streamlit session finishing its query
+        threading.Thread(target=limiter.release).start()
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(main())
+    assert entered == ["coroutine"]
+
+    async def hold(release):
+        async with limiter:
+            await release.wait()
+
+    async def main_with_thread():
+        release = asyncio.Event()
+        task = asyncio.create_task(hold(release))
+        await asyncio.sleep(0)
+        thread = threading.Thread(target=lambda: (limiter.acquire(), entered.append("thread"), limiter.release()))
+        thread.start()
+        await asyncio.sleep(0.05)
+        assert entered == ["coroutine"]
+        release.set()
+        await task
+        thread.join(1)
+
+    asyncio.run(main_with_thread())
+    assert entered == ["coroutine", "thread"]
+    assert limiter._active == 0
+
+
+@pytest.mark.parametrize("handed_over", [False, True])
+def test_cancelled_waiter_gives_its_slot_back(handed_over):
+    limiter = ConcurrencyLimiter(1)
+
+    async def wait():
+        async with limiter:
+            pass
+
+    async def main():
+        limiter.acquire()
+        task = asyncio.create_task(wait())
+        await asyncio.sleep(0)
+        if handed_over:
+            # The slot is handed to the waiter just as it is cancelled
+            limiter.release()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        if not handed_over:
+            limiter.release()
+
+    asyncio.run(main())
+    assert limiter._active == 0 and not limiter._waiters
+    with limiter:
+        assert limiter._active == 1
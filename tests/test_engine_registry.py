@@ -0,0 +1,26 @@
+import gc
+
+from utilities import schema_catalog
+from utilities.engine_registry import EngineRegistry
+
+
+def test_idle_engine_is_disposed_even_with_a_catalog(tmp_path, monkeypatch):
+    monkeypatch.setattr(schema_catalog, "SCHEMA_CACHE_DIR", str(tmp_path / "schema"))
+    db_uri = f"sqlite:///{tmp_path / 'shop.db'}"
+    registry = EngineRegistry(idle_timeout=0)
+    db = registry.get_database(db_uri)
+    with db._engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE orders (id INTEGER PRIMARY KEY)")
+    catalog = schema_catalog.get_catalog(db)
+    catalog.refresh()
+    engine, pool = db._engine, db._engine.pool
+
+    del db
+    registry.evict_idle()
+    gc.collect()
+
+    # The finalizer disposed the engine, which swaps in a fresh pool
+    assert engine.pool is not pool
+    assert catalog.db is None
+    registry.evict_idle()
+    assert registry._entries == {}
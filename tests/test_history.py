@@ -0,0 +1,66 @@
+import json
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utilities.history import HistoryManager, compact_message, summarize_turns
+from utilities.table_selector import estimate_tokens
+
+
+def turn(number, rows=3):
+    answer = {
+        "query": f"SELECT * FROM orders WHERE customer_id = {number}",
+        "result": {"columns": ["id", "total"], "data": [[i, i * 10] for i in range(rows)], "row_count": rows},
+        "rephrasedAnswer": f"Customer {number} placed {rows} orders. The largest was {rows * 10}.",
+    }
+    return [HumanMessage(content=f"What did customer {number} order?"), AIMessage(content=json.dumps(answer))]
+
+
+def test_compact_message_replaces_the_result_table_with_its_shape():
+    line = compact_message(turn(7, rows=5000)[1])
+
+    assert line.startswith("AI: SQL: SELECT * FROM orders WHERE customer_id = 7")
+    assert "Result: 5000 rows with columns id, total" in line
+    assert "[1, 10]" not in line
+
+
+def test_older_turns_are_summarized_once_and_recent_ones_kept():
+    calls = []
+
+    def summarizer(previous, messages):
+        calls.append(len(messages))
+        return summarize_turns(previous, messages)
+
+    manager = HistoryManager(max_turns=2, token_budget=1500, summary_budget=400, summarizer=summarizer)
+    history = []
+    for number in range(6):
+        history += turn(number)
+        rendered = manager.render(history)
+
+    assert "Recent messages:\nHuman: What did customer 4 order?" in rendered
+    assert "- Human: What did customer 0 order?" in rendered
+    assert "customer 3 order?" in rendered.split("Recent messages:")[0]
+    # Each turn that aged out was summarized once, on the render it aged out in
+    assert calls == [2, 2, 2, 2]
+
+
+def test_summary_and_rendering_stay_within_their_budgets():
+    manager = HistoryManager(max_turns=1, token_budget=300, summary_budget=100)
+    history = []
+    for number in range(50):
+        history += turn(number, rows=1000)
+
+    rendered = manager.render(history)
+
+    assert estimate_tokens(manager._summary) <= 100
+    assert "customer 49" in rendered and "customer 0 " not in rendered
+    assert len(rendered) <= 300 * 4
+
+
+def test_edited_history_is_summarized_again():
+    manager = HistoryManager(max_turns=1)
+    history = turn(0) + turn(1) + turn(2)
+    manager.render(history)
+
+    edited = [HumanMessage(content="What did customer 9 order?")] + history[1:]
+
+    assert "customer 9" in manager.render(edited)
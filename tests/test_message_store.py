@@ -0,0 +1,77 @@
+import datetime
+import json
+
+import mongomock
+import mongomock.gridfs
+
+from utilities.message_store import MessageStore
+
+mongomock.gridfs.enable_gridfs_integration()
+
+
+def make_store(**options):
+    mongo_db = mongomock.MongoClient()["querybot"]
+    return mongo_db, MessageStore(mongo_db, **options)
+
+
+def answer(rows):
+    return json.dumps({"query": "SELECT * FROM orders", "result": {"columns": ["id"], "data": [[i] for i in range(rows)]},
+                       "rephrasedAnswer": f"{rows} orders."})
+
+
+def test_pages_go_back_from_the_most_recent_messages():
+    mongo_db, store = make_store(page_size=2)
+    conversation_id = str(mongo_db.conversations.insert_one({}).inserted_id)
+    for number in range(5):
+        store.append(conversation_id, "Human", f"question {number}")
+
+    page, has_more = store.load_page(conversation_id)
+    assert [message["seq"] for message in page] == [4, 5] and has_more
+    page, has_more = store.load_page(conversation_id, before_seq=page[0]["seq"])
+    assert [message["content"] for message in page] == ["question 1", "question 2"] and has_more
+    page, has_more = store.load_page(conversation_id, before_seq=page[0]["seq"])
+    assert [message["seq"] for message in page] == [1] and not has_more
+
+
+def test_large_results_are_offloaded_and_restored():
+    mongo_db, store = make_store(inline_result_bytes=100)
+    conversation_id = str(mongo_db.conversations.insert_one({}).inserted_id)
+    store.append(conversation_id, "AI", answer(2))
+    store.append(conversation_id, "AI", answer(500))
+
+    small, large = mongo_db.messages.find().sort("seq")
+    assert "result" in small and "result_file_id" not in small
+    assert "result_file_id" in large and "result" not in large
+    page, _ = store.load_page(conversation_id)
+    assert [len(json.loads(message["content"])["result"]["data"]) for message in page] == [2, 500]
+
+
+def test_embedded_messages_are_migrated_once():
+    mongo_db, store = make_store()
+    embedded = [{"role": "Human", "content": "How many orders?"}, {"role": "AI", "content": answer(3)}]
+    conversation_id = str(mongo_db.conversations.insert_one({"messages": embedded}).inserted_id)
+
+    page, has_more = store.load_page(conversation_id)
+    assert [(message["seq"], message["role"]) for message in page] == [(1, "Human"), (2, "AI")] and not has_more
+    assert "messages" not in mongo_db.conversations.find_one()
+
+    store.load_page(conversation_id)
+    assert store.append(conversation_id, "Human", "And yesterday?") == 3
+    assert mongo_db.messages.count_documents({}) == 3
+
+
+def test_interrupted_migration_is_resumed_with_the_same_sequence_numbers():
+    mongo_db, store = make_store(migration_timeout=60)
+    embedded = [{"role": "Human", "content": f"question {number}"} for number in range(3)]
+    started = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+    conversation_id = mongo_db.conversations.insert_one({
+        "messages": embedded, "message_seq": 3, "messages_migration": {"first_seq": 1, "at": started},
+    }).inserted_id
+    # The session that died had inserted the first message already
+    mongo_db.messages.insert_one({"conversation_id": conversation_id, "seq": 1, "role": "Human", "content": "question 0"})
+
+    page, _ = store.load_page(str(conversation_id))
+
+    assert [message["content"] for message in page] == ["question 0", "question 1", "question 2"]
+    assert [message["seq"] for message in page] == [1, 2, 3]
+    assert "messages_migration" not in mongo_db.conversations.find_one()
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine
+
+from utilities.plan_guard import PlanGuard, _mysql_stats, _postgres_stats
+
+
+def make_guard(dialect="mysql", max_rows=1_000_000, row_limit=1000):
+    return PlanGuard(SimpleNamespace(dialect=dialect, _schema=None), max_rows=max_rows, row_limit=row_limit)
+
+
+def mysql_table(name, rows, access_type="ALL"):
+    return {"table": {"table_name": name, "access_type": access_type, "rows_examined_per_scan": rows}}
+
+
+def test_with_limit_appends_a_limit_to_a_simple_select():
+    assert make_guard().with_limit("SELECT * FROM orders;") == "SELECT * FROM orders\nLIMIT 1000"
+
+
+def test_with_limit_keeps_a_smaller_existing_limit():
+    guard = make_guard()
+    assert guard.with_limit("SELECT * FROM orders LIMIT 10") == "SELECT * FROM orders LIMIT 10"
+    assert guard.with_limit("SELECT * FROM orders LIMIT 10 OFFSET 50000") == "SELECT * FROM orders LIMIT 10 OFFSET 50000"
+
+
+def test_with_limit_lowers_a_larger_existing_limit():
+    guard = make_guard()
+    assert guard.with_limit("SELECT * FROM orders LIMIT 50000") == "SELECT * FROM orders LIMIT 1000"
+    assert guard.with_limit("SELECT * FROM orders LIMIT 20, 50000") == "SELECT * FROM orders LIMIT 20, 1000"
+
+
+def test_with_limit_refuses_queries_a_limit_does_not_bound():
+    guard = make_guard()
+    assert guard.with_limit("SELECT * FROM orders ORDER BY total DESC") is None
+    assert guard.with_limit("SELECT * FROM orders o JOIN items i ON i.order_id = o.id") is None
+    assert guard.with_limit("SELECT COUNT(*) FROM orders") is None
+    assert guard.with_limit("DELETE FROM orders") is None
+    assert make_guard("mssql").with_limit("SELECT * FROM orders") is None
+
+
+def test_over_budget_reports_rows_and_full_scans():
+    guard = make_guard(max_rows=100)
+    assert guard.over_budget({"estimated_rows": 100, "cost": None, "full_scans": ["orders"]}) == ""
+    reason = guard.over_budget({"estimated_rows": 5000, "cost": None, "full_scans": ["orders"]})
+    assert "5,000 rows" in reason and "fully scans orders" in reason
+
+
+def test_existing_limit_bounds_the_estimate(monkeypatch):
+    guard = make_guard(max_rows=100)
+    monkeypatch.setattr(guard, "explain", lambda query: guard._bounded(
+        query, {"estimated_rows": 10_000_000, "cost": None, "full_scans": ["orders"]}
+    ))
+
+    assert guard.check("SELECT * FROM orders LIMIT 10")["action"] == "accept"
+    assert guard.check("SELECT * FROM orders")["action"] == "rewrite"
+    assert guard.check("SELECT * FROM orders ORDER BY total LIMIT 10")["action"] == "reject"
+
+
+def test_mysql_rows_multiply_within_a_join_but_not_across_union_branches():
+    join = {"query_block": {"nested_loop": [mysql_table("orders", 1000), mysql_table("items", 50, "ref")]}}
+    assert _mysql_stats(join)["estimated_rows"] == 50_000
+
+    union = {"query_block": {"union_result": {"query_specifications": [
+        {"query_block": mysql_table("orders", 1000)},
+        {"query_block": mysql_table("archived_orders", 2000)},
+    ]}}}
+    stats = _mysql_stats(union)
+    assert stats["estimated_rows"] == 3000
+    assert stats["full_scans"] == ["orders", "archived_orders"]
+
+
+def test_mysql_rows_do_not_multiply_into_subqueries():
+    plan = {"query_block": {"table": dict(mysql_table("customers", 100)["table"], attached_subqueries=[
+        {"query_block": mysql_table("orders", 1000)},
+    ])}}
+    assert _mysql_stats(plan)["estimated_rows"] == 1100
+
+
+def test_postgres_limit_node_bounds_the_estimate():
+    scan = {"Node Type": "Seq Scan", "Relation Name": "orders", "Plan Rows": 10_000_000}
+    limited = [{"Plan": {"Node Type": "Limit", "Plan Rows": 10, "Total Cost": 1.0, "Plans": [scan]}}]
+    assert _postgres_stats(limited)["estimated_rows"] == 10
+
+    sort = {"Node Type": "Sort", "Plan Rows": 10_000_000, "Plans": [scan]}
+    sorted_limit = [{"Plan": {"Node Type": "Limit", "Plan Rows": 10, "Total Cost": 1.0, "Plans": [sort]}}]
+    assert _postgres_stats(sorted_limit)["estimated_rows"] == 10_000_000
+
+
+def sqlite_guard(max_rows):
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE orders (id INTEGER PRIMARY KEY, total REAL)")
+        connection.exec_driver_sql("CREATE TABLE items (id INTEGER PRIMARY KEY, order_id INTEGER)")
+    catalog = SimpleNamespace(tables={"orders": {"marker": [5000]}, "items": {"marker": [20000]}})
+    return PlanGuard(SimpleNamespace(dialect="sqlite", _schema=None, _engine=engine), catalog=catalog, max_rows=max_rows)
+
+
+def test_sqlite_aliased_cross_join_is_rejected():
+    verdict = sqlite_guard(max_rows=1_000_000).check("SELECT * FROM orders o, items i")
+
+    assert verdict["action"] == "reject"
+    assert verdict["stats"]["estimated_rows"] == 100_000_000
+    assert verdict["stats"]["full_scans"] == ["orders", "items"]
+
+
+def test_sqlite_aliased_key_join_is_accepted():
+    verdict = sqlite_guard(max_rows=1_000_000).check("SELECT * FROM orders AS o JOIN items i ON i.order_id = o.id")
+
+    assert verdict["action"] == "accept"
+    assert verdict["stats"]["full_scans"] == ["items"]
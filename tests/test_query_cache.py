@@ -0,0 +1,95 @@
+from utilities.query_cache import QueryCache
+
+
+def make_cache():
+    return QueryCache(path=None, similarity_threshold=0.9, result_ttl=300)
+
+
+def test_scope_separates_databases_with_the_same_schema():
+    cache = make_cache()
+    tenant_a = QueryCache.scope("db-a", None, "schema", "mysql")
+    tenant_b = QueryCache.scope("db-b", None, "schema", "mysql")
+    cache.store("How many orders were placed?", tenant_a, "SELECT COUNT(*) FROM orders", {"rows": [[1]]}, "One.",
+                markers={"orders": [1, "2024-01-01"]})
+
+    assert cache.lookup("How many orders were placed?", tenant_b) is None
+    assert cache.lookup("How many orders were placed?", tenant_a)["rephrasedAnswer"] == "One."
+
+
+def test_scope_separates_schemas():
+    assert QueryCache.scope("db", "sales", "schema", "postgresql") != QueryCache.scope("db", "hr", "schema", "postgresql")
+
+
+def test_questions_differing_in_a_literal_do_not_match():
+    cache = make_cache()
+    scope = QueryCache.scope("db", None, "schema", "mysql")
+    prefix = "show all orders with their items, totals and shipping status placed last month by customer"
+    cache.store(f"{prefix} 1042", scope, "SELECT * FROM orders WHERE customer_id = 1042", {"rows": []}, "None.")
+
+    assert cache.lookup(f"{prefix} 1043", scope) is None
+
+
+def test_similar_hit_reuses_sql_but_not_the_result():
+    cache = make_cache()
+    scope = QueryCache.scope("db", None, "schema", "mysql")
+    cache.store(
+        "show the total revenue of every product category in the last quarter",
+        scope, "SELECT category, SUM(revenue) FROM sales GROUP BY category", {"rows": [["toys", 10]]}, "Toys: 10.",
+        markers={"sales": [1, "2024-01-01"]},
+    )
+
+    hit = cache.lookup("show the total revenue for every product category in the last quarter", scope)
+
+    assert hit is not None
+    assert hit["query"] == "SELECT category, SUM(revenue) FROM sales GROUP BY category"
+    assert "result" not in hit
+    assert "rephrasedAnswer" not in hit
+
+
+def test_exact_hit_reuses_the_result():
+    cache = make_cache()
+    scope = QueryCache.scope("db", None, "schema", "mysql")
+    cache.store("Total revenue?", scope, "SELECT SUM(revenue) FROM sales", {"rows": [[10]]}, "10.",
+                markers={"sales": [1, "2024-01-01"]})
+
+    hit = cache.lookup("total revenue", scope)
+
+    assert hit["result"] == {"rows": [[10]]}
+    assert hit["rephrasedAnswer"] == "10."
+    assert hit["markers"] == {"sales": [1, "2024-01-01"]}
+
+
+def test_result_without_markers_is_not_reused():
+    cache = make_cache()
+    scope = QueryCache.scope("db", None, "schema", "oracle")
+    cache.store("Total revenue?", scope, "SELECT SUM(revenue) FROM sales", {"rows": [[10]]}, "10.")
+
+    hit = cache.lookup("Total revenue?", scope)
+
+    assert hit["query"] == "SELECT SUM(revenue) FROM sales"
+    assert "result" not in hit
+
+
+class DictStore:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+
+def test_other_workers_reuse_published_sql_but_not_results():
+    shared = DictStore()
+    scope = QueryCache.scope("db", None, "schema", "mysql")
+    QueryCache(shared=shared).store("Total revenue?", scope, "SELECT SUM(revenue) FROM sales", {"rows": [[10]]}, "10.",
+                                    markers={"sales": [1, "2024-01-01"]})
+
+    (published,) = shared.values.values()
+    assert "result" not in published and "answer" not in published
+
+    hit = QueryCache(shared=shared).lookup("Total revenue?", scope)
+    assert hit["query"] == "SELECT SUM(revenue) FROM sales"
+    assert "result" not in hit
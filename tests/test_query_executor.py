@@ -0,0 +1,28 @@
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine
+
+from utilities.query_executor import QueryExecutor
+
+
+def make_executor(tmp_path, **options):
+    engine = create_engine(f"sqlite:///{tmp_path / 'shop.db'}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE orders (id INTEGER PRIMARY KEY, total REAL)")
+        connection.exec_driver_sql(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 30) "
+            "INSERT INTO orders (total) SELECT i FROM n"
+        )
+    return QueryExecutor(SQLDatabase(engine, lazy_table_reflection=True), page_size=4, **options)
+
+
+def test_capped_result_reports_the_total_row_count_by_default(tmp_path):
+    result = make_executor(tmp_path, max_rows=10).run("SELECT * FROM orders")
+
+    assert len(result) == 10
+    assert result.attrs["truncated"] and result.attrs["row_count"] == 30
+
+
+def test_capped_result_without_counting_leaves_the_total_unknown(tmp_path):
+    result = make_executor(tmp_path, max_rows=10, count_total=False).run("SELECT * FROM orders")
+
+    assert result.attrs["truncated"] and result.attrs["row_count"] is None
@@ -0,0 +1,77 @@
+import pandas as pd
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine
+
+from utilities.result_cache import ResultCache, canonicalize_sql, referenced_relations
+
+
+def make_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'shop.db'}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE orders (id INTEGER PRIMARY KEY, total REAL)")
+        connection.exec_driver_sql("CREATE VIEW big_orders AS SELECT * FROM orders WHERE total > 100")
+    # SQLDatabase lists the usable tables once, when it is created
+    return SQLDatabase(engine, lazy_table_reflection=True)
+
+
+def test_canonicalize_sql_ignores_formatting_but_not_values_or_identifier_case():
+    canonical, words = canonicalize_sql("select  Total -- revenue\nFROM Orders\n WHERE  id = 'A b' ;")
+
+    assert canonical == "select Total from Orders where id = 'A b'"
+    assert words == ["select", "Total", "FROM", "Orders", "WHERE", "id"]
+    assert canonicalize_sql("SELECT COUNT( * ) FROM orders /* all */")[0] == canonicalize_sql("select count(*) from orders")[0]
+    assert canonicalize_sql("SELECT * FROM orders WHERE id = 1")[0] != canonicalize_sql("SELECT * FROM orders WHERE id = 2")[0]
+    assert canonicalize_sql("SELECT * FROM orders")[0] != canonicalize_sql("SELECT * FROM ORDERS")[0]
+
+
+def test_referenced_relations_skips_ctes_subqueries_and_function_arguments():
+    assert referenced_relations("SELECT * FROM orders o, items AS i") == ["orders", "items"]
+    assert referenced_relations(
+        "WITH recent AS (SELECT * FROM orders) SELECT EXTRACT(YEAR FROM created_at) FROM recent JOIN sales.items ON 1=1"
+    ) == ["orders", "sales.items"]
+    assert referenced_relations("SELECT * FROM (SELECT * FROM orders) o, items") == ["items", "orders"]
+
+
+def test_markers_refuse_relations_without_a_marker(tmp_path):
+    cache = ResultCache(cache_dir=None)
+    db = make_database(tmp_path)
+
+    assert set(cache.markers(db, "SELECT COUNT(*) FROM orders")) == {"orders"}
+    assert cache.markers(db, "SELECT * FROM big_orders") is None
+    assert cache.markers(db, "SELECT * FROM other.orders") is None
+    assert cache.markers(db, "SELECT * FROM orders WHERE created_at > NOW()") is None
+
+
+def test_result_is_stale_when_written_while_the_query_ran(tmp_path):
+    cache = ResultCache(cache_dir=None, marker_ttl=0)
+    db = make_database(tmp_path)
+    query = "SELECT COUNT(*) FROM orders"
+
+    markers = cache.markers(db, query)
+    with db._engine.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO orders (total) VALUES (10)")
+    cache.store(db, query, pd.DataFrame({"count": [0]}), markers)
+
+    assert cache.lookup(db, query) is None
+
+
+def test_cached_result_is_served_until_its_table_changes(tmp_path):
+    cache = ResultCache(cache_dir=None, marker_ttl=0)
+    db = make_database(tmp_path)
+    query = "SELECT COUNT(*) FROM orders"
+    cache.store(db, query, pd.DataFrame({"count": [0]}), cache.markers(db, query))
+
+    assert cache.lookup(db, "select count(*)\nfrom orders;")["count"].tolist() == [0]
+    with db._engine.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO orders (total) VALUES (10)")
+    assert cache.lookup(db, query) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_cached_result_expires_after_the_ttl(tmp_path):
+    cache = ResultCache(cache_dir=None, ttl=0)
+    db = make_database(tmp_path)
+    query = "SELECT COUNT(*) FROM orders"
+    cache.store(db, query, pd.DataFrame({"count": [0]}), cache.markers(db, query))
+
+    assert cache.lookup(db, query) is None
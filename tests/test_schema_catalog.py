@@ -0,0 +1,49 @@
+import threading
+import time
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine
+
+from utilities.schema_catalog import SchemaCatalog
+
+
+def make_catalog(tmp_path, tables=()):
+    engine = create_engine(f"sqlite:///{tmp_path / 'shop.db'}")
+    with engine.begin() as connection:
+        for name in tables:
+            connection.exec_driver_sql(f"CREATE TABLE {name} (id INTEGER PRIMARY KEY)")
+    db = SQLDatabase(engine, lazy_table_reflection=True)
+    catalog = SchemaCatalog(db, cache_dir=str(tmp_path / "schema"), sample_rows=0)
+    refreshes = []
+    refresh = catalog._refresh
+
+    def counting_refresh():
+        refreshes.append(1)
+        time.sleep(0.05)
+        return refresh()
+
+    catalog._refresh = counting_refresh
+    return db, catalog, refreshes
+
+
+def test_concurrent_first_requests_reflect_the_schema_once(tmp_path):
+    db, catalog, refreshes = make_catalog(tmp_path, tables=["orders", "items"])
+
+    threads = [threading.Thread(target=catalog.ensure_fresh) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(refreshes) == 1
+    assert sorted(catalog.tables) == ["items", "orders"]
+
+
+def test_a_database_without_tables_is_not_reflected_on_every_call(tmp_path):
+    db, catalog, refreshes = make_catalog(tmp_path)
+
+    for _ in range(3):
+        catalog.ensure_fresh()
+
+    assert len(refreshes) == 1
+    assert catalog.tables == {}
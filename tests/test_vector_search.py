@@ -0,0 +1,44 @@
+from langchain.schema import Document
+
+from utilities import vector_search
+
+
+class VectorEmbeddings:
+    """Embeds the texts "x,y" as the unit vector towards (x, y)."""
+
+    @staticmethod
+    def _vector(text):
+        x, y = (float(value) for value in text.split(","))
+        norm = (x * x + y * y) ** 0.5
+        return [x / norm, y / norm]
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+def make_store():
+    # 50 chunks of "shared.txt" close to the query, 2 of "mine.txt" far from it
+    documents = [Document(page_content=f"1,{i / 1000}", metadata={"source": "shared.txt"}) for i in range(50)]
+    documents += [Document(page_content=f"{i / 10},1", metadata={"source": "mine.txt"}) for i in range(2)]
+    return vector_search.build_faiss_index(documents, VectorEmbeddings())
+
+
+def test_filtered_search_finds_chunks_outside_the_global_top_candidates():
+    store = make_store()
+
+    results = vector_search.search(store, "1,0", k=2, filter={"source": "mine.txt"}, fetch_k=20)
+
+    assert [document.metadata["source"] for document, _ in results] == ["mine.txt", "mine.txt"]
+
+
+def test_id_restricted_search_only_returns_those_chunks():
+    store = make_store()
+    ids = [doc_id for doc_id in store.index_to_docstore_id.values()
+           if store.docstore.search(doc_id).metadata["source"] == "mine.txt"]
+
+    for _ in range(20):
+        results = vector_search.search(store, "1,0", k=4, ids=ids)
+        assert {document.page_content for document, _ in results} == {"0.0,1", "0.1,1"}
@@ -4,26 +4,24 @@ ENV_FILE = find_dotenv()
 if ENV_FILE:
     load_dotenv(ENV_FILE)
 
-import pandas as pd
-import ast
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.utilities import SQLDatabase
-from langchain.chains import create_sql_query_chain
+import asyncio
+import time
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from operator import itemgetter
-
-llm = ChatGoogleGenerativeAI(model="gemini-pro", temperature=0)
-
-from langfuse.callback import CallbackHandler
-langfuse_handler = CallbackHandler(
-    secret_key=os.getenv('LANGFUSE_SECRET_KEY'),
-    public_key=os.getenv('LANGFUSE_PUBLIC_KEY'),
-    host=os.getenv('LANGFUSE_HOST'), 
-)
+from utilities.schema_catalog import database_fingerprint, get_catalog
+from utilities.table_selector import get_table_selector
+from utilities.query_cache import query_cache
+from utilities.result_cache import result_cache as shared_result_cache
+from utilities.history import get_history_manager
+from utilities.plan_guard import get_plan_guard
+from utilities.concurrency import cancellations, chain_limiter, run_blocking
+from utilities.query_executor import deserialize_result, get_query_executor, serialize_result
+from utilities.runtime import get_langfuse_handler, get_llm
+from utilities.table_selector import estimate_tokens
+from utilities.tracing import record, span
 
 sql_prompt = PromptTemplate.from_template(
     '''Given an input question/query/instruction and previous messages for context first create a syntactically correct {dialect} query to run. Do not put the query you make in markdowns as sql, keep it as simple text. Unless the user specifies in the question a specific number of examples to obtain, query for at most {top_k} results using the LIMIT clause as per {dialect}.
@@ -46,32 +44,338 @@ answer_prompt = PromptTemplate.from_template(
 )
 
 class SQLChain:
-    def __init__(self, db):
+    def __init__(self, db, llm=None, callbacks=None, cache=None, result_cache=None, catalog=None):
         self.db = db
+        self.cache = cache if cache is not None else query_cache
+        # Results are shared by every session in the process, keyed by canonical SQL
+        self.result_cache = result_cache if result_cache is not None else shared_result_cache
+        # The LLM client and Langfuse handler are process-wide and built on first use
+        self.llm = llm if llm is not None else get_llm()
+        self.callbacks = [get_langfuse_handler()] if callbacks is None else callbacks
+        self.catalog = catalog if catalog is not None else get_catalog(db)
+        self.table_selector = get_table_selector(self.catalog)
+        self.history = get_history_manager()
+        self.plan_guard = get_plan_guard(db, self.catalog)
+        self.plan_retries = int(os.getenv("SQL_PLAN_MAX_RETRIES", 2))
         self.chain = self.create_chain()
 
+    def create_query_chain(self):
+        # Same shape as langchain's create_sql_query_chain, but {table_info} is rendered
+        # from the cached schema catalog instead of reflecting the live database
+        return (
+            RunnablePassthrough.assign(
+                # plan_feedback explains why the plan guard rejected the previous attempt
+                input=lambda x: x["question"] + x.get("plan_feedback", "") + "\nSQLQuery: ",
+                table_info=lambda x: self.catalog.render(x.get("table_names_to_use")),
+                dialect=lambda x: self.db.dialect,
+            )
+            | sql_prompt
+            | self.llm.bind(stop=["\nSQLResult:"])
+            | StrOutputParser()
+            | (lambda text: text.strip())
+        )
+
     def create_chain(self):
-        SQLChain = create_sql_query_chain(llm, self.db, prompt=sql_prompt)
-        execute_query = QuerySQLDataBaseTool(db=self.db)
+        SQLChain = self.create_query_chain()
+        self.executor = get_query_executor(self.db)
+        self.execute_query = RunnableLambda(self.run_query)
+        # The answer prompt gets a compact rendering of the result frame, not the frame itself
+        self.rephrase_chain = (
+            RunnablePassthrough.assign(result=lambda x: self.executor.render(x["result"]))
+            | answer_prompt
+            | self.llm
+            | StrOutputParser()
+        )
         
-        chain = RunnablePassthrough.assign(
-            query=SQLChain
+        self.generate_chain = RunnablePassthrough.assign(
+            tableSelection=lambda x: self.table_selector.select(x["question"])
+        ).assign(
+            table_names_to_use=lambda x: x["tableSelection"]["tables"]
         ).assign(
-            result=itemgetter("query") | execute_query
+            query=SQLChain
+        )
+        self.answer_chain = RunnablePassthrough.assign(
+            result=itemgetter("query") | self.execute_query
         ).assign(
-            rephrasedAnswer= answer_prompt | llm | StrOutputParser()
+            rephrasedAnswer=self.rephrase_chain
         )
+        chain = self.generate_chain | self.answer_chain
 
         return chain
 
+    def prepare_inputs(self, question, history):
+        # Prompts get a bounded, table-free rendering of the history rather than the raw messages
+        with span("history_render", messages=len(history)) as tags:
+            message_history = self.history.render(history)
+            tags["history_tokens"] = estimate_tokens(message_history)
+        return {"question": question, "message_history": message_history, "top_k": 10}
+
+    def _generate(self, inputs, config):
+        with span("generation") as tags:
+            state = self.generate_chain.invoke(inputs, config=config)
+            tags["tables"] = len(state["tableSelection"]["tables"])
+            tags["schema_tokens"] = state["tableSelection"]["prompt_tokens"]
+            tags["schema_tokens_saved"] = state["tableSelection"]["tokens_saved"]
+        return state
+
+    def _cache_scope(self):
+        """Query cache scope of this database, or None while the catalog has no tables to scope by."""
+        self.catalog.ensure_fresh()
+        if not self.catalog.tables:
+            return None
+        return self.cache.scope(
+            database_fingerprint(self.db._engine), self.db._schema, self.catalog.schema_fingerprint, self.db.dialect,
+        )
+
+    def _cache_lookup(self, question, scope):
+        """Query cache hit for a question, without its result once the tables it read have changed."""
+        with span("cache_lookup") as tags:
+            cached = self.cache.lookup(question, scope)
+            tags["hit"] = int(cached is not None)
+        if cached and "result" in cached and self.result_cache.markers(self.db, cached["query"]) != cached["markers"]:
+            # Same freshness rule as the result cache: reuse the SQL, run it again
+            cached = {"query": cached["query"], "similarity": cached["similarity"]}
+        return cached
+
+    def _cache_store(self, question, scope, query, result, answer, markers):
+        if isinstance(result, str) and result.startswith("Error"):
+            return
+        with span("cache_store"):
+            self.cache.store(question, scope, query, serialize_result(result), answer, markers=markers)
+
+    def _cached_result(self, query):
+        with span("result_cache_lookup") as tags:
+            result = self.result_cache.lookup(self.db, query)
+            tags["hit"] = int(result is not None)
+        return result
+
+    def run_query(self, query):
+        """Execute a query, serving it from the result cache when its tables have not changed."""
+        return self._run_query(query, self.result_cache.markers(self.db, query))
+
+    def _run_query(self, query, markers):
+        """Execute a query whose change markers were read before it, caching the result under them."""
+        result = self._cached_result(query)
+        if result is None:
+            result = self.executor.run(query)
+            self.result_cache.store(self.db, query, result, markers)
+        return result
+
+    def _check_plan(self, query):
+        with span("plan_guard") as tags:
+            verdict = self.plan_guard.check(query)
+            tags["action"] = verdict["action"]
+            if verdict["stats"]:
+                tags["estimated_rows"] = verdict["stats"]["estimated_rows"]
+                if verdict["stats"]["cost"] is not None:
+                    tags["cost"] = verdict["stats"]["cost"]
+        return verdict
+
+    @staticmethod
+    def _plan_stats(verdict, regenerations):
+        return dict(verdict["stats"] or {}, action=verdict["action"], reason=verdict["reason"],
+                    regenerations=regenerations)
+
+    def _guard(self, inputs, state, config):
+        """
+        Check the generated SQL's plan before it runs.
+
+        Rejected queries are regenerated with the guard's reason in the prompt, up to
+        `plan_retries` times; rewritten ones (e.g. with an added LIMIT) replace the query.
+
+        Returns:
+            tuple: The state to execute and its plan stats (None when the guard is disabled).
+        """
+        if self.plan_guard is None:
+            return state, None
+        verdict = self._check_plan(state["query"])
+        regenerations = 0
+        while verdict["action"] == "reject" and regenerations < self.plan_retries:
+            regenerations += 1
+            feedback = self.plan_guard.feedback(state["query"], verdict)
+            state = self._generate(dict(inputs, plan_feedback=feedback), config)
+            verdict = self._check_plan(state["query"])
+        state["query"] = verdict["query"]
+        return state, self._plan_stats(verdict, regenerations)
+
+    async def _aguard(self, inputs, state, config):
+        """Async counterpart of `_guard`."""
+        if self.plan_guard is None:
+            return state, None
+        verdict = await run_blocking(self._check_plan, state["query"])
+        regenerations = 0
+        while verdict["action"] == "reject" and regenerations < self.plan_retries:
+            regenerations += 1
+            feedback = self.plan_guard.feedback(state["query"], verdict)
+            with span("generation"):
+                state = await self.generate_chain.ainvoke(dict(inputs, plan_feedback=feedback), config=config)
+            verdict = await run_blocking(self._check_plan, state["query"])
+        state["query"] = verdict["query"]
+        return state, self._plan_stats(verdict, regenerations)
+
+    @staticmethod
+    def _rejected(plan_stats):
+        return f"Error: the query was not run because {plan_stats['reason']}"
+
+    def stream_chain(self, question, history):
+        """
+        Run the chain stage by stage, yielding each stage as soon as it is ready.
+
+        Yields `(key, value)` pairs using the same keys as `invoke_chain`'s response:
+        `tableSelection` (only when SQL is generated), `planStats` (when the query is
+        about to run and the plan guard is enabled), `query`, `result` and finally
+        `rephrasedAnswer`, whose value is a generator of answer tokens. The answer is
+        cached once that generator is exhausted. While the query runs, each fetched
+        page of rows is also yielded as `resultPage` before the combined `result`.
+
+        Generation and execution, and separately the answer stream, run under the
+        process-wide `chain_limiter`, so every Streamlit session shares one cap on
+        the LLM calls and queries in flight.
+        """
+        inputs = self.prepare_inputs(question, history)
+        config = {"callbacks": self.callbacks}
+        # Generation and execution hold a slot of the process-wide limiter
+        with chain_limiter:
+            scope = self._cache_scope()
+
+            cached = self._cache_lookup(question, scope) if scope is not None else None
+            if cached:
+                # Reuse the SQL and skip the generation round trip
+                state = dict(inputs, query=cached["query"])
+            else:
+                state = self._generate(inputs, config)
+                yield "tableSelection", state["tableSelection"]
+
+            plan_stats = None
+            if not (cached and "result" in cached):
+                state, plan_stats = self._guard(inputs, state, config)
+                if plan_stats is not None:
+                    yield "planStats", plan_stats
+            yield "query", state["query"]
+
+            markers = None
+            if cached and "result" in cached:
+                state["result"] = deserialize_result(cached["result"])
+            elif plan_stats is not None and plan_stats["action"] == "reject":
+                state["result"] = self._rejected(plan_stats)
+            else:
+                # Read before the query runs, so a write committed meanwhile makes the cached result stale
+                markers = self.result_cache.markers(self.db, state["query"])
+                state["result"] = self._cached_result(state["query"])
+            if state["result"] is None:
+                # Only time spent fetching counts, not the time the caller spends rendering pages
+                stats, pages, elapsed = {}, [], 0.0
+                pages_iter = self.executor.iter_pages(state["query"], stats)
+                while True:
+                    started = time.perf_counter()
+                    page = next(pages_iter, None)
+                    elapsed += time.perf_counter() - started
+                    if page is None:
+                        break
+                    pages.append(page)
+                    yield "resultPage", page
+                state["result"] = self.executor.collect(pages, stats)
+                self.result_cache.store(self.db, state["query"], state["result"], markers)
+                record("execution", elapsed, rows=stats["fetched_rows"], truncated=int(stats["truncated"]),
+                       failed=int(bool(stats["error"])))
+            yield "result", state["result"]
+
+        def answer_tokens():
+            answer, elapsed, first_token = [], 0.0, None
+            if cached and "result" in cached:
+                answer.append(cached["rephrasedAnswer"])
+                yield cached["rephrasedAnswer"]
+            else:
+                with chain_limiter:
+                    chunks = self.rephrase_chain.stream(state, config=config)
+                    while True:
+                        started = time.perf_counter()
+                        chunk = next(chunks, None)
+                        elapsed += time.perf_counter() - started
+                        if chunk is None:
+                            break
+                        if first_token is None:
+                            first_token = elapsed
+                        answer.append(chunk)
+                        yield chunk
+            record("rephrase", elapsed, first_token_ms=round((first_token or elapsed) * 1000, 1),
+                   result_prompt_chars=len(self.executor.render(state["result"]) or ""))
+            if scope is not None and not (cached and "result" in cached):
+                # Storing a served result again would restart its TTL and republish it
+                self._cache_store(question, scope, state["query"], state["result"], "".join(answer), markers)
+
+        yield "rephrasedAnswer", answer_tokens()
 
     def invoke_chain(self, question, history):
-        response = self.chain.invoke({"question": question, "message_history": history,"top_k":10},config={"callbacks": [langfuse_handler]})
-        try:
-            if response['result'].strip():  
-                result_list = ast.literal_eval(response['result'])
-                response['result'] = pd.DataFrame(result_list)
-        except (ValueError, SyntaxError) as e:
-            print(f"Error converting result to DataFrame: {e}")
-        
+        response = {"question": question, "message_history": history}
+        for key, value in self.stream_chain(question, history):
+            if key == "resultPage":
+                continue
+            response[key] = "".join(value) if key == "rephrasedAnswer" else value
         return response
+
+    async def ainvoke_chain(self, question, history, conversation_id=None):
+        """
+        Async counterpart of `invoke_chain`.
+
+        LLM calls use the models' async APIs and the query runs on the shared
+        database thread pool, under the process-wide `chain_limiter`. Passing a
+        `conversation_id` lets `cancel_conversation` cancel the run from any thread.
+        """
+        task = asyncio.current_task()
+        cancellations.register(conversation_id, task)
+        try:
+            async with chain_limiter:
+                return await self._ainvoke_chain(question, history)
+        finally:
+            cancellations.unregister(conversation_id, task)
+
+    async def _ainvoke_chain(self, question, history):
+        inputs = self.prepare_inputs(question, history)
+        config = {"callbacks": self.callbacks}
+        # The catalog may have to reflect the schema on first use, which blocks
+        scope = await run_blocking(self._cache_scope)
+
+        cached = await run_blocking(self._cache_lookup, question, scope) if scope is not None else None
+        if cached and "result" in cached:
+            return dict(inputs, query=cached["query"], result=deserialize_result(cached["result"]),
+                        rephrasedAnswer=cached["rephrasedAnswer"])
+        if cached:
+            state = dict(inputs, query=cached["query"])
+        else:
+            with span("generation"):
+                state = await self.generate_chain.ainvoke(inputs, config=config)
+
+        state, plan_stats = await self._aguard(inputs, state, config)
+        if plan_stats is not None:
+            state["planStats"] = plan_stats
+        markers = None
+        if plan_stats is not None and plan_stats["action"] == "reject":
+            state["result"] = self._rejected(plan_stats)
+        else:
+            with span("execution") as tags:
+                markers = await run_blocking(self.result_cache.markers, self.db, state["query"])
+                state["result"] = await run_blocking(self._run_query, state["query"], markers)
+                tags["rows"] = len(state["result"]) if not isinstance(state["result"], str) else 0
+        with span("rephrase"):
+            state["rephrasedAnswer"] = await self.rephrase_chain.ainvoke(state, config=config)
+
+        if scope is not None:
+            await run_blocking(self._cache_store, question, scope, state["query"], state["result"],
+                               state["rephrasedAnswer"], markers)
+        return state
+
+    async def abatch_invoke_chain(self, questions, history, conversation_id=None):
+        """Answer independent questions concurrently; failures are returned in place of their response."""
+        return await asyncio.gather(
+            *(self.ainvoke_chain(question, history, conversation_id) for question in questions),
+            return_exceptions=True,
+        )
+
+    def batch_invoke_chain(self, questions, history, conversation_id=None):
+        return asyncio.run(self.abatch_invoke_chain(questions, history, conversation_id))
+
+    @staticmethod
+    def cancel_conversation(conversation_id):
+        return cancellations.cancel(conversation_id)
+
@@ -0,0 +1,157 @@
+import asyncio
+import collections
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class _AsyncWaiter:
+    """A coroutine waiting for a limiter slot; `set` may be called from any thread."""
+
+    def __init__(self, limiter, loop):
+        self.limiter = limiter
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def set(self):
+        try:
+            self.loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # The waiting loop is closed; pass the slot on
+            self.limiter.release()
+
+    def _wake(self):
+        if self.future.cancelled():
+            self.limiter.release()
+        else:
+            self.future.set_result(None)
+
+
+class ConcurrencyLimiter:
+    """
+    Process-wide cap on the number of chain runs in flight.
+
+    Streamlit runs every session in its own thread, and each `asyncio.run` call
+    gets its own event loop, so an `asyncio.Semaphore` would only limit a single
+    loop. This limiter can be entered from both sync code and any event loop.
+    Waiters are served in arrival order: a released slot is handed straight to
+    the longest waiting thread or coroutine, and coroutines wait on a future of
+    their own loop instead of polling.
+
+    Args:
+        limit (int): Maximum number of concurrent holders.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._active = 0
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+
+    def _enqueue(self, waiter):
+        """Take a free slot and return None, or queue `waiter` and return it."""
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return None
+            self._waiters.append(waiter)
+            return waiter
+
+    def acquire(self):
+        waiter = self._enqueue(threading.Event())
+        if waiter is not None:
+            waiter.wait()
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self._active -= 1
+                return
+            # The slot passes to the next waiter without becoming free in between
+            waiter = self._waiters.popleft()
+        waiter.set()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def __aenter__(self):
+        waiter = self._enqueue(_AsyncWaiter(self, asyncio.get_running_loop()))
+        if waiter is None:
+            return self
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+            if not queued and waiter.future.done() and not waiter.future.cancelled():
+                # The slot was handed over just as the task was cancelled
+                self.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class CancellationRegistry:
+    """Track the running tasks of each conversation so they can be cancelled from any thread."""
+
+    def __init__(self):
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def register(self, conversation_id, task):
+        if conversation_id is None:
+            return
+        with self._lock:
+            self._tasks.setdefault(conversation_id, set()).add((task.get_loop(), task))
+
+    def unregister(self, conversation_id, task):
+        if conversation_id is None:
+            return
+        with self._lock:
+            tasks = self._tasks.get(conversation_id, set())
+            tasks.discard((task.get_loop(), task))
+            if not tasks:
+                self._tasks.pop(conversation_id, None)
+
+    def cancel(self, conversation_id):
+        """
+        Cancel every running task of a conversation.
+
+        Args:
+            conversation_id (str): Conversation whose tasks to cancel.
+
+        Returns:
+            int: Number of tasks a cancellation was requested for.
+        """
+        with self._lock:
+            tasks = list(self._tasks.get(conversation_id, ()))
+        for loop, task in tasks:
+            loop.call_soon_threadsafe(task.cancel)
+        return len(tasks)
+
+
+# Sync database drivers run here so a slow query never blocks an event loop
+db_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SQL_EXECUTOR_WORKERS", 8)),
+    thread_name_prefix="querybot-db",
+)
+chain_limiter = ConcurrencyLimiter(int(os.getenv("SQL_MAX_CONCURRENT_CHAINS", 16)))
+cancellations = CancellationRegistry()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the shared database thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
@@ -1,36 +1,187 @@
 import pandas as pd
 import os
 import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
 from langchain_google_genai import GoogleGenerativeAI
 from langchain.prompts import PromptTemplate
 
-def process_csv(files):
+from utilities.data_profiler import content_hash, profile_cache, render_profile
+from utilities.uploads import file_digest, file_label, rewind
+
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
+INSIGHTS_TOKEN_BUDGET = int(os.getenv("INSIGHTS_TOKEN_BUDGET", 2000))
+
+# Nullable dtypes, so a column that is all-integer in the sample can still hold gaps in other files
+ENFORCEABLE_DTYPES = {"int64": "Int64", "float64": "float64", "bool": "boolean"}
+
+
+def _unique_label(label, taken):
+    """`label`, or `label (2)`, `label (3)`... when an earlier upload had the same name."""
+    candidate, suffix = label, 2
+    while candidate in taken:
+        candidate, suffix = f"{label} ({suffix})", suffix + 1
+    return candidate
+
+
+def infer_dtypes(file, sample_rows=1000):
+    """
+    Infer column dtypes once from the head of a CSV file.
+
+    Only numeric and boolean columns are pinned; text and date-like columns are left
+    to the parser.
+
+    Args:
+        file (str or file-like): CSV file to sample.
+        sample_rows (int): Number of rows to sample.
+
+    Returns:
+        dict: Mapping of column name to the dtype to enforce.
+    """
+    rewind(file)
+    sample = pd.read_csv(file, nrows=sample_rows)
+    rewind(file)
+    return {
+        column: ENFORCEABLE_DTYPES[str(dtype)]
+        for column, dtype in sample.dtypes.items()
+        if str(dtype) in ENFORCEABLE_DTYPES
+    }
+
+
+def _read_csv(file, dtypes):
+    rewind(file)
+    try:
+        return pd.read_csv(file, dtype=dtypes, engine=CSV_ENGINE)
+    except (ValueError, TypeError) as e:
+        # A later file does not fit the sampled dtypes; let pandas infer this one
+        print(f"Inferred dtypes do not fit {file_label(file)}, re-reading without them: {e}")
+        rewind(file)
+        return pd.read_csv(file, engine=CSV_ENGINE)
+
+
+def read_csv_files(files, max_workers=None, sample_rows=1000):
+    """
+    Parse CSV files in parallel, using dtypes inferred once from the first file.
+
+    Args:
+        files (list of str or file-like): List of file paths or uploaded CSV files.
+        max_workers (int or None): Number of files parsed concurrently. Defaults to one per CPU.
+        sample_rows (int): Rows of the first file sampled for dtype inference.
+
+    Returns:
+        list of (str, pd.DataFrame): One pair per parsed file, in upload order. Labels are
+        the file names, made unique with a " (2)", " (3)"... suffix.
+    """
+    frames = []
+    if not files:
+        return frames
+
+    try:
+        dtypes = infer_dtypes(files[0], sample_rows)
+    except Exception as e:
+        print(f"Error inferring dtypes from {file_label(files[0])}: {e}")
+        dtypes = {}
+
+    def read(file):
+        try:
+            df = _read_csv(file, dtypes)
+            # Lets process_csv report a cache key for the profile without hashing the parsed rows
+            df.attrs["content_hash"] = content_hash(file_digest(file), sorted(dtypes.items()))
+            return file, df, None
+        except Exception as e:
+            return file, None, e
+
+    labels = set()
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        for file, df, error in executor.map(read, files):
+            if error is not None:
+                print(f"Error processing file {file_label(file)}: {error}")
+                continue
+            label = _unique_label(file_label(file), labels)
+            labels.add(label)
+            frames.append((label, df))
+            print(f"Processed file: {label} with {df.shape[0]} rows and {df.shape[1]} columns.")
+    return frames
+
+
+def process_csv(files, max_workers=None, sample_rows=1000):
     """
     Process a list of CSV files and combine their data into a single DataFrame.
 
+    Files are parsed in parallel (with pyarrow's multithreaded parser when it is
+    installed), using dtypes inferred once from the first file, and combined with
+    a single concat.
+
     Args:
-        files (list of str): List of file paths to the CSV files.
+        files (list of str or file-like): List of file paths or uploaded CSV files.
+        max_workers (int or None): Number of files parsed concurrently. Defaults to one per CPU.
+        sample_rows (int): Rows of the first file sampled for dtype inference.
 
     Returns:
         combined_df (pd.DataFrame): Combined DataFrame containing data from all files.
         dfs (list of pd.DataFrame): List of individual DataFrames for each file.
-        report (dict): Summary report of the number of rows and columns from each file.
+        report (dict): Summary report of the number of rows and columns from each file, keyed
+                       by the labels `read_csv_files` returns. Each entry's `content_hash` is the
+                       `cache_key` to pass to `generate_insights` for that file; `combined_df`'s
+                       key is `content_hash` over all of them, in order.
     """
-    combined_df = pd.DataFrame()
-    dfs = []
-    report = {}
+    frames = read_csv_files(files, max_workers, sample_rows)
+    dfs = [df for _, df in frames]
+    report = {
+        label: {"rows": df.shape[0], "columns": df.shape[1], "content_hash": df.attrs["content_hash"]}
+        for label, df in frames
+    }
+    combined_df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+    return combined_df, dfs, report
 
+
+def iter_csv_batches(files, chunksize=100_000, sample_rows=1000):
+    """
+    Stream CSV files as fixed-size batches instead of loading them whole.
+
+    Args:
+        files (list of str or file-like): List of file paths or uploaded CSV files.
+        chunksize (int): Rows per batch.
+        sample_rows (int): Rows of the first file sampled for dtype inference.
+
+    Yields:
+        tuple: (file label, pd.DataFrame batch)
+    """
+    dtypes = infer_dtypes(files[0], sample_rows) if files else {}
     for file in files:
-        try:
-            df = pd.read_csv(file)
-            dfs.append(df)
-            combined_df = pd.concat([combined_df, df], ignore_index=True)
-            report[file] = {"rows": df.shape[0], "columns": df.shape[1]}
-            print(f"Processed file: {file} with {df.shape[0]} rows and {df.shape[1]} columns.")
-        except Exception as e:
-            print(f"Error processing file {file}: {e}")
+        rewind(file)
+        for batch in pd.read_csv(file, dtype=dtypes, chunksize=chunksize):
+            yield file_label(file), batch
 
-    return combined_df, dfs, report
+
+def spill_csv_batches(files, spill_dir, chunksize=100_000, sample_rows=1000):
+    """
+    Stream CSV files to Parquet batches on disk so their combined size is not bounded by RAM.
+
+    Args:
+        files (list of str or file-like): List of file paths or uploaded CSV files.
+        spill_dir (str): Directory the Parquet batches are written to.
+        chunksize (int): Rows per batch.
+        sample_rows (int): Rows of the first file sampled for dtype inference.
+
+    Returns:
+        paths (list of str): Parquet files written, in order.
+        report (dict): Summary report of the number of rows and columns from each file.
+    """
+    os.makedirs(spill_dir, exist_ok=True)
+    paths = []
+    report = {}
+    for index, (label, batch) in enumerate(iter_csv_batches(files, chunksize, sample_rows)):
+        path = os.path.join(spill_dir, f"batch-{index:06d}.parquet")
+        batch.to_parquet(path, index=False)
+        paths.append(path)
+        file_report = report.setdefault(label, {"rows": 0, "columns": batch.shape[1]})
+        file_report["rows"] += batch.shape[0]
+    return paths, report
 
 def plot_summary(report):
     """
@@ -61,13 +212,20 @@ def plot_summary(report):
     plt.title('Summary of Processed CSV Files')
     plt.show()
 
-def generate_insights(query, df):
+def generate_insights(query, df, token_budget=None, cache_key=None):
     """
     Generate insights based on the provided query and DataFrame.
 
+    The prompt carries a profile of the data (column statistics, top values, histograms,
+    correlations and a stratified sample) rendered within `token_budget`, not the rows
+    themselves, so its size does not grow with the row count.
+
     Args:
         query (str): The query for generating insights.
         df (pd.DataFrame): The DataFrame containing the data.
+        token_budget (int or None): Token budget of the data profile. Defaults to `INSIGHTS_TOKEN_BUDGET`.
+        cache_key (str or None): Content hash of the source file, from the `process_csv` report;
+            computed from every row of `df` when omitted.
 
     Returns:
         str: Generated insights.
@@ -80,10 +238,11 @@ def generate_insights(query, df):
 
     # Define prompt template
     prompt_template = """
-    Using the following data, answer the query as accurately as possible. If the query cannot be answered with the provided data, 
-    please state "The query cannot be answered with the provided data."
+    Using the following data profile, answer the query as accurately as possible. The profile summarizes
+    the full data set; the sample rows are only a subset of it. If the query cannot be answered with the
+    provided data, please state "The query cannot be answered with the provided data."
 
-    Data:\n {data}
+    Data profile:\n {data}
 
     Query: {query}
 
@@ -91,8 +250,9 @@ def generate_insights(query, df):
     """
     prompt = PromptTemplate(template=prompt_template, input_variables=["data", "query"])
 
-    # Format the DataFrame as a string for the prompt
-    data_string = df.to_string()
+    # Summarize the DataFrame; profiles are cached per content hash
+    profile = profile_cache.get(df, cache_key=cache_key)
+    data_string = render_profile(profile, token_budget or INSIGHTS_TOKEN_BUDGET)
 
     # Prepare the input for the LLM
     input_variables = {"data": data_string, "query": query}
@@ -102,4 +262,3 @@ def generate_insights(query, df):
     response = llm(prompt_text)
 
     return response
-
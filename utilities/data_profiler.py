@@ -0,0 +1,239 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utilities.table_selector import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CACHE_DIR = os.getenv("PROFILE_CACHE_DIR", os.path.join(".cache", "profiles"))
+
+
+def dataframe_hash(df):
+    """Content hash of a DataFrame, including its column names."""
+    digest = hashlib.sha256(",".join(map(str, df.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def content_hash(*parts):
+    """
+    Cache key of data read from files, cheaper than `dataframe_hash` of the parsed frame.
+
+    Args:
+        *parts (bytes or str): File contents and anything else that changes the parsed
+            frame, e.g. the dtypes it was read with, or the hashes of concatenated files.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def _scalar(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return None if np.isnan(value) else round(value, 4)
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value if isinstance(value, (int, str, bool)) or value is None else str(value)
+
+
+def _stratified_sample(df, sample_rows):
+    """Sample rows spread across the groups of the lowest-cardinality categorical column."""
+    if len(df) <= sample_rows:
+        return df
+    candidates = []
+    for column in df.columns:
+        if df[column].dtype == object or isinstance(df[column].dtype, pd.CategoricalDtype):
+            distinct = df[column].nunique(dropna=True)
+            if 2 <= distinct <= sample_rows:
+                candidates.append((distinct, column))
+    pool = df.sample(min(len(df), sample_rows * 20), random_state=0)
+    if not candidates:
+        return pool.head(sample_rows)
+    groups, column = min(candidates, key=lambda candidate: candidate[0])
+    per_group = max(1, sample_rows // groups)
+    return pool.groupby(column, dropna=False, sort=False).head(per_group).head(sample_rows)
+
+
+def profile_dataframe(df, top_values=5, bins=10, sample_rows=10, max_correlations=10):
+    """
+    Compute a compact, vectorized profile of a DataFrame.
+
+    Args:
+        df (pd.DataFrame): Data to profile.
+        top_values (int): Most frequent values kept per text column.
+        bins (int): Histogram bins per numeric column.
+        sample_rows (int): Rows in the stratified sample.
+        max_correlations (int): Strongest numeric correlations kept.
+
+    Returns:
+        dict: JSON-serializable profile with `rows`, `columns`, `correlations` and `sample`.
+    """
+    columns = []
+    numeric = df.select_dtypes(include="number")
+    nulls = df.isna().sum()
+    for name in df.columns:
+        series = df[name]
+        column = {
+            "name": str(name),
+            "dtype": str(series.dtype),
+            "nulls": int(nulls[name]),
+            "distinct": int(series.nunique(dropna=True)),
+        }
+        values = series.dropna()
+        if name in numeric.columns and not values.empty and series.dtype != bool:
+            quantiles = values.quantile([0.25, 0.5, 0.75]).tolist()
+            finite = values.astype(float)
+            # np.histogram rejects an infinite range; the infinities still show in min and max
+            finite = finite[np.isfinite(finite)]
+            counts, edges = np.histogram(finite, bins=bins) if not finite.empty else (np.array([], dtype=int), [])
+            column.update(
+                min=_scalar(values.min()), max=_scalar(values.max()),
+                mean=_scalar(values.mean()), std=_scalar(values.std()),
+                quartiles=[_scalar(q) for q in quantiles],
+                histogram={"edges": [_scalar(e) for e in edges], "counts": counts.tolist()},
+            )
+        elif pd.api.types.is_datetime64_any_dtype(series) and not values.empty:
+            column.update(min=_scalar(values.min()), max=_scalar(values.max()))
+        elif not values.empty:
+            counts = values.astype(str).value_counts().head(top_values)
+            column["top_values"] = [[value, int(count)] for value, count in counts.items()]
+        columns.append(column)
+
+    correlations = []
+    if numeric.shape[1] > 1:
+        matrix = numeric.corr().to_numpy()
+        upper = np.triu_indices_from(matrix, k=1)
+        pairs = sorted(
+            ((matrix[i, j], numeric.columns[i], numeric.columns[j]) for i, j in zip(*upper) if not np.isnan(matrix[i, j])),
+            key=lambda pair: -abs(pair[0]),
+        )
+        correlations = [[str(a), str(b), round(float(r), 3)] for r, a, b in pairs[:max_correlations]]
+
+    sample = _stratified_sample(df, sample_rows)
+    return {
+        "rows": int(len(df)),
+        "columns": columns,
+        "correlations": correlations,
+        "sample": sample.to_csv(index=False),
+    }
+
+
+def render_profile(profile, token_budget=2000):
+    """
+    Render a profile as prompt text within a token budget.
+
+    Sections are added in priority order (overview, column summaries, correlations,
+    histograms, sample rows) and whatever does not fit the budget is left out.
+
+    Args:
+        profile (dict): Profile returned by `profile_dataframe`.
+        token_budget (int): Maximum tokens of the rendered text.
+
+    Returns:
+        str: Compact description of the data.
+    """
+    lines = [f"{profile['rows']} rows, {len(profile['columns'])} columns."]
+    for column in profile["columns"]:
+        line = f"- {column['name']} ({column['dtype']}, {column['nulls']} nulls, {column['distinct']} distinct)"
+        if "mean" in column:
+            line += (f": min {column['min']}, max {column['max']}, mean {column['mean']}, std {column['std']}, "
+                     f"quartiles {column['quartiles']}")
+        elif "min" in column:
+            line += f": from {column['min']} to {column['max']}"
+        elif "top_values" in column:
+            line += ": top " + ", ".join(f"{value} ({count})" for value, count in column["top_values"])
+        lines.append(line)
+
+    optional = []
+    if profile["correlations"]:
+        optional.append("Strongest correlations:\n" + "\n".join(
+            f"- {a} ~ {b}: {r}" for a, b, r in profile["correlations"]
+        ))
+    histograms = [
+        f"- {column['name']}: edges {column['histogram']['edges']}, counts {column['histogram']['counts']}"
+        for column in profile["columns"] if "histogram" in column
+    ]
+    if histograms:
+        optional.append("Histograms:\n" + "\n".join(histograms))
+    optional.append(f"Sample rows:\n{profile['sample']}")
+
+    text = "Column summary:\n" + "\n".join(lines)
+    if estimate_tokens(text) > token_budget:
+        return text[:token_budget * 4] + "\n..."
+    for section in optional:
+        candidate = f"{text}\n\n{section}"
+        if estimate_tokens(candidate) <= token_budget:
+            text = candidate
+    return text
+
+
+class ProfileCache:
+    """
+    Profiles keyed by DataFrame content hash, in an in-process LRU backed by JSON files.
+
+    Args:
+        cache_dir (str or None): Directory profiles are persisted in. None keeps them in memory only.
+        max_entries (int): Profiles kept in memory.
+    """
+
+    def __init__(self, cache_dir=PROFILE_CACHE_DIR, max_entries=64):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, df, cache_key=None, **profile_options):
+        """
+        Return the profile of a DataFrame, computing it only on a cache miss.
+
+        Args:
+            df (pd.DataFrame): Data to profile.
+            cache_key (str or None): Precomputed content hash, e.g. the `content_hash` the CSV and
+                Excel processors report per file. Hashing `df` instead costs a pass over every row.
+            **profile_options: Passed to `profile_dataframe`.
+        """
+        key = cache_key or dataframe_hash(df)
+        if profile_options:
+            key += "-" + hashlib.sha1(json.dumps(profile_options, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        path = os.path.join(self.cache_dir, f"{key}.json") if self.cache_dir else None
+        profile = None
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    profile = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable profile {path}: {e}")
+        if profile is None:
+            profile = profile_dataframe(df, **profile_options)
+            if path:
+                try:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    with open(path, "w", encoding="utf-8") as f:
+                        json.dump(profile, f)
+                except OSError as e:
+                    logger.warning(f"Could not persist profile {path}: {e}")
+
+        with self._lock:
+            self.entries[key] = profile
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return profile
+
+
+profile_cache = ProfileCache()
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.vectorstores import FAISS
+
+from utilities import vector_search
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_INDEX_DIR = os.getenv("DOCUMENT_INDEX_DIR", os.path.join(".cache", "document_index"))
+DOCUMENT_INDEX_MAX_CHUNKS = int(os.getenv("DOCUMENT_INDEX_MAX_CHUNKS", 200000))
+MANIFEST_FILE = "manifest.json"
+# Bumped when the manifest layout changes, so an old index is rebuilt instead of misread
+MANIFEST_VERSION = 2
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:24]
+
+
+class DocumentIndex:
+    """
+    FAISS index of document chunks persisted to disk and updated incrementally.
+
+    Source documents are keyed by their content hash, not their file name, so the
+    index is shared safely by every session: two uploads called `notes.txt` are two
+    sources, and the same text uploaded twice is split and embedded once. Searches
+    are restricted to the hashes a caller synced. When the index grows past
+    `max_chunks`, the least recently synced sources are evicted. The chunk vectors
+    plus docstore are saved with `FAISS.save_local` next to a JSON manifest.
+
+    Args:
+        index_dir (str): Directory the index and manifest live in.
+        embedding (Embeddings): Embedding model used for chunks and queries.
+        embedding_name (str): Identifies the embedding model; a change discards the index.
+        chunk_size (int): Characters per chunk.
+        chunk_overlap (int): Characters shared by consecutive chunks.
+        max_chunks (int): Chunks kept before least recently synced sources are evicted.
+    """
+
+    def __init__(self, index_dir, embedding, embedding_name="", chunk_size=1500, chunk_overlap=150,
+                 max_chunks=DOCUMENT_INDEX_MAX_CHUNKS):
+        self.index_dir = index_dir
+        self.embedding = embedding
+        self.settings = {"version": MANIFEST_VERSION, "embedding": embedding_name, "chunk_size": chunk_size,
+                         "chunk_overlap": chunk_overlap}
+        self.max_chunks = max_chunks
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+        )
+        self.store = None
+        # Content hash -> chunk ids, least recently synced first
+        self.sources = OrderedDict()
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        manifest_path = os.path.join(self.index_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("settings") != self.settings:
+                logger.info(f"Document index settings changed, rebuilding {self.index_dir}")
+                return
+            if manifest["sources"]:
+                self.store = vector_search.load_faiss_index(self.index_dir, self.embedding)
+            self.sources = OrderedDict(manifest["sources"])
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable document index {self.index_dir}: {e}")
+            self.store, self.sources = None, OrderedDict()
+
+    def _save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        if self.store is not None:
+            self.store.save_local(self.index_dir)
+        tmp_path = os.path.join(self.index_dir, f"{MANIFEST_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": self.settings, "sources": list(self.sources.items())}, f)
+        os.replace(tmp_path, os.path.join(self.index_dir, MANIFEST_FILE))
+
+    def _split(self, document, digest):
+        chunks = self.splitter.split_documents([document])
+        for chunk in chunks:
+            chunk.metadata["doc_hash"] = digest
+        return chunks
+
+    def _evict(self, keep):
+        """Drop least recently synced sources, other than `keep`, until at most `max_chunks` remain."""
+        total = sum(len(ids) for ids in self.sources.values())
+        stale_ids = []
+        for digest in list(self.sources):
+            if total <= self.max_chunks:
+                break
+            if digest in keep:
+                continue
+            ids = self.sources.pop(digest)
+            stale_ids += ids
+            total -= len(ids)
+        return stale_ids
+
+    def sync(self, documents):
+        """
+        Make sure `documents` are indexed, embedding only those whose content is new.
+
+        Args:
+            documents (list of Document): Source documents.
+
+        Returns:
+            list of str: Content hashes of `documents`, usable as a search filter.
+        """
+        with self._lock:
+            hashes, chunks, added = [], [], {}
+            for document in documents:
+                digest = content_hash(document.page_content)
+                hashes.append(digest)
+                if digest in self.sources:
+                    self.sources.move_to_end(digest)
+                    continue
+                if digest in added:
+                    continue
+                split = self._split(document, digest)
+                added[digest] = [f"{digest}-{i}" for i in range(len(split))]
+                chunks += split
+
+            if not chunks:
+                return hashes
+
+            ids = [chunk_id for chunk_ids in added.values() for chunk_id in chunk_ids]
+            # Vectors and docstore are only touched once every chunk embedded, so a failed
+            # embedding call leaves the index as it was
+            if self.store is None:
+                self.store = FAISS.from_documents(chunks, self.embedding, ids=ids)
+            else:
+                self.store.add_documents(chunks, ids=ids)
+            self.sources.update(added)
+            stale_ids = self._evict(set(hashes))
+            if stale_ids:
+                self.store.delete(stale_ids)
+            self._save()
+            logger.info(f"Document index: embedded {len(chunks)} chunks from {len(added)} documents, "
+                        f"evicted {len(stale_ids)} least recently used chunks")
+            return hashes
+
+    def search(self, query, k=4, doc_hashes=None, **options):
+        """
+        Return the `k` chunks most similar to `query`.
+
+        Args:
+            query (str): Search text.
+            k (int): Number of chunks returned.
+            doc_hashes (list of str or None): Restrict results to these source documents.
+            **options: Passed to `vector_search.search`, e.g. `score_threshold` or `mmr`.
+        """
+        with self._lock:
+            if self.store is None:
+                return []
+            ids = None
+            if doc_hashes is not None:
+                ids = [chunk_id for digest in dict.fromkeys(doc_hashes) for chunk_id in self.sources.get(digest, ())]
+            return [document for document, _ in vector_search.search(self.store, query, k=k, ids=ids, **options)]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_document_index(embedding, embedding_name, index_dir=None, **options):
+    """
+    Process-wide `DocumentIndex` per directory, loaded from disk once.
+
+    Args:
+        embedding (Embeddings): Embedding model used for chunks and queries.
+        embedding_name (str): Identifies the embedding model.
+        index_dir (str or None): Directory of the index. Defaults to `DOCUMENT_INDEX_DIR`.
+        **options: Passed to `DocumentIndex`.
+    """
+    index_dir = index_dir or DOCUMENT_INDEX_DIR
+    with _indexes_lock:
+        index = _indexes.get(index_dir)
+        if index is None:
+            index = _indexes[index_dir] = DocumentIndex(index_dir, embedding, embedding_name, **options)
+        return index
@@ -0,0 +1,197 @@
+import functools
+import hashlib
+import logging
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 100))
+EMBEDDING_BATCH_CHARS = int(os.getenv("EMBEDDING_BATCH_CHARS", 60_000))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 5))
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic local embedder for tests and offline runs.
+
+    Words and word bigrams are hashed into a fixed number of signed buckets and the
+    vector is L2-normalized, so similar texts still land close together without any
+    model or network access.
+
+    Args:
+        dimensions (int): Vector size.
+    """
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+
+    def _embed(self, text):
+        words = re.findall(r"\w+", text.lower())
+        vector = [0.0] * self.dimensions
+        for term in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embedding service with a content-addressed cache in front of a remote model.
+
+    Texts are deduplicated by hash and looked up in a SQLite cache; only the misses
+    are sent to the model, in batches bounded by count and characters, several batches
+    at a time, with exponential backoff on errors.
+
+    Args:
+        base (Embeddings): Model that computes missing vectors.
+        model_name (str): Part of the cache key, so vectors of different models never mix.
+        path (str or None): SQLite cache file. None keeps the cache in memory.
+        batch_size (int): Maximum texts per model call.
+        batch_chars (int): Maximum characters per model call.
+        max_concurrency (int): Model calls in flight at once.
+        max_retries (int): Attempts per batch before the error is raised.
+    """
+
+    def __init__(self, base, model_name, path=EMBEDDING_CACHE_PATH, batch_size=EMBEDDING_BATCH_SIZE,
+                 batch_chars=EMBEDDING_BATCH_CHARS, max_concurrency=EMBEDDING_CONCURRENCY,
+                 max_retries=EMBEDDING_MAX_RETRIES):
+        self.base = base
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.batch_chars = batch_chars
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._connection.commit()
+
+    def key(self, text, kind="document"):
+        return hashlib.sha256(f"{self.model_name}|{kind}|{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((key, array("f", vector).tolist()) for key, vector in rows)
+        return found
+
+    def _store(self, vectors):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in vectors.items()],
+            )
+            self._connection.commit()
+
+    def _batches(self, items):
+        batch, chars = [], 0
+        for key, text in items:
+            if batch and (len(batch) >= self.batch_size or chars + len(text) > self.batch_chars):
+                yield batch
+                batch, chars = [], 0
+            batch.append((key, text))
+            chars += len(text)
+        if batch:
+            yield batch
+
+    def _embed_batch(self, batch):
+        for attempt in range(self.max_retries):
+            try:
+                vectors = self.base.embed_documents([text for _, text in batch])
+                return {key: vector for (key, _), vector in zip(batch, vectors)}
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                delay = min(30.0, 2 ** attempt) * (0.5 + random.random())
+                logger.warning(f"Embedding batch of {len(batch)} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def embed_documents(self, texts):
+        keys = [self.key(text) for text in texts]
+        unique = dict(zip(keys, texts))
+        vectors = self._lookup(list(unique))
+        missing = [(key, text) for key, text in unique.items() if key not in vectors]
+        self.hits += len(unique) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                for computed in executor.map(self._embed_batch, self._batches(missing)):
+                    # Store as batches complete so an interrupted run keeps its progress
+                    self._store(computed)
+                    vectors.update(computed)
+            logger.info(f"Embedded {len(missing)} texts in {time.perf_counter() - started:.1f}s, "
+                        f"{len(unique) - len(missing)} served from cache")
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self.key(text, kind="query")
+        vector = self._lookup([key]).get(key)
+        if vector is None:
+            vector = self.base.embed_query(text)
+            self._store({key: vector})
+        return vector
+
+
+def _base_embeddings(backend):
+    if backend == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        model = "models/embedding-001"
+        return GoogleGenerativeAIEmbeddings(model=model), f"google:{model}"
+    if backend == "openai":
+        from langchain.embeddings import OpenAIEmbeddings
+        embeddings = OpenAIEmbeddings()
+        return embeddings, f"openai:{embeddings.model}"
+    if backend == "hashing":
+        return HashingEmbeddings(), "hashing:384"
+    raise ValueError(f"Unsupported embedding backend: {backend}")
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_embeddings(backend):
+    base, name = _base_embeddings(backend)
+    return CachedEmbeddings(base, name)
+
+
+def get_embeddings(backend="google"):
+    """
+    Process-wide cached embedding service.
+
+    Args:
+        backend (str): "google", "openai" or "hashing". The EMBEDDING_BACKEND environment
+            variable overrides it, e.g. to run everything offline with "hashing".
+
+    Returns:
+        CachedEmbeddings: Embeddings whose `model_name` identifies the model.
+    """
+    return _cached_embeddings(os.getenv("EMBEDDING_BACKEND") or backend)
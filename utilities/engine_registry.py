@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+import weakref
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+from utilities.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class _RegistryEntry:
+    def __init__(self, engine, database):
+        self.engine = engine
+        # Strong reference while the entry is in use; dropped once it goes idle
+        self.database = database
+        self.database_ref = weakref.ref(database)
+        # The pool is closed once the last holder (the registry or a chain) lets go of the database
+        weakref.finalize(database, engine.dispose)
+        self.last_used = time.monotonic()
+        self.last_ping = time.monotonic()
+
+    def get(self):
+        return self.database if self.database is not None else self.database_ref()
+
+
+class EngineRegistry:
+    """
+    Process-wide registry of SQLAlchemy engines and their `SQLDatabase` wrappers.
+
+    Streamlit reruns the whole script on every message, but imported modules
+    survive reruns, so keeping the registry at module level lets every session
+    of the process that points at the same database share one engine and one
+    connection pool. Tables are reflected lazily; `SchemaCatalog` owns reflection.
+
+    Engines are created under a per-URI lock, so a slow or unreachable database
+    only blocks the sessions that use it. Idle engines are released rather than
+    disposed: a chain still holding the database keeps the pool alive, and the
+    pool is closed once the last holder goes away.
+
+    Args:
+        pool_size (int): Connections kept open per engine.
+        max_overflow (int): Extra connections allowed under burst load.
+        pool_recycle (int): Seconds after which pooled connections are recycled.
+        idle_timeout (int): Seconds without use after which an engine is disposed.
+        ping_interval (int): Minimum seconds between health-check pings of an engine.
+    """
+
+    def __init__(self, pool_size=5, max_overflow=5, pool_recycle=1800, idle_timeout=900, ping_interval=60):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_recycle = pool_recycle
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self._entries = {}
+        self._uri_locks = {}
+        self._lock = threading.Lock()
+
+    def _create_engine(self, db_uri):
+        url = make_url(db_uri)
+        engine_kwargs = {"pool_pre_ping": True}
+        if url.get_backend_name() != "sqlite":
+            engine_kwargs.update(
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_recycle=self.pool_recycle,
+            )
+        return create_engine(url, **engine_kwargs)
+
+    def _ping(self, entry):
+        with entry.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        entry.last_ping = time.monotonic()
+
+    def _uri_lock(self, db_uri):
+        with self._lock:
+            return self._uri_locks.setdefault(db_uri, threading.Lock())
+
+    def get_database(self, db_uri):
+        """
+        Return the shared `SQLDatabase` for a connection URI, creating it on first use.
+
+        Args:
+            db_uri (str): SQLAlchemy connection URI.
+
+        Returns:
+            SQLDatabase: Database wrapper backed by a pooled, health-checked engine.
+        """
+        self.evict_idle()
+        with self._uri_lock(db_uri):
+            with self._lock:
+                entry = self._entries.get(db_uri)
+            database = entry.get() if entry is not None else None
+            if database is not None and time.monotonic() - entry.last_ping > self.ping_interval:
+                try:
+                    self._ping(entry)
+                except Exception as e:
+                    logger.warning(f"Health check failed for {entry.engine.url!r}, reconnecting: {e}")
+                    entry.engine.dispose()
+                    database = None
+
+            if database is None:
+                # Imported here so langchain_community is only loaded once a database is opened
+                from langchain_community.utilities import SQLDatabase
+                with span("db_connect"):
+                    engine = self._create_engine(db_uri)
+                    database = SQLDatabase(engine, lazy_table_reflection=True)
+                entry = _RegistryEntry(engine, database)
+                logger.info(f"Created engine for {engine.url!r}")
+
+            entry.database = database
+            entry.last_used = time.monotonic()
+            with self._lock:
+                self._entries[db_uri] = entry
+            return database
+
+    def evict_idle(self):
+        """Release engines that have not been used for longer than `idle_timeout`."""
+        now = time.monotonic()
+        with self._lock:
+            for db_uri, entry in list(self._entries.items()):
+                if entry.database is not None and now - entry.last_used > self.idle_timeout:
+                    entry.database = None
+                    logger.info(f"Released idle engine for {entry.engine.url!r}")
+                if entry.database is None and entry.database_ref() is None:
+                    # No chain holds it any more; its pool was closed by the finalizer
+                    del self._entries[db_uri]
+
+    def dispose(self, db_uri=None):
+        """
+        Dispose one engine, or every engine when `db_uri` is None.
+
+        Args:
+            db_uri (str or None): Connection URI of the engine to dispose.
+        """
+        with self._lock:
+            uris = [db_uri] if db_uri is not None else list(self._entries)
+            for uri in uris:
+                entry = self._entries.pop(uri, None)
+                if entry is not None:
+                    entry.engine.dispose()
+
+
+registry = EngineRegistry(
+    pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+    max_overflow=int(os.getenv("DB_POOL_MAX_OVERFLOW", 5)),
+    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    idle_timeout=int(os.getenv("DB_ENGINE_IDLE_TIMEOUT", 900)),
+    ping_interval=int(os.getenv("DB_ENGINE_PING_INTERVAL", 60)),
+)
+
+
+def get_database(db_uri):
+    return registry.get_database(db_uri)
@@ -1,45 +1,268 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import matplotlib.pyplot as plt
 import logging
 
+from utilities.data_profiler import content_hash
+from utilities.uploads import file_label, read_bytes
+
 logging.basicConfig(level=logging.INFO)
 
-def process_excel(files, sheet_name=None, remove_duplicates=False):
+EXCEL_CACHE_DIR = os.getenv("EXCEL_CACHE_DIR", os.path.join(".cache", "excel"))
+
+try:
+    import python_calamine  # noqa: F401  Rust reader, supported by pandas >= 2.2
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+
+def excel_engine(label):
     """
-    Process a list of Excel files and combine their data into a single DataFrame.
+    Pick the fastest available reader for a workbook.
+
+    calamine when installed; otherwise openpyxl for .xlsx/.xlsm (pandas opens it
+    read-only) and pandas' default for legacy formats such as .xls.
+    """
+    if EXCEL_ENGINE:
+        return EXCEL_ENGINE
+    if str(label).lower().endswith((".xlsx", ".xlsm")):
+        return "openpyxl"
+    return None
+
+
+class SheetCache:
+    """
+    Parsed sheets stored as Parquet, keyed by the hash of the workbook bytes and the sheet selection.
 
     Args:
-        files (list of str): List of file paths to the Excel files.
-        sheet_name (str or int or None): Name or index of the sheet to read.
-                                         Default is None, which reads the first sheet.
-        remove_duplicates (bool): Whether to remove duplicate rows in the combined DataFrame.
-                                  Default is False.
+        cache_dir (str or None): Directory the Parquet files live in. None disables the cache.
+    """
+
+    def __init__(self, cache_dir=EXCEL_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """Return the cached {sheet name: DataFrame} for `key`, or None on a miss."""
+        if not self.cache_dir:
+            return None
+        manifest_path = os.path.join(self._entry_dir(key), "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            return {
+                sheet: pd.read_parquet(os.path.join(self._entry_dir(key), f"{index}.parquet"))
+                for index, sheet in enumerate(manifest["sheets"])
+            }
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable Excel cache entry {key}: {e}")
+            return None
+
+    def save(self, key, sheets):
+        if not self.cache_dir:
+            return
+        entry_dir = self._entry_dir(key)
+        tmp_dir = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(prefix=f"{key}.", suffix=".tmp", dir=self.cache_dir)
+            for index, df in enumerate(sheets.values()):
+                df.to_parquet(os.path.join(tmp_dir, f"{index}.parquet"), index=False)
+            with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump({"sheets": list(sheets)}, f)
+            # os.replace cannot replace a non-empty directory; an entry is only rewritten when it was unreadable
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except Exception as e:
+            # Mixed-type object columns and a missing pyarrow both end up here
+            logging.warning(f"Could not cache parsed sheets {key}: {e}")
+            if tmp_dir:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+sheet_cache = SheetCache()
+
+
+def _workbook_key(data, sheet_name):
+    selection = 0 if sheet_name is None else None if sheet_name == "*" else sheet_name
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps(selection).encode("utf-8"))
+    return selection, digest.hexdigest()[:24]
+
+
+def _parse_workbook(label, data, selection):
+    """
+    Parse the selected sheets of a workbook, keyed by sheet name; runs in a worker process.
+
+    openpyxl parses in pure Python and holds the GIL, so workbooks are parsed in
+    processes rather than threads.
+    """
+    with pd.ExcelFile(io.BytesIO(data), engine=excel_engine(label)) as book:
+        if selection is None:
+            selected = book.sheet_names
+        else:
+            selected = [
+                book.sheet_names[sheet] if isinstance(sheet, int) else sheet
+                for sheet in (selection if isinstance(selection, list) else [selection])
+            ]
+        sheets = {}
+        for sheet in selected:
+            df = book.parse(sheet)
+            # Parquet needs string column names; apply the same on a miss so both paths agree
+            sheets[str(sheet)] = df.set_axis([str(c) for c in df.columns], axis=1)
+        return sheets
+
+
+def _finish(key, sheets):
+    for sheet, df in sheets.items():
+        # Lets process_excel report a cache key for the profile without hashing the parsed rows
+        df.attrs["content_hash"] = content_hash(key, sheet)
+    return sheets
+
+
+def read_workbook(file, sheet_name=None, cache=sheet_cache):
+    """
+    Read the selected sheets of one workbook in a single pass, using the Parquet cache.
+
+    Args:
+        file (str or file-like): Path or uploaded Excel file.
+        sheet_name (str, int, list or None): Sheet(s) to read. None reads the first sheet,
+            "*" reads every sheet.
+        cache (SheetCache or None): Cache of parsed sheets.
 
     Returns:
-        combined_df (pd.DataFrame): Combined DataFrame containing data from all files.
-        dfs (list of pd.DataFrame): List of individual DataFrames for each file.
-        report (dict): Summary report of the number of rows and columns from each file.
+        dict: Mapping of sheet name to DataFrame, in workbook order.
+    """
+    label = file_label(file)
+    data = read_bytes(file)
+    selection, key = _workbook_key(data, sheet_name)
+
+    sheets = cache.load(key) if cache else None
+    if sheets is not None:
+        logging.info(f"Loaded {label} from the Excel cache.")
+        return _finish(key, sheets)
+    sheets = _parse_workbook(label, data, selection)
+    if cache:
+        cache.save(key, sheets)
+    return _finish(key, sheets)
+
+
+def read_excel_files(files, sheet_name=None, max_workers=None, cache=sheet_cache):
+    """
+    Parse Excel workbooks in parallel, each one in a single pass over its selected sheets.
+
+    Cached workbooks are loaded from Parquet; the rest are parsed in a process pool
+    when there is more than one of them.
+
+    Args:
+        files (list of str or file-like): List of file paths or uploaded Excel files.
+        sheet_name (str or int or list or None): Sheet(s) to read, see `read_workbook`.
+        max_workers (int or None): Worker processes. Defaults to one per CPU.
+        cache (SheetCache or None): Cache of parsed sheets. None always parses.
+
+    Returns:
+        list of (str, pd.DataFrame): One pair per sheet read, in upload and workbook order.
+        Labels are "file" or, when several sheets were read, "file [sheet]", made unique
+        with a " (2)", " (3)"... suffix.
     """
-    combined_df = pd.DataFrame()
-    dfs = []
-    report = {}
+    frames = []
+    if not files:
+        return frames
 
+    jobs = []
     for file in files:
+        label = file_label(file)
         try:
-            df = pd.read_excel(file, sheet_name=sheet_name)
-            dfs.append(df)
-            combined_df = pd.concat([combined_df, df], ignore_index=True)
-            report[file] = {"rows": df.shape[0], "columns": df.shape[1]}
-            logging.info(f"Processed file: {file} with {df.shape[0]} rows and {df.shape[1]} columns.")
+            data = read_bytes(file)
         except Exception as e:
-            logging.error(f"Error processing file {file}: {e}")
+            logging.error(f"Error processing file {label}: {e}")
+            continue
+        selection, key = _workbook_key(data, sheet_name)
+        sheets = cache.load(key) if cache else None
+        if sheets is not None:
+            logging.info(f"Loaded {label} from the Excel cache.")
+        jobs.append((label, data, selection, key, sheets))
+
+    misses = [index for index, job in enumerate(jobs) if job[4] is None]
+    executor = ProcessPoolExecutor(max_workers=max_workers) if len(misses) > 1 else None
+    try:
+        pending = {index: executor.submit(_parse_workbook, *jobs[index][:3]) for index in misses} if executor else {}
+        labels = set()
+        for index, (label, data, selection, key, sheets) in enumerate(jobs):
+            if sheets is None:
+                try:
+                    sheets = pending[index].result() if index in pending else _parse_workbook(label, data, selection)
+                except Exception as e:
+                    logging.error(f"Error processing file {label}: {e}")
+                    continue
+                if cache:
+                    cache.save(key, sheets)
+            for sheet, df in _finish(key, sheets).items():
+                name = label if len(sheets) == 1 else f"{label} [{sheet}]"
+                candidate, suffix = name, 2
+                while candidate in labels:
+                    candidate, suffix = f"{name} ({suffix})", suffix + 1
+                labels.add(candidate)
+                frames.append((candidate, df))
+                logging.info(f"Processed file: {candidate} with {df.shape[0]} rows and {df.shape[1]} columns.")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return frames
+
+
+def process_excel(files, sheet_name=None, remove_duplicates=False, max_workers=None, cache=sheet_cache):
+    """
+    Process a list of Excel files and combine their data into a single DataFrame.
+
+    Workbooks are parsed in parallel with the fastest available engine, each one in a
+    single pass over its sheets, and combined with a single concat. Parsed sheets are
+    cached as Parquet keyed by the file hash, so re-uploads skip parsing.
+
+    Args:
+        files (list of str or file-like): List of file paths or uploaded Excel files.
+        sheet_name (str or int or list or None): Name or index of the sheet(s) to read.
+                                                 Default is None, which reads the first sheet;
+                                                 "*" reads every sheet.
+        remove_duplicates (bool): Whether to remove duplicate rows in the combined DataFrame.
+                                  Default is False.
+        max_workers (int or None): Worker processes parsing workbooks. Defaults to one per CPU.
+        cache (SheetCache or None): Cache of parsed sheets. None always parses.
+
+    Returns:
+        combined_df (pd.DataFrame): Combined DataFrame containing data from all files.
+        dfs (list of pd.DataFrame): List of individual DataFrames, one per file and sheet read.
+        report (dict): Summary report of the number of rows and columns from each file and sheet,
+                       keyed by the labels `read_excel_files` returns, with the `content_hash`
+                       to pass to `generate_insights` as its `cache_key`.
+    """
+    frames = read_excel_files(files, sheet_name, max_workers, cache)
+    dfs = [df for _, df in frames]
+    report = {
+        label: {"rows": df.shape[0], "columns": df.shape[1], "content_hash": df.attrs["content_hash"]}
+        for label, df in frames
+    }
 
+    combined_df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
     if remove_duplicates:
         combined_df.drop_duplicates(inplace=True)
         logging.info("Removed duplicate rows in the combined DataFrame.")
 
     return combined_df, dfs, report
 
+
 def plot_summary(report):
     """
     Plot a summary of the processed files.
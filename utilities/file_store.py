@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import os
+import re
+
+import pandas as pd
+
+from utilities.engine_registry import get_database
+
+logger = logging.getLogger(__name__)
+
+FILE_STORE_DIR = os.getenv("FILE_STORE_DIR", os.path.join(".cache", "file_store"))
+
+try:
+    import duckdb
+    import duckdb_engine  # noqa: F401  SQLAlchemy dialect, needed to expose the store as a SQLDatabase
+    DEFAULT_BACKEND = "duckdb"
+except ImportError:
+    duckdb = None
+    DEFAULT_BACKEND = "sqlite"
+
+
+def table_name_for(label, taken=()):
+    """
+    Turn a file name into a SQL-friendly table name.
+
+    Args:
+        label (str): File path or name, e.g. "Sales 2024.csv".
+        taken (collection of str): Names already used; a numeric suffix is added on collision.
+
+    Returns:
+        str: Lowercase identifier, e.g. "sales_2024".
+    """
+    # Drop the extension but keep what follows it, e.g. the sheet in "book.xlsx [Sheet1]"
+    base = re.sub(r"\.(csv|tsv|txt|xlsx|xlsm|xlsb|xls|ods)\b", "", os.path.basename(str(label)), flags=re.IGNORECASE)
+    name = re.sub(r"[^0-9a-zA-Z]+", "_", base).strip("_").lower() or "data"
+    if name[0].isdigit():
+        name = f"t_{name}"
+    candidate, suffix = name, 2
+    while candidate in taken:
+        candidate, suffix = f"{name}_{suffix}", suffix + 1
+    return candidate
+
+
+def _clean_columns(df):
+    seen = set()
+    columns = []
+    for column in df.columns:
+        name = table_name_for(str(column), seen)
+        seen.add(name)
+        columns.append(name)
+    return df.set_axis(columns, axis=1)
+
+
+def frames_fingerprint(frames):
+    """Content hash of named frames; identical uploads map to the same store."""
+    digest = hashlib.sha256()
+    for name, df in sorted(frames.items()):
+        digest.update(name.encode("utf-8"))
+        digest.update(",".join(map(str, df.columns)).encode("utf-8"))
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _index_columns(df, max_ratio=0.1):
+    """Columns worth indexing: id-like columns and low-cardinality text columns."""
+    columns = []
+    for column in df.columns:
+        if column == "id" or column.endswith("_id"):
+            columns.append(column)
+        elif df[column].dtype == object and len(df) and df[column].nunique(dropna=True) / len(df) <= max_ratio:
+            columns.append(column)
+    return columns
+
+
+def _load_sqlite(path, frames):
+    import sqlite3
+    connection = sqlite3.connect(path)
+    try:
+        for name, df in frames.items():
+            df.to_sql(name, connection, if_exists="replace", index=False, chunksize=10_000)
+            for column in _index_columns(df):
+                connection.execute(f'CREATE INDEX IF NOT EXISTS "ix_{name}_{column}" ON "{name}" ("{column}")')
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _load_duckdb(path, frames):
+    connection = duckdb.connect(path)
+    try:
+        # DuckDB is columnar with min/max zone maps, so no secondary indexes are created
+        for name, df in frames.items():
+            connection.register("upload_frame", df)
+            connection.execute(f'CREATE OR REPLACE TABLE "{name}" AS SELECT * FROM upload_frame')
+            connection.unregister("upload_frame")
+    finally:
+        connection.close()
+
+
+def load_frames(frames, backend=None, store_dir=None):
+    """
+    Load DataFrames into an embedded SQL store and expose it as a `SQLDatabase`.
+
+    The store file is named after the content hash of the frames, so re-uploading
+    the same files reuses the existing store instead of loading it again.
+
+    Args:
+        frames (dict or list of (str, pd.DataFrame)): File or table names and their DataFrames.
+            Names that map to the same table name get a numeric suffix, e.g. `orders`, `orders_2`.
+        backend (str or None): "duckdb" or "sqlite". Defaults to DuckDB when `duckdb` and
+            `duckdb_engine` are installed, SQLite otherwise.
+        store_dir (str or None): Directory the store files live in.
+
+    Returns:
+        SQLDatabase: Database that `SQLChain` can query.
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == "duckdb" and duckdb is None:
+        raise ValueError("The duckdb backend needs the duckdb and duckdb_engine packages")
+    if backend not in ("duckdb", "sqlite"):
+        raise ValueError(f"Unsupported file store backend: {backend}")
+
+    tables = {}
+    for label, df in (frames.items() if isinstance(frames, dict) else frames):
+        tables[table_name_for(label, tables)] = _clean_columns(df)
+
+    store_dir = store_dir or FILE_STORE_DIR
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(store_dir, f"{frames_fingerprint(tables)}.{backend}"))
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        (_load_duckdb if backend == "duckdb" else _load_sqlite)(tmp_path, tables)
+        os.replace(tmp_path, path)
+        logger.info(f"Loaded {len(tables)} tables ({sum(len(df) for df in tables.values())} rows) into {path}")
+    return get_database(f"{backend}:///{path}")
+
+
+def load_files(csv_files=(), excel_files=()):
+    """
+    Parse uploaded CSV and Excel files and load each file (and each Excel sheet) as a table.
+
+    Library entry point for file-backed chats; the Streamlit app itself only connects to databases.
+
+    Args:
+        csv_files (list of str or file-like): CSV files.
+        excel_files (list of str or file-like): Excel files.
+
+    Returns:
+        SQLDatabase: Database with one table per successfully parsed file or sheet.
+    """
+    from utilities.csv_processor import read_csv_files
+    from utilities.excel_processor import read_excel_files
+
+    # Pairs rather than a dict, so two uploads with the same name both become tables
+    frames = read_csv_files(list(csv_files)) + read_excel_files(list(excel_files), sheet_name="*")
+    if not frames:
+        raise ValueError("None of the uploaded files could be parsed")
+    return load_frames(frames)
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+
+from langchain_core.messages import AIMessage
+
+from utilities.table_selector import estimate_tokens
+
+
+def _describe_result(result):
+    """Reduce a stored result to its columns and row count."""
+    if result is None or result == "":
+        return "no rows"
+    if isinstance(result, str):
+        return result if len(result) <= 200 else result[:200] + "..."
+    if isinstance(result, dict) and "columns" in result and "data" in result:
+        columns, row_count = result["columns"], result.get("row_count", len(result["data"]))
+    elif isinstance(result, dict):
+        # DataFrame.to_dict() payloads stored by older messages
+        columns = list(result)
+        row_count = len(next(iter(result.values()), {}))
+    else:
+        return "result omitted"
+    return f"{row_count} rows with columns {', '.join(str(c) for c in columns)}"
+
+
+def compact_message(message):
+    """
+    Render one chat message for a prompt, without its result table.
+
+    Args:
+        message (BaseMessage): HumanMessage, or AIMessage holding the JSON that `app.py` stores.
+
+    Returns:
+        str: `Human: ...` or `AI: ...` line.
+    """
+    if not isinstance(message, AIMessage):
+        return f"Human: {message.content}"
+    try:
+        content = json.loads(message.content)
+    except (json.JSONDecodeError, TypeError):
+        return f"AI: {message.content}"
+    parts = []
+    if content.get("query") and content["query"] != "N/A":
+        parts.append(f"SQL: {content['query']}")
+    if content.get("result") is not None:
+        parts.append(f"Result: {_describe_result(content['result'])}")
+    parts.append(f"Answer: {content.get('rephrasedAnswer', '')}")
+    return "AI: " + " | ".join(parts)
+
+
+def _first_sentence(text, limit=150):
+    sentence = text.split("\n")[0].split(". ")[0]
+    return sentence if len(sentence) <= limit else sentence[:limit] + "..."
+
+
+def summarize_turns(previous_summary, messages):
+    """
+    Extractive summarizer: one line per older message, appended to the previous summary.
+
+    Any callable with this signature can be passed to `HistoryManager` instead,
+    for example one that asks the LLM to condense the summary.
+    """
+    lines = [previous_summary] if previous_summary else []
+    for message in messages:
+        line = compact_message(message)
+        role, _, text = line.partition(": ")
+        if role == "AI":
+            answer = text.rsplit("Answer: ", 1)[-1]
+            sql = text.split(" | ")[0].removeprefix("SQL: ") if text.startswith("SQL: ") else None
+            text = _first_sentence(answer) + (f" (SQL: {_first_sentence(sql, 120)})" if sql else "")
+        else:
+            text = _first_sentence(text)
+        lines.append(f"- {role}: {text}")
+    return "\n".join(lines)
+
+
+class HistoryManager:
+    """
+    Render chat history for prompts within a token budget.
+
+    The last `max_turns` question/answer turns are kept verbatim, except that result
+    tables are reduced to their columns and row count. Older messages are folded
+    into a rolling summary that is extended incrementally as turns age out, so each
+    message is summarized once per conversation.
+
+    Args:
+        max_turns (int): Recent turns kept verbatim.
+        token_budget (int): Maximum tokens of the rendered history.
+        summary_budget (int): Maximum tokens of the rolling summary.
+        summarizer (callable or None): `(previous_summary, messages) -> summary`.
+    """
+
+    def __init__(self, max_turns=3, token_budget=1500, summary_budget=400, summarizer=None):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.summarizer = summarizer or summarize_turns
+        self._summary = ""
+        self._summarized = 0
+        self._summarized_digest = hashlib.sha1().hexdigest()
+
+    @staticmethod
+    def _digest(messages):
+        digest = hashlib.sha1()
+        for message in messages:
+            digest.update(message.content.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _summarize(self, messages):
+        """Return the summary of `messages`, reusing the previous summary when it covers a prefix."""
+        if len(messages) < self._summarized or self._digest(messages[:self._summarized]) != self._summarized_digest:
+            self._summary, self._summarized = "", 0
+        if len(messages) > self._summarized:
+            self._summary = self.summarizer(self._summary, messages[self._summarized:])
+            self._summarized = len(messages)
+            self._summarized_digest = self._digest(messages)
+            while estimate_tokens(self._summary) > self.summary_budget and "\n" in self._summary:
+                self._summary = self._summary.split("\n", 1)[1]
+        return self._summary
+
+    def render(self, history):
+        """
+        Args:
+            history (list of BaseMessage): Full chat history.
+
+        Returns:
+            str: Rolling summary of older turns followed by the recent turns.
+        """
+        split = max(len(history) - 2 * self.max_turns, 0)
+        recent = [compact_message(message) for message in history[split:]]
+        while recent and estimate_tokens("\n".join(recent)) > self.token_budget - self.summary_budget:
+            # Age out whole messages until the verbatim part fits its share of the budget
+            recent.pop(0)
+            split += 1
+
+        summary = self._summarize(history[:split]) if split else ""
+        sections = []
+        if summary:
+            sections.append(f"Summary of earlier conversation:\n{summary}")
+        if recent:
+            sections.append("Recent messages:\n" + "\n".join(recent))
+        rendered = "\n\n".join(sections)
+        max_chars = self.token_budget * 4
+        return rendered if len(rendered) <= max_chars else "..." + rendered[-max_chars:]
+
+
+def get_history_manager() -> HistoryManager:
+    return HistoryManager(
+        max_turns=int(os.getenv("HISTORY_MAX_TURNS", 3)),
+        token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", 1500)),
+        summary_budget=int(os.getenv("HISTORY_SUMMARY_BUDGET", 400)),
+    )
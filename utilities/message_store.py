@@ -0,0 +1,190 @@
+import datetime
+import functools
+import json
+import logging
+import os
+
+import gridfs
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+class MessageStore:
+    """
+    Append-only storage of chat messages in their own collection.
+
+    Each message is one document indexed by `(conversation_id, seq)`, so a turn
+    costs one insert no matter how long the conversation is, and history can be
+    read back a page at a time. Results larger than `inline_result_bytes` are
+    offloaded to GridFS and referenced by id.
+
+    Conversations created before this store keep their messages embedded in the
+    conversation document; they are moved into the collection on first load. The
+    session that moves them first claims the conversation and reserves its
+    sequence numbers in one atomic update, so concurrent loads never copy the
+    history twice, and a migration interrupted for longer than `migration_timeout`
+    is resumed with the same sequence numbers.
+
+    Args:
+        mongo_db (pymongo.database.Database): Database holding the collections.
+        inline_result_bytes (int): Largest serialized result stored inline.
+        page_size (int): Messages returned per page.
+        migration_timeout (float): Seconds after which an unfinished migration may be resumed.
+    """
+
+    def __init__(self, mongo_db, inline_result_bytes=256 * 1024, page_size=50, migration_timeout=600):
+        self.conversations = mongo_db["conversations"]
+        self.messages = mongo_db["messages"]
+        self.results = gridfs.GridFS(mongo_db, collection="results")
+        self.inline_result_bytes = inline_result_bytes
+        self.page_size = page_size
+        self.migration_timeout = migration_timeout
+        self.messages.create_index([("conversation_id", ASCENDING), ("seq", ASCENDING)], unique=True)
+
+    def _next_seq(self, conversation_id, count=1):
+        conversation = self.conversations.find_one_and_update(
+            {"_id": ObjectId(conversation_id)},
+            {"$inc": {"message_seq": count}},
+            projection={"message_seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if conversation is None:
+            raise ValueError(f"Conversation {conversation_id} not found")
+        return conversation["message_seq"] - count + 1
+
+    def _to_document(self, conversation_id, seq, role, content):
+        document = {"conversation_id": ObjectId(conversation_id), "seq": seq, "role": role, "content": content}
+        if role != "AI":
+            return document
+        try:
+            payload = json.loads(content)
+        except (json.JSONDecodeError, TypeError):
+            return document
+        if not isinstance(payload, dict) or payload.get("result") is None:
+            return document
+        result = json.dumps(payload.pop("result")).encode("utf-8")
+        document["content"] = json.dumps(payload)
+        if len(result) > self.inline_result_bytes:
+            document["result_file_id"] = self.results.put(
+                result, conversation_id=ObjectId(conversation_id), seq=seq, content_type="application/json"
+            )
+        else:
+            document["result"] = result.decode("utf-8")
+        return document
+
+    def _from_document(self, document):
+        content = document["content"]
+        if "result" in document or "result_file_id" in document:
+            if "result_file_id" in document:
+                try:
+                    result = self.results.get(document["result_file_id"]).read().decode("utf-8")
+                except gridfs.errors.NoFile:
+                    logger.warning(f"Result blob {document['result_file_id']} is missing")
+                    result = "null"
+            else:
+                result = document["result"]
+            payload = json.loads(content)
+            payload["result"] = json.loads(result)
+            content = json.dumps(payload)
+        return {"seq": document["seq"], "role": document["role"], "content": content}
+
+    def append(self, conversation_id, role, content):
+        """
+        Append one message to a conversation.
+
+        Args:
+            conversation_id (str): Conversation the message belongs to.
+            role (str): "AI" or "Human".
+            content (str): Message content; AI messages hold the JSON written by `app.py`.
+
+        Returns:
+            int: Sequence number of the stored message.
+        """
+        seq = self._next_seq(conversation_id)
+        self.messages.insert_one(self._to_document(conversation_id, seq, role, content))
+        return seq
+
+    def _claim_migration(self, conversation_id):
+        """Claim a conversation's embedded messages for migration, or return None when another session holds them."""
+        projection = {"messages": 1, "messages_migration": 1}
+        # Reserves the sequence numbers and claims the conversation in one update
+        conversation = self.conversations.find_one_and_update(
+            {"_id": ObjectId(conversation_id), "messages.0": {"$exists": True}, "messages_migration": {"$exists": False}},
+            [{"$set": {
+                "messages_migration": {"first_seq": {"$add": [{"$ifNull": ["$message_seq", 0]}, 1]}, "at": "$$NOW"},
+                "message_seq": {"$add": [{"$ifNull": ["$message_seq", 0]}, {"$size": "$messages"}]},
+            }}],
+            projection=projection,
+            return_document=ReturnDocument.AFTER,
+        )
+        if conversation is not None:
+            return conversation
+        # A claim older than the timeout belongs to a session that died mid-migration
+        stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.migration_timeout)
+        return self.conversations.find_one_and_update(
+            {"_id": ObjectId(conversation_id), "messages.0": {"$exists": True}, "messages_migration.at": {"$lt": stale}},
+            {"$set": {"messages_migration.at": datetime.datetime.utcnow()}},
+            projection=projection,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _migrate_embedded(self, conversation_id):
+        conversation = self._claim_migration(conversation_id)
+        if conversation is None:
+            return
+        messages = conversation["messages"]
+        first_seq = conversation["messages_migration"]["first_seq"]
+        try:
+            self.messages.insert_many([
+                self._to_document(conversation_id, first_seq + offset, message["role"], message["content"])
+                for offset, message in enumerate(messages)
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Messages a previous, interrupted migration already inserted
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+        self.conversations.update_one(
+            {"_id": ObjectId(conversation_id)}, {"$unset": {"messages": "", "messages_migration": ""}}
+        )
+        logger.info(f"Moved {len(messages)} embedded messages of conversation {conversation_id}")
+
+    def load_page(self, conversation_id, before_seq=None, limit=None):
+        """
+        Load the most recent messages of a conversation, oldest first.
+
+        Args:
+            conversation_id (str): Conversation to load.
+            before_seq (int or None): Only load messages older than this sequence number.
+            limit (int or None): Page size; defaults to the store's `page_size`.
+
+        Returns:
+            tuple: (list of {"seq", "role", "content"} dicts, whether older messages exist)
+        """
+        if before_seq is None:
+            self._migrate_embedded(conversation_id)
+        limit = limit or self.page_size
+        query = {"conversation_id": ObjectId(conversation_id)}
+        if before_seq is not None:
+            query["seq"] = {"$lt": before_seq}
+        documents = list(self.messages.find(query).sort("seq", DESCENDING).limit(limit + 1))
+        has_more = len(documents) > limit
+        return [self._from_document(document) for document in reversed(documents[:limit])], has_more
+
+    def delete_conversation(self, conversation_id):
+        """Delete every message and offloaded result of a conversation."""
+        for file in self.results.find({"conversation_id": ObjectId(conversation_id)}):
+            self.results.delete(file._id)
+        self.messages.delete_many({"conversation_id": ObjectId(conversation_id)})
+
+
+@functools.lru_cache(maxsize=None)
+def get_message_store(mongo_db) -> MessageStore:
+    """Process-wide message store per database, so its indexes are only ensured once per process."""
+    return MessageStore(
+        mongo_db,
+        inline_result_bytes=int(os.getenv("MESSAGE_INLINE_RESULT_BYTES", 256 * 1024)),
+        page_size=int(os.getenv("MESSAGE_PAGE_SIZE", 50)),
+    )
@@ -1,59 +1,213 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 from langchain.schema import Document
 from PyPDF2 import PdfReader
-from langchain.vectorstores import FAISS
-from langchain.embeddings import OpenAIEmbeddings
 
-def process_pdfs(files):
+from utilities import vector_search
+from utilities.embedding_service import get_embeddings
+from utilities.uploads import file_digest, file_label
+
+logger = logging.getLogger(__name__)
+
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(".cache", "pdf"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 25))
+
+
+def _materialize(file, cache_dir):
+    """
+    Return the content hash of a PDF and a path worker processes can open.
+
+    Uploaded files are written once under `cache_dir`, so workers receive a path
+    instead of a copy of the whole file per task.
+    """
+    if isinstance(file, str):
+        return file_digest(file)[:24], file
+    data = file.getvalue() if hasattr(file, "getvalue") else file.read()
+    digest = hashlib.sha256(data).hexdigest()[:24]
+    path = os.path.join(cache_dir, f"{digest}.pdf")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return digest, path
+
+
+def _extract_pages(path, start, stop):
+    """Extract the text of pages [start, stop) of a PDF; runs in a worker process."""
+    reader = PdfReader(path)
+    return [reader.pages[number].extract_text() or "" for number in range(start, stop)]
+
+
+def _load_cached_text(cache_dir, digest):
+    path = os.path.join(cache_dir, f"{digest}.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable PDF text cache {path}: {e}")
+        return None
+
+
+def _save_cached_text(cache_dir, digest, pages):
+    path = os.path.join(cache_dir, f"{digest}.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(pages, f)
+    os.replace(tmp_path, path)
+
+
+def iter_pdf_pages(files, max_workers=None, pages_per_task=PDF_PAGES_PER_TASK, cache_dir=PDF_CACHE_DIR):
+    """
+    Extract PDF text page by page, in parallel, yielding one Document per page.
+
+    Page ranges of all files are extracted in a process pool and yielded in file and
+    page order as soon as they are ready. Extracted text is cached by file hash, so a
+    file seen before is not parsed again.
+
+    Parameters:
+    - files (list): List of PDF paths or uploaded PDF files.
+    - max_workers (int, optional): Worker processes. Defaults to one per CPU.
+    - pages_per_task (int): Pages extracted per worker task.
+    - cache_dir (str): Directory of the text cache and of uploaded files handed to workers.
+
+    Yields:
+    - Document: Text of one page, with `source` (file name) and `page` (1-based) metadata.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    started = time.perf_counter()
+    total_pages = 0
+    executor = None
+    try:
+        jobs = []
+        for file in files:
+            label = file_label(file)
+            digest, path = _materialize(file, cache_dir)
+            cached = _load_cached_text(cache_dir, digest)
+            if cached is not None:
+                jobs.append((label, digest, [cached], True))
+                continue
+            page_count = len(PdfReader(path).pages)
+            ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+            if len(ranges) > 1 and executor is None:
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+            if len(ranges) > 1:
+                parts = [executor.submit(_extract_pages, path, start, stop) for start, stop in ranges]
+            else:
+                parts = [_extract_pages(path, start, stop) for start, stop in ranges]
+            jobs.append((label, digest, parts, False))
+
+        for label, digest, parts, cached in jobs:
+            file_started = time.perf_counter()
+            pages = []
+            for part in parts:
+                for text in (part if isinstance(part, list) else part.result()):
+                    pages.append(text)
+                    yield Document(page_content=text, metadata={"source": label, "page": len(pages)})
+            if not cached:
+                _save_cached_text(cache_dir, digest, pages)
+            total_pages += len(pages)
+            logger.info(f"Extracted {len(pages)} pages from {label}{' (cached)' if cached else ''} "
+                        f"in {time.perf_counter() - file_started:.2f}s")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Extracted {total_pages} pages in {elapsed:.2f}s ({total_pages / elapsed if elapsed else 0:.1f} pages/s)")
+
+
+def process_pdfs(files, max_workers=None):
     """
     Process PDF files and convert their content to a single text string and a list of Document objects.
 
     Parameters:
     - files (list): List of uploaded PDF files.
+    - max_workers (int, optional): Worker processes used for extraction.
 
     Returns:
     - combined_text (str): Combined text content of all PDF files.
-    - texts (list): List of Document objects containing text for each PDF.
-    """
-    texts = []
-    for file in files:
-        reader = PdfReader(file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-        texts.append(Document(page_content=text))
+    - texts (list): List of Document objects, one per page, with `source` and `page` metadata.
+    """
+    texts = list(iter_pdf_pages(files, max_workers=max_workers))
     combined_text = "\n\n".join(text.page_content for text in texts)
     return combined_text, texts
 
-def create_faiss_index(documents):
+def create_faiss_index(documents, embeddings=None, index_type="flat", save_dir=None):
     """
     Create a FAISS index from a list of documents.
 
     Parameters:
     - documents (list): List of Document objects.
+    - embeddings (Embeddings, optional): Embedding model. Defaults to the cached OpenAI embedding service.
+    - index_type (str): "flat" for exact search, "hnsw" or "ivf" for large corpora.
+    - save_dir (str, optional): Directory the index is persisted to with `save_local`.
 
     Returns:
     - index: The created FAISS index.
     """
-    # Initialize the embeddings
-    embeddings = OpenAIEmbeddings()
+    # Chunks embedded before, in any file, are served from the embedding cache
+    embeddings = embeddings or get_embeddings("openai")
+
+    index = vector_search.build_faiss_index(documents, embeddings, index_type=index_type)
+    if save_dir:
+        index.save_local(save_dir)
 
-    # Create the FAISS index
-    index = FAISS.from_documents(documents, embeddings)
-    
     return index
 
-def search_faiss_index(index, query):
+
+@functools.lru_cache(maxsize=8)
+def _load_faiss_index(path, version):
+    return vector_search.load_faiss_index(path, get_embeddings("openai"))
+
+
+def load_faiss_index(path):
     """
-    Search a FAISS index with a query.
+    Load an index persisted by `create_faiss_index`, once per process and version on disk.
 
     Parameters:
-    - index: The FAISS index to search.
-    - query (str): The query to search with.
+    - path (str): Directory passed as `save_dir`.
 
     Returns:
-    - results (list): List of search results.
+    - index: The loaded FAISS index.
     """
+    # A re-save changes the files' mtime or size, so it is loaded again instead of served stale
+    version = tuple(
+        (stat.st_mtime_ns, stat.st_size)
+        for stat in (os.stat(os.path.join(path, name)) for name in ("index.faiss", "index.pkl"))
+    )
+    return _load_faiss_index(path, version)
+
+
+def search_faiss_index(index, query, k=4, score_threshold=None, filter=None, mmr=False, fetch_k=20):
+    """
+    Search a FAISS index with one or more queries.
+
+    Parameters:
+    - index: The FAISS index to search, or the directory of a persisted index.
+    - query (str or list): The query, or several queries searched in one batched call.
+    - k (int): Number of results per query.
+    - score_threshold (float, optional): Minimum relevance score in [0, 1].
+    - filter (dict, optional): Metadata filter, e.g. {"source": "manual.pdf", "page": [3, 4]}.
+    - mmr (bool): Re-rank results by maximal marginal relevance for diversity.
+    - fetch_k (int): Candidates fetched per query before filtering and re-ranking.
+
+    Returns:
+    - results (list): (Document, score) pairs, or one such list per query when `query` is a list.
+    """
+    if isinstance(index, str):
+        index = load_faiss_index(index)
+
     # Perform the search
-    results = index.search(query)
-    
+    results = vector_search.search(
+        index, query, k=k, score_threshold=score_threshold, filter=filter, fetch_k=fetch_k, mmr=mmr
+    )
+
     return results
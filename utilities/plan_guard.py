@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+LIMIT_DIALECTS = ("mysql", "postgresql", "sqlite", "duckdb")
+# LIMIT n, LIMIT n OFFSET m, or MySQL's LIMIT m, n at the end of the query
+_LIMIT = re.compile(r"\blimit\s+(\d+)(?:\s*(,|offset)\s*(\d+))?\s*;?\s*$", re.IGNORECASE)
+# Constructs whose work is not bounded by a LIMIT on the outer query: joins (explicit or
+# comma-separated), sorting, grouping, set operations, aggregates and subqueries
+_UNBOUNDED = re.compile(
+    r"\b(join|group\s+by|order\s+by|distinct|union|intersect|except|having|count|sum|avg|min|max)\b"
+    r"|\bfrom\s+[\w.\"`\[\]]+(\s+(as\s+)?\w+)?\s*,"
+    r"|\(\s*select\b",
+    re.IGNORECASE,
+)
+
+
+# A table in a FROM clause or join, with its optional alias
+_SQLITE_RELATION = re.compile(r"(?:\bfrom|\bjoin|,)\s+([\w.\"`\[\]]+)(?:\s+(?:as\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIASES = {
+    "where", "join", "inner", "left", "right", "full", "outer", "cross", "natural", "on", "using", "group",
+    "order", "having", "limit", "union", "intersect", "except", "window",
+}
+
+
+def _sqlite_aliases(query):
+    """Alias -> table of the relations in a query; SQLite's query plan names scans by alias."""
+    aliases = {}
+    for relation, alias in _SQLITE_RELATION.findall(query):
+        table_name = relation.split(".")[-1].strip("\"`[]")
+        aliases.setdefault(table_name, table_name)
+        if alias and alias.lower() not in _NOT_ALIASES:
+            aliases[alias] = table_name
+    return aliases
+
+
+def _walk(node):
+    """Yield every dict nested in a JSON plan."""
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def _limit_rows(query):
+    """Row count of the query's trailing LIMIT, or None without one."""
+    match = _LIMIT.search(query)
+    if match is None:
+        return None
+    return int(match.group(3)) if match.group(2) == "," else int(match.group(1))
+
+
+# Keys of a MySQL JSON plan that hold another query block rather than a table of this one
+_MYSQL_NESTED_BLOCKS = (
+    "query_block", "materialized_from_subquery", "attached_subqueries", "optimized_away_subqueries",
+    "select_list_subqueries", "having_subqueries", "order_by_subqueries", "group_by_subqueries",
+    "query_specifications", "union_result",
+)
+
+
+def _mysql_block(node, tables, nested):
+    """Collect the tables joined in one MySQL query block and the query blocks nested in it."""
+    if isinstance(node, list):
+        for value in node:
+            _mysql_block(value, tables, nested)
+    elif isinstance(node, dict):
+        for key, value in node.items():
+            if key in _MYSQL_NESTED_BLOCKS:
+                nested.append(value)
+                continue
+            if key == "table" and isinstance(value, dict):
+                tables.append(value)
+            _mysql_block(value, tables, nested)
+
+
+def _mysql_rows(node):
+    """Rows a MySQL plan examines: the product over the tables joined in each block, summed over blocks."""
+    tables, nested = [], []
+    _mysql_block(node, tables, nested)
+    examined = 1
+    for table in tables:
+        examined *= max(1, int(float(table.get("rows_examined_per_scan", 1))))
+    return (examined if tables else 0) + sum(_mysql_rows(block) for block in nested)
+
+
+def _mysql_stats(plan):
+    query_block = plan.get("query_block", {})
+    tables = [node["table"] for node in _walk(plan) if isinstance(node.get("table"), dict)]
+    return {
+        "cost": float(query_block.get("cost_info", {}).get("query_cost", 0) or 0),
+        "estimated_rows": _mysql_rows(plan),
+        "full_scans": [table.get("table_name") for table in tables if table.get("access_type") == "ALL"],
+    }
+
+
+# Plan nodes that consume all their input before returning a row, so a Limit above them bounds nothing
+_POSTGRES_BLOCKING = {"Sort", "Incremental Sort", "Aggregate", "Hash", "Materialize", "SetOp", "WindowAgg"}
+
+
+def _postgres_stats(plan):
+    root = plan[0]["Plan"]
+    nodes = list(_walk(root))
+    scans = [node for node in nodes if node.get("Node Type") == "Seq Scan"]
+    # Rows the plan touches: the largest intermediate result, at least the scanned rows
+    estimated_rows = int(max([node.get("Plan Rows", 0) for node in nodes] + [sum(n.get("Plan Rows", 0) for n in scans)]))
+    if root.get("Node Type") == "Limit" and not any(node.get("Node Type") in _POSTGRES_BLOCKING for node in nodes):
+        # Execution stops once the Limit has its rows
+        estimated_rows = int(root.get("Plan Rows", 0))
+    return {
+        "cost": float(root.get("Total Cost", 0)),
+        "estimated_rows": estimated_rows,
+        "full_scans": [node.get("Relation Name") for node in scans],
+    }
+
+
+class PlanGuard:
+    """
+    Check generated SQL with the database's `EXPLAIN` before running it.
+
+    MySQL (`EXPLAIN FORMAT=JSON`) and PostgreSQL (`EXPLAIN (FORMAT JSON)`) report
+    row and cost estimates. SQLite's `EXPLAIN QUERY PLAN` has no estimates, so
+    the row counts the schema catalog keeps per table stand in for full scans.
+
+    A query over budget is rewritten with a `LIMIT` when that bounds its work (a
+    single-table select without sorting or aggregation); otherwise it is rejected
+    with a reason that can be fed back to the LLM to write a cheaper query. Such a
+    query that already has a `LIMIT` of at most `row_limit` counts as that many rows;
+    PostgreSQL's estimates are bounded by its plan's own `Limit` node instead.
+
+    Args:
+        db (SQLDatabase): Database the query will run against.
+        catalog (SchemaCatalog or None): Source of per-table row counts for SQLite.
+        max_rows (int): Budget of rows the plan may examine.
+        max_cost (float or None): Budget in the dialect's cost units. None checks rows only.
+        row_limit (int): `LIMIT` added by a rewrite.
+    """
+
+    def __init__(self, db, catalog=None, max_rows=5_000_000, max_cost=None, row_limit=1000):
+        self.db = db
+        self.catalog = catalog
+        self.max_rows = max_rows
+        self.max_cost = max_cost
+        self.row_limit = row_limit
+
+    def _sqlite_stats(self, connection, query):
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {query}")).fetchall()
+        tables = self.catalog.tables if self.catalog is not None else {}
+        aliases = _sqlite_aliases(query)
+        examined, full_scans = 1, []
+        for row in rows:
+            match = re.match(r"SCAN (?:TABLE )?(\w+)", row[-1])
+            if not match:
+                continue
+            table_name = match.group(1) if match.group(1) in tables else aliases.get(match.group(1))
+            if table_name not in tables:
+                continue
+            marker = tables[table_name].get("marker") or [0]
+            full_scans.append(table_name)
+            examined *= max(1, int(marker[0] or 0))
+        return {"cost": None, "estimated_rows": examined if full_scans else 0, "full_scans": full_scans}
+
+    def explain(self, query):
+        """
+        Estimate the work a query does.
+
+        Returns:
+            dict or None: `estimated_rows`, `cost` (None when the dialect has no cost model)
+            and `full_scans`; None when the dialect is not supported.
+
+        Raises:
+            SQLAlchemyError: When the query cannot be planned, e.g. a syntax error.
+        """
+        dialect = self.db.dialect
+        query = query.strip().rstrip(";")
+        with self.db._engine.connect() as connection:
+            if dialect == "mysql":
+                plan = json.loads(connection.execute(text(f"EXPLAIN FORMAT=JSON {query}")).scalar())
+                return self._bounded(query, _mysql_stats(plan))
+            if dialect == "postgresql":
+                if self.db._schema is not None:
+                    connection.exec_driver_sql("SET search_path TO %s", (self.db._schema,))
+                plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {query}")).scalar()
+                return _postgres_stats(json.loads(plan) if isinstance(plan, str) else plan)
+            if dialect == "sqlite":
+                return self._bounded(query, self._sqlite_stats(connection, query))
+        return None
+
+    def _bounded(self, query, stats):
+        """Cap the row estimate of a query whose own LIMIT bounds its work; the plan ignores it."""
+        limit = _limit_rows(query)
+        if limit is not None and limit <= self.row_limit and not _UNBOUNDED.search(query):
+            return dict(stats, estimated_rows=min(stats["estimated_rows"], limit))
+        return stats
+
+    def over_budget(self, stats):
+        reasons = []
+        if stats["estimated_rows"] > self.max_rows:
+            reasons.append(f"it is estimated to examine about {stats['estimated_rows']:,} rows (budget {self.max_rows:,})")
+        if self.max_cost is not None and stats["cost"] is not None and stats["cost"] > self.max_cost:
+            reasons.append(f"its estimated cost is {stats['cost']:,.0f} (budget {self.max_cost:,.0f})")
+        if reasons and stats["full_scans"]:
+            reasons.append(f"it fully scans {', '.join(str(t) for t in stats['full_scans'])}")
+        return "; ".join(reasons)
+
+    def with_limit(self, query):
+        """
+        The query bounded to `row_limit` rows, or None when a LIMIT would not bound its work.
+
+        A query without a LIMIT gets one appended; a larger LIMIT is lowered to `row_limit`.
+        """
+        query = query.strip().rstrip(";")
+        if self.db.dialect not in LIMIT_DIALECTS or _UNBOUNDED.search(query):
+            return None
+        if not re.match(r"\s*select\b", query, re.IGNORECASE):
+            return None
+        match = _LIMIT.search(query)
+        if match is None:
+            return f"{query}\nLIMIT {self.row_limit}"
+        if _limit_rows(query) <= self.row_limit:
+            return query
+        count_group = 3 if match.group(2) == "," else 1
+        return f"{query[:match.start(count_group)]}{self.row_limit}{query[match.end(count_group):]}"
+
+    def check(self, query):
+        """
+        Decide whether a query may run.
+
+        Returns:
+            dict: `action` ("accept", "rewrite" or "reject"), the `query` to run, the
+            `reason` for a rewrite or rejection, and the plan `stats`.
+        """
+        try:
+            stats = self.explain(query)
+        except SQLAlchemyError as e:
+            reason = f"the database could not plan it: {getattr(e, 'orig', None) or e}"
+            return {"action": "reject", "query": query, "reason": reason, "stats": None}
+        except Exception as e:
+            # An unexpected plan format must not block the question
+            logger.warning(f"Could not read the query plan, running unchecked: {e}")
+            return {"action": "accept", "query": query, "reason": None, "stats": None}
+        if stats is None:
+            return {"action": "accept", "query": query, "reason": None, "stats": None}
+
+        reason = self.over_budget(stats)
+        if not reason:
+            return {"action": "accept", "query": query, "reason": None, "stats": stats}
+
+        limited = self.with_limit(query)
+        if limited is not None:
+            stats = dict(stats, estimated_rows=min(stats["estimated_rows"], self.row_limit))
+            if limited == query.strip().rstrip(";"):
+                # Its own LIMIT already bounds it
+                return {"action": "accept", "query": query, "reason": None, "stats": stats}
+            return {"action": "rewrite", "query": limited, "reason": f"added LIMIT {self.row_limit} because {reason}",
+                    "stats": stats}
+        return {"action": "reject", "query": query, "reason": reason, "stats": stats}
+
+    @staticmethod
+    def feedback(query, verdict):
+        """Text appended to the question so the LLM writes a cheaper query."""
+        return (
+            f"\nA previous attempt was rejected before running because {verdict['reason']}:\n{query}\n"
+            "Write a cheaper query: filter on indexed or key columns as early as possible, join only on keys, "
+            "avoid cross joins, and aggregate instead of returning every row."
+        )
+
+
+def get_plan_guard(db, catalog=None):
+    """Plan guard configured from the SQL_PLAN_* environment variables, or None when disabled."""
+    if os.getenv("SQL_PLAN_GUARD", "true").lower() != "true":
+        return None
+    max_cost = os.getenv("SQL_PLAN_MAX_COST")
+    return PlanGuard(
+        db,
+        catalog=catalog,
+        max_rows=int(float(os.getenv("SQL_PLAN_MAX_ROWS", 5_000_000))),
+        max_cost=float(max_cost) if max_cost else None,
+        row_limit=int(os.getenv("SQL_PLAN_ROW_LIMIT", 1000)),
+    )
@@ -0,0 +1,320 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from utilities.shared_store import get_shared_store
+from utilities.table_selector import tokenize
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", os.path.join(".cache", "query_cache.sqlite3"))
+# Fields published for other workers: the SQL and what identifies it, never results
+SHARED_FIELDS = ("key", "scope", "question", "query", "created_at")
+
+
+def normalize_question(question):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?.!")
+
+
+def question_literals(question):
+    """Numbers and quoted strings in a question, which near-duplicate matches must agree on."""
+    return sorted(re.findall(r"'[^']*'|\"[^\"]*\"|\d+(?:\.\d+)?", question))
+
+
+def embed_question(question):
+    """
+    Sparse bag-of-terms embedding of a question.
+
+    Uses word unigrams and bigrams so that questions differing only in stopwords or
+    plurals match, while "last month" and "last year" stay apart.
+
+    Returns:
+        dict: Mapping of term to weight, L2-normalized.
+    """
+    words = tokenize(question)
+    terms = Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+    norm = math.sqrt(sum(weight * weight for weight in terms.values())) or 1.0
+    return {term: weight / norm for term, weight in terms.items()}
+
+
+def cosine_similarity(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(term, 0.0) for term, weight in a.items())
+
+
+class QueryCache:
+    """
+    Two-tier question -> SQL cache in front of `SQLChain`.
+
+    Entries are scoped by database, schema, schema fingerprint and dialect (see
+    `scope`) and keyed by the normalized question. A lookup first tries the exact
+    key, then the most similar cached question in the same scope above
+    `similarity_threshold` that mentions the same numbers and quoted values.
+    Results and rephrased answers are cached alongside the SQL, with the change
+    markers of the tables they read, but only reused on an exact hit within
+    `result_ttl` seconds; a near-duplicate hit reuses the SQL only. The caller
+    compares the markers with `ResultCache.markers` before serving a result.
+
+    The memory tier is an LRU bounded by `max_entries`; the SQLite tier persists
+    across restarts and is trimmed to `max_persistent_entries` by last hit. Chat
+    workers may share the SQLite file; a write that finds it locked is skipped.
+    With a shared store every stored question's SQL (not its result) is also
+    published under its own key, and a question missing locally is fetched by key,
+    so other workers' SQL is reused for exact repeats.
+
+    Args:
+        path (str or None): SQLite file of the persistent tier. None keeps the cache in memory only.
+        max_entries (int): Entries kept in memory.
+        max_persistent_entries (int): Entries kept in the SQLite tier.
+        similarity_threshold (float): Minimum cosine similarity for a near-duplicate hit.
+        result_ttl (int): Seconds a cached result stays reusable. 0 disables result reuse.
+        shared (store or None): Store shared by all workers, see `get_shared_store`.
+        shared_ttl (float): Seconds entries live in the shared store.
+    """
+
+    def __init__(self, path=None, max_entries=1000, max_persistent_entries=20000, similarity_threshold=0.9, result_ttl=300,
+                 shared=None, shared_ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_persistent_entries = max_persistent_entries
+        self.similarity_threshold = similarity_threshold
+        self.result_ttl = result_ttl
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.entries = OrderedDict()
+        self.counters = Counter()
+        self._loaded_scopes = set()
+        self._lock = threading.RLock()
+        self._connection = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            try:
+                self._connection = self._open(path)
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Query cache file {path} unavailable, keeping the cache in memory: {e}")
+
+    @staticmethod
+    def _open(path):
+        # Several chat workers may open the same file; wait briefly for each other's writes
+        connection = sqlite3.connect(path, timeout=1, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS query_cache ("
+            "key TEXT PRIMARY KEY, scope TEXT, question TEXT, embedding TEXT, query TEXT, "
+            "result TEXT, answer TEXT, created_at REAL, result_at REAL, last_hit REAL, markers TEXT)"
+        )
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(query_cache)")}
+        if "markers" not in columns:
+            # Results cached before markers were stored are never served again
+            connection.execute("ALTER TABLE query_cache ADD COLUMN markers TEXT")
+        connection.execute("CREATE INDEX IF NOT EXISTS query_cache_scope ON query_cache (scope, last_hit)")
+        connection.commit()
+        return connection
+
+    @staticmethod
+    def scope(database_fingerprint, schema, schema_fingerprint, dialect):
+        """
+        Scope of the entries generated against one database.
+
+        Args:
+            database_fingerprint (str): Fingerprint of the database, see `schema_catalog.database_fingerprint`.
+            schema (str or None): Schema the queries run in.
+            schema_fingerprint (str): Fingerprint of the schema the SQL was generated against.
+            dialect (str): SQL dialect of the database.
+        """
+        return f"{dialect}:{database_fingerprint}:{schema or ''}:{schema_fingerprint}"
+
+    @staticmethod
+    def key(question, scope):
+        return hashlib.sha256(f"{scope}|{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, entry):
+        self.entries[entry["key"]] = entry
+        self.entries.move_to_end(entry["key"])
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _load_local_scope(self, scope):
+        if self._connection is None or scope in self._loaded_scopes:
+            return
+        rows = self._connection.execute(
+            "SELECT key, scope, question, embedding, query, result, answer, created_at, result_at, last_hit, markers "
+            "FROM query_cache WHERE scope = ? ORDER BY last_hit DESC LIMIT ?",
+            (scope, self.max_entries),
+        ).fetchall()
+        for row in reversed(rows):
+            entry = dict(zip(
+                ("key", "scope", "question", "embedding", "query", "result", "answer", "created_at", "result_at",
+                 "last_hit", "markers"),
+                row,
+            ))
+            entry["embedding"] = json.loads(entry["embedding"])
+            entry["result"] = json.loads(entry["result"]) if entry["result"] is not None else None
+            entry["markers"] = json.loads(entry["markers"]) if entry["markers"] is not None else None
+            self._remember(entry)
+        self._loaded_scopes.add(scope)
+
+    def _write(self, statements):
+        """Run SQLite writes in one transaction; a file locked by another worker only costs the write."""
+        try:
+            for sql, parameters in statements:
+                self._connection.execute(sql, parameters)
+            self._connection.commit()
+        except sqlite3.OperationalError as e:
+            self._connection.rollback()
+            logger.warning(f"Skipped query cache write: {e}")
+
+    def _pull_shared(self, key):
+        """Fetch the entry another worker published under `key`; call without holding the lock."""
+        if self.shared is None:
+            return
+        entry = self.shared.get(f"query_cache:{key}")
+        if not entry:
+            return
+        entry = dict(entry, embedding=embed_question(entry["question"]), result=None, answer=None, result_at=None,
+                     markers=None, last_hit=time.time())
+        with self._lock:
+            if key not in self.entries:
+                self._remember(entry)
+
+    def _publish(self, entry):
+        if self.shared is None:
+            return
+        self.shared.set(f"query_cache:{entry['key']}", {field: entry[field] for field in SHARED_FIELDS},
+                        ttl=self.shared_ttl)
+
+    def lookup(self, question, scope):
+        """
+        Find a cached answer for a question.
+
+        Args:
+            question (str): Natural-language question.
+            scope (str): Scope returned by `scope`.
+
+        Returns:
+            dict or None: `query`, plus `result`, `rephrasedAnswer` and the `markers` stored
+            with them on an exact hit whose result is still within its TTL, plus the
+            `similarity` of the match.
+        """
+        key = self.key(question, scope)
+        with self._lock:
+            self._load_local_scope(scope)
+            known = key in self.entries
+        if not known:
+            # A network round trip, so other threads keep using the cache meanwhile
+            self._pull_shared(key)
+        with self._lock:
+            entry = self.entries.get(key)
+            similarity = 1.0
+            if entry is None:
+                embedding = embed_question(question)
+                literals = question_literals(question)
+                best = max(
+                    ((cosine_similarity(embedding, candidate["embedding"]), candidate)
+                     for candidate in self.entries.values()
+                     if candidate["scope"] == scope and question_literals(candidate["question"]) == literals),
+                    key=lambda item: item[0],
+                    default=(0.0, None),
+                )
+                similarity, entry = best
+                if similarity < self.similarity_threshold:
+                    entry = None
+                if entry is not None:
+                    self.counters["similar_hits"] += 1
+            else:
+                self.counters["exact_hits"] += 1
+
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+
+            now = time.time()
+            entry["last_hit"] = now
+            self.entries.move_to_end(entry["key"])
+            if self._connection is not None:
+                self._write([("UPDATE query_cache SET last_hit = ? WHERE key = ?", (now, entry["key"]))])
+
+            hit = {"query": entry["query"], "similarity": similarity}
+            # A similar question may differ in ways that change the result, so only its SQL is reused
+            exact = entry["key"] == key
+            if (exact and self.result_ttl and entry["result_at"] and now - entry["result_at"] <= self.result_ttl
+                    and entry.get("markers") is not None):
+                hit["result"] = entry["result"]
+                hit["rephrasedAnswer"] = entry["answer"]
+                hit["markers"] = entry["markers"]
+                self.counters["result_hits"] += 1
+            return hit
+
+    def store(self, question, scope, query, result=None, answer=None, markers=None):
+        """
+        Cache the SQL generated for a question, and optionally its result and answer.
+
+        Args:
+            question (str): Natural-language question.
+            scope (str): Scope returned by `scope`.
+            query (str): Generated SQL.
+            result (JSON-serializable or None): Query result to reuse within the TTL.
+            answer (str or None): Rephrased answer to reuse with the result.
+            markers (dict or None): Change markers of the tables the result was read from, see
+                `ResultCache.markers`, read before the query ran. Without them the result is never reused.
+        """
+        if markers is None:
+            result = answer = None
+        now = time.time()
+        entry = {
+            "key": self.key(question, scope),
+            "scope": scope,
+            "question": question,
+            "embedding": embed_question(question),
+            "query": query,
+            "result": result,
+            "answer": answer,
+            "created_at": now,
+            "result_at": now if result is not None else None,
+            "last_hit": now,
+            "markers": markers,
+        }
+        self._publish(entry)
+        with self._lock:
+            self._remember(entry)
+            self.counters["stores"] += 1
+            if self._connection is None:
+                return
+            statements = [(
+                "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry["key"], scope, question, json.dumps(entry["embedding"]), query,
+                 json.dumps(result) if result is not None else None, answer, now, entry["result_at"], now,
+                 json.dumps(markers) if markers is not None else None),
+            )]
+            if self.counters["stores"] % 100 == 0:
+                statements.append((
+                    "DELETE FROM query_cache WHERE key IN "
+                    "(SELECT key FROM query_cache ORDER BY last_hit DESC LIMIT -1 OFFSET ?)",
+                    (self.max_persistent_entries,),
+                ))
+            self._write(statements)
+
+    def stats(self):
+        """Return hit/miss counters and the current number of in-memory entries."""
+        with self._lock:
+            return dict(self.counters, entries=len(self.entries))
+
+
+query_cache = QueryCache(
+    path=QUERY_CACHE_PATH if os.getenv("QUERY_CACHE_PERSIST", "true").lower() == "true" else None,
+    max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 1000)),
+    max_persistent_entries=int(os.getenv("QUERY_CACHE_MAX_PERSISTENT_ENTRIES", 20000)),
+    similarity_threshold=float(os.getenv("QUERY_CACHE_SIMILARITY_THRESHOLD", 0.9)),
+    result_ttl=int(os.getenv("QUERY_CACHE_RESULT_TTL", 300)),
+    shared=get_shared_store(),
+)
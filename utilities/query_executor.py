@@ -0,0 +1,313 @@
+import datetime
+import decimal
+import logging
+import os
+import time
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+
+def _coerce_types(frame):
+    """Turn DB-API object columns holding Decimals and dates into numeric and datetime columns."""
+    for name in frame.columns[frame.dtypes == object]:
+        values = frame[name].dropna()
+        if values.empty:
+            continue
+        sample = values.iloc[0]
+        if isinstance(sample, decimal.Decimal):
+            frame[name] = pd.to_numeric(frame[name].map(lambda v: float(v) if v is not None else None))
+        elif isinstance(sample, (datetime.datetime, datetime.date)):
+            try:
+                frame[name] = pd.to_datetime(frame[name])
+            except (ValueError, TypeError, OverflowError):
+                pass
+    return frame
+
+
+class _Abandoned(Exception):
+    """Raised to leave the transaction of a capped query whose connection was dropped."""
+
+
+def _jsonable(value):
+    if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if hasattr(value, "item"):
+        return _jsonable(value.item())
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+def serialize_result(result):
+    """
+    Convert a query result into a JSON-serializable value for storage.
+
+    DataFrames become `{"columns", "dtypes", "data"}` dicts; strings pass through.
+    """
+    if isinstance(result, pd.DataFrame):
+        return {
+            "columns": [str(c) for c in result.columns],
+            "dtypes": [str(t) for t in result.dtypes],
+            "data": [[_jsonable(v) for v in row] for row in result.itertuples(index=False, name=None)],
+            "row_count": result.attrs.get("row_count", len(result)),
+            "truncated": result.attrs.get("truncated", False),
+        }
+    return result
+
+
+def deserialize_result(result):
+    """
+    Rebuild a query result stored by `serialize_result`.
+
+    Also accepts the `DataFrame.to_dict()` payloads stored by older messages.
+    """
+    if isinstance(result, dict):
+        if "columns" in result and "data" in result:
+            frame = pd.DataFrame(result["data"], columns=result["columns"])
+            for name, dtype in zip(result["columns"], result.get("dtypes", [])):
+                if dtype.startswith("datetime"):
+                    frame[name] = pd.to_datetime(frame[name])
+            frame.attrs["row_count"] = result.get("row_count", len(frame))
+            frame.attrs["truncated"] = result.get("truncated", False)
+            return frame
+        return pd.DataFrame(result)
+    return result
+
+
+class QueryExecutor:
+    """
+    Execute generated SQL straight into a typed DataFrame.
+
+    Rows are fetched with the DB-API cursor and kept as Python values with their
+    column names, instead of round-tripping through a repr string. The LLM only
+    sees a compact, truncated CSV rendering of the frame.
+
+    Queries run on a streaming cursor (server-side on MySQL and PostgreSQL) under
+    a statement timeout, and fetching stops at a hard row and byte cap so a
+    missing `LIMIT` cannot exhaust memory. MySQL's unbuffered cursor reads every
+    remaining row when it is closed, so a capped MySQL query is killed and its
+    connection dropped instead. With `count_total` (the default) the true row count
+    of a capped result is fetched with a separate `COUNT(*)`. It re-runs the query,
+    but only for capped results and under the same statement timeout; a count that
+    fails or times out leaves the row count unknown.
+
+    Args:
+        db (SQLDatabase): Database to run queries against.
+        max_prompt_rows (int): Rows rendered into the prompt.
+        max_prompt_chars (int): Characters rendered into the prompt.
+        max_rows (int): Hard cap on fetched rows.
+        max_bytes (int): Hard cap on the in-memory size of fetched rows.
+        page_size (int): Rows fetched per page.
+        statement_timeout (float): Seconds a statement may run. 0 disables the timeout.
+        count_total (bool): Whether to count the full result when it is capped.
+    """
+
+    def __init__(self, db, max_prompt_rows=20, max_prompt_chars=4000, max_rows=10000,
+                 max_bytes=50 * 1024 * 1024, page_size=500, statement_timeout=30, count_total=True):
+        self.db = db
+        self.max_prompt_rows = max_prompt_rows
+        self.max_prompt_chars = max_prompt_chars
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.page_size = page_size
+        self.statement_timeout = statement_timeout
+        self.count_total = count_total
+
+    def _prepare(self, connection):
+        """Apply the search path and statement timeout for the connection's dialect."""
+        dialect = self.db.dialect
+        if self.db._schema is not None and dialect == "postgresql":
+            connection.exec_driver_sql("SET search_path TO %s", (self.db._schema,))
+        if not self.statement_timeout:
+            return None
+        timeout_ms = int(self.statement_timeout * 1000)
+        if dialect == "postgresql":
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+        elif dialect == "mysql":
+            connection.exec_driver_sql(f"SET SESSION MAX_EXECUTION_TIME = {timeout_ms}")
+            return lambda: connection.exec_driver_sql("SET SESSION MAX_EXECUTION_TIME = 0")
+        elif dialect == "sqlite":
+            deadline = time.monotonic() + self.statement_timeout
+            driver_connection = connection.connection.driver_connection
+            driver_connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+            return lambda: driver_connection.set_progress_handler(None, 0)
+        else:
+            logger.debug(f"No statement timeout support for dialect {dialect}")
+        return None
+
+    def _connection_id(self, connection):
+        """Server thread id of a MySQL connection, needed to kill its query from another connection."""
+        if self.db.dialect != "mysql":
+            return None
+        try:
+            return connection.connection.driver_connection.thread_id()
+        except Exception:
+            return None
+
+    def _abandon(self, connection, thread_id):
+        """Stop a MySQL query whose rows were not all read, without draining them over the wire."""
+        if thread_id is not None:
+            try:
+                with self.db._engine.connect() as killer:
+                    killer.exec_driver_sql(f"KILL QUERY {int(thread_id)}")
+            except Exception as e:
+                logger.warning(f"Could not kill capped query on connection {thread_id}: {e}")
+        # The pool discards the connection instead of closing the cursor on it
+        connection.invalidate()
+
+    def _count(self, query):
+        count_query = f"SELECT COUNT(*) FROM ({query.strip().rstrip(';')}) AS capped_result"
+        try:
+            with self.db._engine.begin() as connection:
+                reset = self._prepare(connection)
+                try:
+                    return connection.execute(text(count_query)).scalar()
+                finally:
+                    if reset:
+                        reset()
+        except SQLAlchemyError as e:
+            logger.warning(f"Could not count capped result: {e}")
+            return None
+
+    def iter_pages(self, query, stats=None):
+        """
+        Execute a query and yield its rows page by page.
+
+        Args:
+            query (str): SQL to execute.
+            stats (dict or None): Filled with `columns`, `row_count` (None if unknown), `fetched_rows`,
+                `truncated`, `truncated_by`, `elapsed` and, on failure, `error`.
+
+        Yields:
+            pd.DataFrame: Pages of at most `page_size` rows.
+        """
+        stats = {} if stats is None else stats
+        stats.update(columns=[], row_count=0, fetched_rows=0, truncated=False, truncated_by=None, error=None)
+        started = time.monotonic()
+        fetched_bytes = 0
+        try:
+            with self.db._engine.begin() as connection:
+                thread_id = self._connection_id(connection)
+                reset = self._prepare(connection)
+                cursor, drained = None, False
+                try:
+                    cursor = connection.execution_options(
+                        stream_results=True, max_row_buffer=self.page_size
+                    ).execute(text(query))
+                    if not cursor.returns_rows:
+                        stats["row_count"] = None
+                        drained = True
+                        return
+                    columns = stats["columns"] = list(cursor.keys())
+                    while True:
+                        limit = min(self.page_size, self.max_rows - stats["fetched_rows"])
+                        rows = cursor.fetchmany(limit) if limit > 0 else []
+                        if not rows:
+                            if limit <= 0 and cursor.fetchone() is not None:
+                                stats["truncated"], stats["truncated_by"] = True, "rows"
+                            break
+                        page = _coerce_types(pd.DataFrame.from_records(rows, columns=columns))
+                        stats["fetched_rows"] += len(page)
+                        fetched_bytes += int(page.memory_usage(deep=True).sum())
+                        yield page
+                        if fetched_bytes >= self.max_bytes:
+                            if cursor.fetchone() is not None:
+                                stats["truncated"], stats["truncated_by"] = True, "bytes"
+                            break
+                    drained = not stats["truncated"]
+                finally:
+                    if cursor is not None and not drained and self.db.dialect == "mysql":
+                        self._abandon(connection, thread_id)
+                    else:
+                        if cursor is not None:
+                            cursor.close()
+                        if reset:
+                            reset()
+                if not drained and self.db.dialect == "mysql":
+                    raise _Abandoned()
+        except _Abandoned:
+            pass
+        except SQLAlchemyError as e:
+            stats["error"] = f"Error: {e}"
+            return
+        finally:
+            stats["elapsed"] = time.monotonic() - started
+
+        if stats["truncated"]:
+            stats["row_count"] = self._count(query) if self.count_total else None
+        else:
+            stats["row_count"] = stats["fetched_rows"]
+
+    def run(self, query):
+        """
+        Execute a query.
+
+        Args:
+            query (str): SQL to execute.
+
+        Returns:
+            pd.DataFrame or str: The (possibly capped) result set, with `row_count` and
+            `truncated` in its `attrs`, an empty string for statements that return no
+            rows, or an `Error: ...` message like `QuerySQLDataBaseTool`.
+        """
+        stats = {}
+        pages = list(self.iter_pages(query, stats))
+        return self.collect(pages, stats)
+
+    @staticmethod
+    def collect(pages, stats):
+        """Combine the pages and stats produced by `iter_pages` into the value `run` returns."""
+        if stats["error"]:
+            return stats["error"]
+        if stats["row_count"] is None and not stats["truncated"]:
+            return ""
+        frame = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame(columns=stats["columns"])
+        frame.attrs["row_count"] = stats["row_count"]
+        frame.attrs["truncated"] = stats["truncated"]
+        return frame
+
+    def render(self, result):
+        """
+        Render a result for the answer prompt.
+
+        Args:
+            result (pd.DataFrame or str): Result returned by `run`.
+
+        Returns:
+            str: At most `max_prompt_rows` rows as CSV, truncated to `max_prompt_chars`,
+            followed by the total row count when rows were left out.
+        """
+        if not isinstance(result, pd.DataFrame):
+            return result
+        if result.empty:
+            return ""
+        rendered = result.head(self.max_prompt_rows).to_csv(index=False)
+        if len(rendered) > self.max_prompt_chars:
+            rendered = rendered[:self.max_prompt_chars] + "..."
+        row_count = result.attrs.get("row_count", len(result))
+        if result.attrs.get("truncated") and row_count is None:
+            rendered += f"\n(more than {len(result)} rows, first {min(len(result), self.max_prompt_rows)} shown)"
+        elif row_count > self.max_prompt_rows:
+            rendered += f"\n({row_count} rows in total, first {self.max_prompt_rows} shown)"
+        return rendered
+
+
+def get_query_executor(db) -> QueryExecutor:
+    return QueryExecutor(
+        db,
+        max_prompt_rows=int(os.getenv("SQL_PROMPT_MAX_ROWS", 20)),
+        max_prompt_chars=int(os.getenv("SQL_PROMPT_MAX_CHARS", 4000)),
+        max_rows=int(os.getenv("SQL_MAX_ROWS", 10000)),
+        max_bytes=int(os.getenv("SQL_MAX_BYTES", 50 * 1024 * 1024)),
+        page_size=int(os.getenv("SQL_PAGE_SIZE", 500)),
+        statement_timeout=float(os.getenv("SQL_STATEMENT_TIMEOUT", 30)),
+        count_total=os.getenv("SQL_COUNT_CAPPED_ROWS", "true").lower() == "true",
+    )
@@ -0,0 +1,431 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from utilities.runtime import process_started_at
+from utilities.schema_catalog import database_fingerprint, table_change_markers
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(".cache", "results"))
+
+_TOKEN = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+    |(?P<string>'(?:[^']|'')*')
+    |(?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+    |(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+    |(?P<word>[A-Za-z_][\w$]*)
+    |(?P<space>\s+)
+    |(?P<symbol>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+# Lowercased in the cache key; every other unquoted word keeps its case, since MySQL table names can be case-sensitive
+_KEYWORDS = {
+    "select", "from", "where", "and", "or", "not", "in", "is", "null", "as", "on", "join", "inner", "left", "right",
+    "full", "outer", "cross", "natural", "using", "group", "by", "order", "asc", "desc", "having", "limit", "offset",
+    "distinct", "all", "union", "intersect", "except", "with", "recursive", "case", "when", "then", "else", "end",
+    "between", "like", "ilike", "exists", "any", "some", "true", "false", "cast", "over", "partition", "rows",
+    "range", "fetch", "first", "next", "only", "top", "nulls", "last", "count", "sum", "avg", "min", "max",
+}
+# Results of queries calling these change without any table changing
+_VOLATILE = {
+    "now", "current_date", "current_time", "current_timestamp", "localtime", "localtimestamp", "sysdate",
+    "curdate", "curtime", "rand", "random", "uuid", "newid", "gen_random_uuid", "utc_timestamp",
+}
+
+
+def referenced_relations(query):
+    """
+    Names of the relations `query` reads: every table, view or table function after FROM
+    or JOIN of a query block, excluding the names of its common table expressions.
+
+    FROM inside a function call (``EXTRACT(YEAR FROM created_at)``) is not a relation.
+    Schema-qualified names keep their qualifier, e.g. ``sales.orders``.
+
+    Returns:
+        list of str: Relation names as written, without quotes.
+    """
+    tokens = []
+    for match in _TOKEN.finditer(query):
+        kind, value = match.lastgroup, match.group()
+        if kind in ("comment", "space"):
+            continue
+        if kind == "quoted":
+            kind, value = "word", value[1:-1]
+        tokens.append((kind, value.lower() if kind == "word" and value.lower() in _KEYWORDS else value))
+
+    def word(i):
+        return i < len(tokens) and tokens[i][0] == "word" and tokens[i][1] not in _KEYWORDS
+
+    def after_parentheses(i):
+        depth = 0
+        while i < len(tokens):
+            depth += {"(": 1, ")": -1}.get(tokens[i][1], 0)
+            i += 1
+            if depth == 0:
+                break
+        return i
+
+    ctes = {tokens[i][1] for i in range(len(tokens) - 2)
+            if word(i) and tokens[i + 1][1] == "as" and tokens[i + 2][1] == "("}
+    relations, blocks = [], [True]
+    for i, (_, value) in enumerate(tokens):
+        if value == "(":
+            # A subquery or a parenthesized join is part of a query block; function arguments are not
+            blocks.append((i + 1 < len(tokens) and tokens[i + 1][1] in ("select", "with"))
+                          or (i > 0 and tokens[i - 1][1] in ("from", "join")))
+        elif value == ")" and len(blocks) > 1:
+            blocks.pop()
+        elif value in ("from", "join") and blocks[-1]:
+            j = i + 1
+            while j < len(tokens):
+                if tokens[j][1] == "(" and j + 1 < len(tokens) and tokens[j + 1][1] not in ("select", "with"):
+                    # Parenthesized join: its first relation follows the parenthesis
+                    j += 1
+                    continue
+                if tokens[j][1] == "(":
+                    # Derived table: the relations inside are found when the loop reaches them
+                    j = after_parentheses(j)
+                elif word(j):
+                    name = tokens[j][1]
+                    while j + 2 < len(tokens) and tokens[j + 1][1] == "." and tokens[j + 2][0] == "word":
+                        name, j = f"{name}.{tokens[j + 2][1]}", j + 2
+                    if name not in ctes:
+                        relations.append(name)
+                    j += 1
+                    if j < len(tokens) and tokens[j][1] == "(":
+                        # Table function: skip its arguments
+                        j = after_parentheses(j)
+                else:
+                    break
+                if j < len(tokens) and tokens[j][1] == "as":
+                    j += 1
+                if word(j):
+                    j += 1
+                if value == "join" or j >= len(tokens) or tokens[j][1] != ",":
+                    break
+                j += 1
+    return relations
+
+
+def canonicalize_sql(query):
+    """
+    Normalize SQL text so trivially different spellings of a query share a cache key.
+
+    Comments are dropped, whitespace is collapsed, keywords are lowercased and a trailing
+    semicolon is removed. Identifiers, string and numeric literals are kept verbatim, so
+    queries differing in a value, or in a table name's case on a case-sensitive MySQL
+    server, never collide.
+
+    Returns:
+        tuple: (canonical SQL, list of unquoted words and quoted identifiers in it, as written)
+    """
+    parts, words = [], []
+    for match in _TOKEN.finditer(query):
+        kind, value = match.lastgroup, match.group()
+        if kind in ("comment", "space"):
+            if parts and parts[-1] not in (" ", "(", ",", "."):
+                parts.append(" ")
+            continue
+        if kind == "word":
+            words.append(value)
+            if value.lower() in _KEYWORDS:
+                value = value.lower()
+        elif kind == "quoted":
+            words.append(value[1:-1])
+        elif kind == "symbol" and value in "(),;." and parts and parts[-1] == " ":
+            parts.pop()
+        parts.append(value)
+    canonical = "".join(parts).strip().rstrip(";").rstrip()
+    return canonical, words
+
+
+class ResultCache:
+    """
+    Process-wide cache of query results, shared by every session and conversation.
+
+    Entries are keyed by the canonical SQL plus the database fingerprint and schema.
+    A hit is only served while the change markers (row counts, update times or
+    modification counters, see `table_change_markers`) of every table the query
+    references are unchanged, and never after `ttl` seconds. Queries reading a relation
+    without a cheap marker (a view, a table function, another schema's table) are not
+    cached at all. Callers read `markers` before running a query and store the result
+    under them. `QueryCache` uses the same markers, so both caches agree on when a
+    result is stale.
+
+    Frames live in memory up to `max_memory_bytes`; frames larger than `spill_bytes`,
+    and the least recently used ones once memory is full, are pickled to a directory
+    of this process under `cache_dir`, which is itself capped at `max_disk_bytes`.
+    Spill directories left by processes that are gone are removed on start-up.
+
+    Args:
+        ttl (float): Seconds an entry may be served at all.
+        marker_ttl (float): Seconds fetched change markers are reused before checking again.
+        max_memory_bytes (int): Memory budget of in-memory frames.
+        spill_bytes (int): Frames at least this large go straight to disk.
+        max_disk_bytes (int): Disk budget of spilled frames.
+        cache_dir (str or None): Spill directory. None keeps everything in memory and evicts instead.
+    """
+
+    def __init__(self, ttl=300, marker_ttl=5, max_memory_bytes=256 * 1024 * 1024, spill_bytes=16 * 1024 * 1024,
+                 max_disk_bytes=2 * 1024 * 1024 * 1024, cache_dir=RESULT_CACHE_DIR):
+        self.ttl = ttl
+        self.marker_ttl = marker_ttl
+        self.max_memory_bytes = max_memory_bytes
+        self.spill_bytes = spill_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._markers = {}
+        self._lock = threading.RLock()
+        self.spill_dir = None
+        if cache_dir:
+            # Workers share cache_dir, so each spills to its own directory; the start time tells a
+            # restarted container's process apart from the earlier one that had the same pid
+            self.spill_dir = os.path.join(cache_dir, f"{os.getpid()}-{int(process_started_at())}")
+            self._remove_stale_spills()
+
+    def _remove_stale_spills(self):
+        """Delete spilled frames no live process can serve: the in-memory index of them died with it."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            pid = name.split("-", 1)[0]
+            if path == self.spill_dir or (pid.isdigit() and int(pid) != os.getpid() and _process_alive(int(pid))):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def scope(db):
+        return f"{database_fingerprint(db._engine)}|{db._schema or ''}"
+
+    def _tables(self, db, query):
+        """
+        Tables `query` reads, or None when it reads a relation that is not a usable table
+        (a view, a table function or a table of another schema), which has no marker.
+        A name matching tables in several cases maps to all of them; extras only cost a marker.
+        """
+        table_names = {}
+        for name in db.get_usable_table_names():
+            table_names.setdefault(name.lower(), []).append(name)
+        tables = set()
+        for relation in referenced_relations(query):
+            schema, _, name = relation.rpartition(".")
+            matches = table_names.get(name.lower()) if schema in ("", db._schema or "") else None
+            if not matches:
+                return None
+            tables.update(matches)
+        return sorted(tables)
+
+    def _current_markers(self, db, scope, tables):
+        """Change markers of `tables`, reusing ones fetched less than `marker_ttl` seconds ago."""
+        now = time.monotonic()
+        markers, stale = {}, []
+        with self._lock:
+            for name in tables:
+                cached = self._markers.get((scope, name))
+                if cached and now - cached[1] < self.marker_ttl:
+                    markers[name] = cached[0]
+                else:
+                    stale.append(name)
+        if stale:
+            # The database file's marker is enough here; only the plan guard needs SQLite row counts
+            fetched = table_change_markers(db._engine, stale, schema=db._schema, count_rows=False)
+            with self._lock:
+                for name, marker in fetched.items():
+                    self._markers[(scope, name)] = (marker, now)
+            markers.update(fetched)
+        return markers
+
+    def markers(self, db, query):
+        """
+        Change markers of the tables `query` reads, for judging later whether its result is stale.
+
+        Args:
+            db (SQLDatabase): Database the query runs against.
+            query (str): SQL text.
+
+        Returns:
+            dict or None: Table name -> marker, or None when the result must not be cached: the
+            query is not a read, calls a volatile function, or reads a relation without a marker.
+        """
+        canonical, words = canonicalize_sql(query)
+        if _VOLATILE.intersection(word.lower() for word in words) or not canonical.lower().startswith(("select", "with")):
+            return None
+        tables = self._tables(db, query)
+        if tables is None:
+            return None
+        markers = self._current_markers(db, self.scope(db), tables) if tables else {}
+        if any(marker is None for marker in markers.values()):
+            return None
+        return markers
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        if entry["path"]:
+            self.disk_bytes -= entry["size"]
+            try:
+                os.remove(entry["path"])
+            except OSError:
+                pass
+        else:
+            self.memory_bytes -= entry["size"]
+
+    def _spill(self, entry):
+        if not self.spill_dir:
+            return False
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"{entry['key']}.pkl")
+        try:
+            entry["frame"].to_pickle(path)
+        except Exception as e:
+            logger.warning(f"Could not spill cached result to {path}: {e}")
+            return False
+        entry["frame"], entry["path"] = None, path
+        self.disk_bytes += entry["size"]
+        return True
+
+    def _enforce_limits(self):
+        for key in list(self.entries):
+            if self.memory_bytes <= self.max_memory_bytes:
+                break
+            entry = self.entries[key]
+            if entry["path"] is None:
+                self.memory_bytes -= entry["size"]
+                if not self._spill(entry):
+                    self.memory_bytes += entry["size"]
+                    self._drop(key)
+        for key in list(self.entries):
+            if self.disk_bytes <= self.max_disk_bytes:
+                break
+            if self.entries[key]["path"]:
+                self._drop(key)
+
+    def lookup(self, db, query):
+        """
+        Return a copy of the cached result of `query`, or None.
+
+        Args:
+            db (SQLDatabase): Database the query runs against.
+            query (str): SQL text.
+        """
+        canonical, words = canonicalize_sql(query)
+        scope = self.scope(db)
+        key = hashlib.sha256(f"{scope}|{canonical}".encode("utf-8")).hexdigest()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry["created_at"] > self.ttl:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            tables, markers = entry["tables"], entry["markers"]
+
+        if tables and self._current_markers(db, scope, tables) != markers:
+            with self._lock:
+                if key in self.entries:
+                    self._drop(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            path, frame = entry["path"], entry["frame"]
+        try:
+            frame = pd.read_pickle(path) if path else frame
+        except Exception as e:
+            logger.warning(f"Could not read spilled result {path}: {e}")
+            with self._lock:
+                if key in self.entries:
+                    self._drop(key)
+            return None
+        result = frame.copy()
+        result.attrs.update(frame.attrs)
+        return result
+
+    def store(self, db, query, result, markers):
+        """
+        Cache a query result. Only DataFrames of queries `markers` accepts are kept.
+
+        Args:
+            db (SQLDatabase): Database the query ran against.
+            query (str): SQL text.
+            result (pd.DataFrame or str): Result returned by `QueryExecutor.run`.
+            markers (dict or None): `markers(db, query)` read before the query ran. Read after
+                it, a write committed in between would pair the old result with new markers.
+        """
+        if not isinstance(result, pd.DataFrame) or markers is None:
+            return
+        canonical, _ = canonicalize_sql(query)
+        tables = sorted(markers)
+        key = hashlib.sha256(f"{self.scope(db)}|{canonical}".encode("utf-8")).hexdigest()
+        size = int(result.memory_usage(deep=True).sum())
+        entry = {
+            "key": key, "tables": tables, "markers": markers, "created_at": time.time(),
+            "size": size, "frame": result.copy(), "path": None,
+        }
+        entry["frame"].attrs.update(result.attrs)
+        with self._lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = entry
+            if size < self.spill_bytes:
+                self.memory_bytes += size
+            elif not self._spill(entry):
+                # Too large to keep in memory and nowhere to spill it
+                del self.entries[key]
+                return
+            self._enforce_limits()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self.entries), "memory_bytes": self.memory_bytes, "disk_bytes": self.disk_bytes,
+                "hits": self.hits, "misses": self.misses,
+            }
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user, or the platform cannot tell
+        return True
+    return True
+
+
+result_cache = ResultCache(
+    ttl=float(os.getenv("RESULT_CACHE_TTL", 300)),
+    marker_ttl=float(os.getenv("RESULT_CACHE_MARKER_TTL", 5)),
+    max_memory_bytes=int(os.getenv("RESULT_CACHE_MAX_MEMORY", 256 * 1024 * 1024)),
+    spill_bytes=int(os.getenv("RESULT_CACHE_SPILL_BYTES", 16 * 1024 * 1024)),
+    max_disk_bytes=int(os.getenv("RESULT_CACHE_MAX_DISK", 2 * 1024 * 1024 * 1024)),
+    cache_dir=RESULT_CACHE_DIR if os.getenv("RESULT_CACHE_SPILL", "true").lower() == "true" else None,
+)
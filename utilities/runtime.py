@@ -0,0 +1,148 @@
+import functools
+import importlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def _process_start_time():
+    """Wall-clock time the process started, read from /proc on Linux; elsewhere the time this module was imported."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # Field 22 (starttime) counted from the fields after the parenthesized command name
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+
+
+_process_started = _process_start_time()
+_timings = OrderedDict()
+_timings_lock = threading.Lock()
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+
+
+def process_started_at():
+    """Wall-clock time this process started."""
+    return _process_started
+
+
+def _record(name, seconds):
+    with _timings_lock:
+        _timings.setdefault(name, seconds)
+
+
+def process_singleton(name):
+    """
+    Build a factory's value once per process and argument tuple, recording how long the first build took.
+
+    Construction runs under a lock, so the warm-up thread and the first request
+    racing for the same client wait for one build instead of making two.
+    """
+    def decorator(func):
+        values = {}
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            if args in values:
+                return values[args]
+            with lock:
+                if args not in values:
+                    started = time.perf_counter()
+                    values[args] = func(*args)
+                    _record(name, time.perf_counter() - started)
+            return values[args]
+        wrapper.cache_clear = values.clear
+        return wrapper
+    return decorator
+
+
+@process_singleton("llm")
+def get_llm():
+    """Process-wide Gemini chat model, constructed on first use."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model="gemini-pro", temperature=0)
+
+
+@process_singleton("langfuse_handler")
+def get_langfuse_handler():
+    """Process-wide Langfuse callback handler, constructed on first use."""
+    from langfuse.callback import CallbackHandler
+    return CallbackHandler(
+        secret_key=os.getenv('LANGFUSE_SECRET_KEY'),
+        public_key=os.getenv('LANGFUSE_PUBLIC_KEY'),
+        host=os.getenv('LANGFUSE_HOST'),
+    )
+
+
+@process_singleton("mongo_client")
+def get_mongo_client(uri):
+    """Process-wide MongoDB client per URI; pymongo clients are thread-safe and pooled."""
+    import pymongo
+    return pymongo.MongoClient(uri)
+
+
+def preload_drivers(modules=("sqlalchemy", "pymysql", "psycopg2", "pyodbc", "langchain_community.utilities")):
+    """Import database drivers and langchain's SQL wrapper ahead of the first connection; missing optional drivers are skipped."""
+    for module in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            continue
+        _record(f"import:{module}", time.perf_counter() - started)
+
+
+def _warm_up():
+    started = time.perf_counter()
+    for name, step in (("drivers", preload_drivers), ("llm", get_llm), ("langfuse_handler", get_langfuse_handler)):
+        try:
+            step()
+        except Exception as e:
+            logger.warning(f"Warm-up step {name} failed: {e}")
+    _record("warm_up", time.perf_counter() - started)
+    logger.info(f"Startup report: {format_startup_report()}")
+
+
+def warm_up(background=True):
+    """
+    Build the LLM client, the Langfuse handler and the database drivers ahead of the first question.
+
+    Only the first call per process does any work.
+
+    Args:
+        background (bool): Run in a daemon thread instead of blocking the caller.
+
+    Returns:
+        threading.Thread or None: The warm-up thread when run in the background.
+    """
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is not None:
+            return _warm_up_thread
+        _record("process_to_warm_up", time.time() - _process_started)
+        _warm_up_thread = threading.Thread(target=_warm_up, name="querybot-warm-up", daemon=True)
+        if background:
+            _warm_up_thread.start()
+    if not background:
+        _warm_up_thread.run()
+        return None
+    return _warm_up_thread
+
+
+def startup_report():
+    """Return the recorded startup timings in seconds, in the order they happened."""
+    with _timings_lock:
+        return dict(_timings)
+
+
+def format_startup_report():
+    return ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in startup_report().items())
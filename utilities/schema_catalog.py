@@ -0,0 +1,495 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+from sqlalchemy import column, func, inspect, select, table, text
+
+from utilities.shared_store import get_shared_store
+from utilities.tracing import span
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", os.path.join(".cache", "schema"))
+
+
+def database_fingerprint(engine):
+    """
+    Identify a database by its connection URL without leaking the password.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Engine of the database.
+
+    Returns:
+        str: Short stable hash of the dialect and password-free URL.
+    """
+    url = engine.url.render_as_string(hide_password=True)
+    return hashlib.sha256(f"{engine.dialect.name}|{url}".encode("utf-8")).hexdigest()[:16]
+
+
+def _database_file_marker(engine):
+    """Modification time and size of a file-backed database, or None for in-memory ones."""
+    path = engine.url.database
+    if not path or path == ":memory:" or path.startswith("file:"):
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def table_change_markers(engine, table_names, schema=None, count_rows=True, previous=None):
+    """
+    Fetch a cheap per-table marker that changes when the table's rows change.
+
+    MySQL and PostgreSQL expose row estimates and modification counters in their
+    statistics views and SQL Server row counts in `sys.partitions`, so a single
+    query covers every table. SQLite and DuckDB files have no per-table counters;
+    their marker is the database file's modification time and size, which changes
+    on any write. With `count_rows` the first element of a SQLite marker is the
+    table's row count, which is only re-counted when the file changed since the
+    `previous` marker. Other dialects have no cheap marker and get None.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Engine of the database.
+        table_names (list of str): Tables to fetch markers for.
+        schema (str or None): Schema the tables live in.
+        count_rows (bool): Count SQLite rows when the file changed (the plan guard reads them).
+        previous (dict or None): Markers returned by an earlier call, reused while the file is unchanged.
+
+    Returns:
+        dict: Mapping of table name to a JSON-serializable marker, or None when the table has none.
+    """
+    markers = {}
+    previous = previous or {}
+    dialect = engine.dialect.name
+    with engine.connect() as connection:
+        try:
+            if dialect == "mysql":
+                rows = connection.execute(text(
+                    "SELECT TABLE_NAME, TABLE_ROWS, UPDATE_TIME FROM information_schema.tables "
+                    "WHERE TABLE_SCHEMA = COALESCE(:schema, DATABASE())"
+                ), {"schema": schema})
+                markers = {name: [count, str(updated)] for name, count, updated in rows}
+            elif dialect == "postgresql":
+                rows = connection.execute(text(
+                    "SELECT relname, n_live_tup, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables "
+                    "WHERE schemaname = COALESCE(:schema, current_schema())"
+                ), {"schema": schema})
+                markers = {name: [count, changes] for name, count, changes in rows}
+            elif dialect == "mssql":
+                rows = connection.execute(text(
+                    "SELECT o.name, SUM(p.rows), MAX(o.modify_date) FROM sys.objects o "
+                    "JOIN sys.partitions p ON p.object_id = o.object_id AND p.index_id IN (0, 1) "
+                    "WHERE o.type = 'U' AND o.schema_id = SCHEMA_ID(COALESCE(:schema, SCHEMA_NAME())) "
+                    "GROUP BY o.name"
+                ), {"schema": schema})
+                markers = {name: [count, str(modified)] for name, count, modified in rows}
+            elif dialect in ("sqlite", "duckdb"):
+                file_marker = _database_file_marker(engine)
+                if file_marker is not None:
+                    for name in table_names:
+                        count = None
+                        if count_rows and dialect == "sqlite":
+                            known = previous.get(name)
+                            if known and known[1:] == file_marker:
+                                count = known[0]
+                            else:
+                                count_query = select(func.count()).select_from(table(name, schema=schema))
+                                count = connection.execute(count_query).scalar()
+                        markers[name] = [count] + file_marker
+        except Exception as e:
+            logger.warning(f"Could not read table change markers: {e}")
+            markers = {}
+    return {name: markers.get(name) for name in table_names}
+
+
+def table_ddl_signatures(engine, table_names, schema=None):
+    """
+    Fetch a cheap per-table signature that changes when the table's DDL changes.
+
+    Read in one catalog query on MySQL (column definitions), PostgreSQL (columns,
+    constraints and comments), SQL Server (`modify_date`) and SQLite (the stored
+    `CREATE` statement). Other dialects return None for every table, meaning the
+    table must be reflected to find out.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Engine of the database.
+        table_names (list of str): Tables to fetch signatures for.
+        schema (str or None): Schema the tables live in.
+
+    Returns:
+        dict: Mapping of table name to a string signature, or None when it is unknown.
+    """
+    dialect = engine.dialect.name
+    queries = {
+        "mysql": (
+            "SELECT c.TABLE_NAME, CONCAT(COUNT(*), ':', SUM(CRC32(CONCAT_WS(':', c.COLUMN_NAME, c.COLUMN_TYPE, "
+            "c.IS_NULLABLE, c.COLUMN_KEY, c.COLUMN_COMMENT, c.ORDINAL_POSITION))), ':', MAX(t.CREATE_TIME), ':', "
+            "MAX(CRC32(t.TABLE_COMMENT))) FROM information_schema.columns c JOIN information_schema.tables t "
+            "ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME "
+            "WHERE c.TABLE_SCHEMA = COALESCE(:schema, DATABASE()) GROUP BY c.TABLE_NAME"
+        ),
+        "postgresql": (
+            "SELECT c.relname, md5(string_agg(a.attname || ' ' || format_type(a.atttypid, a.atttypmod) || ' ' "
+            "|| a.attnotnull::text || ' ' || COALESCE(col_description(c.oid, a.attnum), ''), ',' ORDER BY a.attnum) "
+            "|| COALESCE((SELECT string_agg(pg_get_constraintdef(k.oid), ',' ORDER BY k.conname) "
+            "FROM pg_constraint k WHERE k.conrelid = c.oid), '') || COALESCE(obj_description(c.oid, 'pg_class'), '')) "
+            "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped "
+            "WHERE n.nspname = COALESCE(:schema, current_schema()) GROUP BY c.oid, c.relname"
+        ),
+        "mssql": (
+            "SELECT name, CONVERT(varchar(33), modify_date, 126) FROM sys.objects "
+            "WHERE type IN ('U', 'V') AND schema_id = SCHEMA_ID(COALESCE(:schema, SCHEMA_NAME()))"
+        ),
+        "sqlite": f"SELECT name, sql FROM {f'{schema}.' if schema else ''}sqlite_master WHERE type IN ('table', 'view')",
+    }
+    signatures = {}
+    if dialect in queries:
+        try:
+            with engine.connect() as connection:
+                params = {"schema": schema} if dialect != "sqlite" else {}
+                signatures = {name: str(signature) for name, signature in connection.execute(text(queries[dialect]), params)}
+        except Exception as e:
+            logger.warning(f"Could not read table DDL signatures, reflecting every table: {e}")
+            signatures = {}
+    return {name: signatures.get(name) for name in table_names}
+
+
+class SchemaCatalog:
+    """
+    Snapshot of a database schema used to render the `{table_info}` prompt section.
+
+    Tables, columns, keys and sample rows are reflected once and persisted per
+    database fingerprint. Each refresh reads a DDL signature per table from the
+    system catalog (see `table_ddl_signatures`) and only re-reflects tables whose
+    signature changed; on dialects without one every table is re-reflected.
+    Sample rows are re-rendered for tables whose row-change marker changed (see
+    `table_change_markers`). While a stale snapshot exists it keeps being served
+    and the refresh runs in the background.
+
+    Args:
+        db (SQLDatabase): Database to describe.
+        cache_dir (str or None): Directory the snapshot is persisted in.
+        refresh_interval (int): Seconds a snapshot is trusted before it is re-checked.
+        sample_rows (int): Number of sample rows rendered per table.
+    """
+
+    def __init__(self, db, cache_dir=None, refresh_interval=300, sample_rows=3):
+        # Weak, so the process-wide catalog does not keep an idle engine from being disposed
+        self._db = weakref.ref(db)
+        self.engine = db._engine
+        self.schema = db._schema
+        self.cache_dir = cache_dir or SCHEMA_CACHE_DIR
+        self.refresh_interval = refresh_interval
+        self.sample_rows = sample_rows
+        self.fingerprint = database_fingerprint(self.engine)
+        self.tables = {}
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()
+        # Serializes the first refresh, so concurrent first requests reflect the schema once
+        self._cold_lock = threading.Lock()
+        self._refreshing = False
+        self._load()
+
+    @property
+    def db(self):
+        """The described `SQLDatabase`, or None once nothing else holds it."""
+        return self._db()
+
+    @property
+    def path(self):
+        return os.path.join(self.cache_dir, f"{self.fingerprint}.json")
+
+    @property
+    def schema_fingerprint(self):
+        """Hash of every table's structure; changes whenever any DDL changes."""
+        structure = sorted((name, entry["structure_hash"]) for name, entry in self.tables.items())
+        return hashlib.sha1(json.dumps(structure).encode("utf-8")).hexdigest()[:16]
+
+    def _load(self):
+        snapshots = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable schema snapshot {self.path}: {e}")
+        # In multi-worker mode a worker that never saw this database starts from the shared snapshot
+        shared = get_shared_store()
+        if shared is not None:
+            snapshots.append(shared.get(f"schema_catalog:{self.fingerprint}"))
+        try:
+            snapshot = max((s for s in snapshots if s), key=lambda s: s["refreshed_at"], default=None)
+            if snapshot:
+                self.tables = snapshot["tables"]
+                self.refreshed_at = snapshot["refreshed_at"]
+        except (KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable schema snapshot {self.path}: {e}")
+
+    def _save(self):
+        snapshot = {"fingerprint": self.fingerprint, "refreshed_at": self.refreshed_at, "tables": self.tables}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+        shared = get_shared_store()
+        if shared is not None:
+            shared.set(f"schema_catalog:{self.fingerprint}", snapshot)
+
+    def _read_structures(self, table_names):
+        inspector = inspect(self.engine)
+        structures = {name: {} for name in table_names}
+        if hasattr(inspector, "get_multi_columns"):
+            # SQLAlchemy 2.x reflects all tables in a handful of queries on most dialects
+            filter_names = list(table_names)
+            columns = inspector.get_multi_columns(schema=self.schema, filter_names=filter_names)
+            primary_keys = inspector.get_multi_pk_constraint(schema=self.schema, filter_names=filter_names)
+            foreign_keys = inspector.get_multi_foreign_keys(schema=self.schema, filter_names=filter_names)
+            for (_, name), value in columns.items():
+                structures[name]["columns"] = value
+            for (_, name), value in primary_keys.items():
+                structures[name]["primary_key"] = value.get("constrained_columns") or []
+            for (_, name), value in foreign_keys.items():
+                structures[name]["foreign_keys"] = value
+            try:
+                comments = inspector.get_multi_table_comment(schema=self.schema, filter_names=filter_names)
+            except NotImplementedError:
+                comments = {(self.schema, name): {"text": None} for name in table_names}
+            for (_, name), value in comments.items():
+                structures[name]["comment"] = value.get("text")
+        for name, structure in structures.items():
+            if "columns" not in structure:
+                structure["columns"] = inspector.get_columns(name, schema=self.schema)
+            if "primary_key" not in structure:
+                structure["primary_key"] = inspector.get_pk_constraint(name, schema=self.schema).get("constrained_columns") or []
+            if "foreign_keys" not in structure:
+                structure["foreign_keys"] = inspector.get_foreign_keys(name, schema=self.schema)
+            if "comment" not in structure:
+                try:
+                    structure["comment"] = inspector.get_table_comment(name, schema=self.schema).get("text")
+                except NotImplementedError:
+                    structure["comment"] = None
+        return structures
+
+    def _type_name(self, column_type):
+        try:
+            return column_type.compile(dialect=self.engine.dialect)
+        except Exception:
+            return str(column_type)
+
+    def _describe(self, name, structure):
+        columns = [
+            {
+                "name": col["name"],
+                "type": self._type_name(col["type"]),
+                "nullable": col.get("nullable", True),
+                "comment": col.get("comment"),
+            }
+            for col in structure["columns"]
+        ]
+        foreign_keys = [
+            {
+                "constrained_columns": fk["constrained_columns"],
+                "referred_table": fk["referred_table"],
+                "referred_columns": fk["referred_columns"],
+            }
+            for fk in structure["foreign_keys"]
+        ]
+        return {
+            "columns": columns,
+            "primary_key": list(structure["primary_key"]),
+            "foreign_keys": foreign_keys,
+            "comment": structure.get("comment"),
+        }
+
+    def _render_ddl(self, name, description):
+        lines = []
+        for col in description["columns"]:
+            line = f"\t{col['name']} {col['type']}"
+            if not col["nullable"]:
+                line += " NOT NULL"
+            if col["comment"]:
+                line += f" -- {col['comment']}"
+            lines.append(line)
+        if description["primary_key"]:
+            lines.append(f"\tPRIMARY KEY ({', '.join(description['primary_key'])})")
+        for fk in description["foreign_keys"]:
+            lines.append(
+                f"\tFOREIGN KEY({', '.join(fk['constrained_columns'])}) "
+                f"REFERENCES {fk['referred_table']} ({', '.join(fk['referred_columns'])})"
+            )
+        ddl = f"CREATE TABLE {name} (\n" + ", \n".join(lines) + "\n)"
+        if description["comment"]:
+            ddl = f"-- {description['comment']}\n{ddl}"
+        return ddl
+
+    def _render_sample_rows(self, name, description):
+        column_names = [col["name"] for col in description["columns"]]
+        query = select(table(name, *[column(c) for c in column_names], schema=self.schema)).limit(self.sample_rows)
+        try:
+            with self.engine.connect() as connection:
+                rows = [[str(value)[:100] for value in row] for row in connection.execute(query)]
+        except Exception as e:
+            logger.warning(f"Could not sample rows of {name}: {e}")
+            rows = []
+        sample = "\n".join("\t".join(row) for row in rows)
+        return f"{self.sample_rows} rows from {name} table:\n" + "\t".join(column_names) + f"\n{sample}"
+
+    def refresh(self):
+        """
+        Re-reflect the tables whose DDL signature changed and re-render the ones whose rows changed.
+
+        Returns:
+            list of str: Names of the tables that were added or re-rendered.
+        """
+        with span("schema_refresh") as tags:
+            changed = self._refresh()
+            tags["tables"] = len(self.tables)
+            tags["tables_changed"] = len(changed)
+        return changed
+
+    def _refresh(self):
+        db = self.db
+        if db is None:
+            # The engine was released and disposed; a later get_catalog builds a new catalog
+            return []
+        table_names = sorted(db.get_usable_table_names())
+        signatures = table_ddl_signatures(self.engine, table_names, schema=self.schema)
+        to_reflect = [
+            name for name in table_names
+            if signatures[name] is None or name not in self.tables
+            or self.tables[name].get("ddl_signature") != signatures[name]
+        ]
+        structures = self._read_structures(to_reflect) if to_reflect else {}
+        previous_markers = {name: entry.get("marker") for name, entry in self.tables.items()}
+        markers = table_change_markers(self.engine, table_names, schema=self.schema, previous=previous_markers)
+
+        tables = {}
+        changed = []
+        for name in table_names:
+            previous = self.tables.get(name)
+            marker = json.loads(json.dumps(markers.get(name), default=str))
+            if name in structures:
+                description = self._describe(name, structures[name])
+                structure_hash = hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+            else:
+                # DDL signature unchanged: keep the reflected structure
+                description = {key: previous[key] for key in ("columns", "primary_key", "foreign_keys", "comment")}
+                structure_hash = previous["structure_hash"]
+            if previous and previous["structure_hash"] == structure_hash and previous["marker"] == marker:
+                tables[name] = dict(previous, ddl_signature=signatures[name])
+                continue
+
+            entry = dict(description, structure_hash=structure_hash, marker=marker, ddl_signature=signatures[name])
+            if previous and previous["structure_hash"] == structure_hash:
+                entry["ddl"] = previous["ddl"]
+            else:
+                entry["ddl"] = self._render_ddl(name, description)
+            entry["sample_rows"] = self._render_sample_rows(name, description) if self.sample_rows else ""
+            tables[name] = entry
+            changed.append(name)
+
+        with self._lock:
+            self.tables = tables
+            self.refreshed_at = time.time()
+        try:
+            self._save()
+        except OSError as e:
+            logger.warning(f"Could not persist schema snapshot {self.path}: {e}")
+        if changed:
+            logger.info(
+                f"Schema catalog {self.fingerprint}: reflected {len(to_reflect)} and re-rendered {len(changed)} "
+                f"of {len(tables)} tables"
+            )
+        return changed
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning(f"Background schema refresh failed: {e}")
+        finally:
+            self._refreshing = False
+
+    def ensure_fresh(self):
+        """Refresh inline when there is no snapshot yet, otherwise in the background once it goes stale."""
+        if not self.refreshed_at:
+            with self._cold_lock:
+                # Another request may have finished the first refresh while this one waited
+                if not self.refreshed_at:
+                    self.refresh()
+            return
+        if time.time() - self.refreshed_at < self.refresh_interval or self._refreshing:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def get_table_names(self):
+        self.ensure_fresh()
+        return list(self.tables)
+
+    def render(self, table_names=None):
+        """
+        Render `CREATE TABLE` statements and sample rows in the same layout as `SQLDatabase.get_table_info`.
+
+        Args:
+            table_names (list of str or None): Tables to include. Defaults to every usable table.
+
+        Returns:
+            str: Table information for the `{table_info}` prompt variable.
+        """
+        self.ensure_fresh()
+        tables = self.tables
+        if table_names is None:
+            table_names = list(tables)
+        missing = set(table_names) - set(tables)
+        if missing:
+            raise ValueError(f"table_names {missing} not found in database")
+
+        sections = []
+        for name in table_names:
+            section = tables[name]["ddl"]
+            if tables[name]["sample_rows"]:
+                section += f"\n\n/*\n{tables[name]['sample_rows']}\n*/"
+            sections.append(section)
+        return "\n\n".join(sections)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(db) -> SchemaCatalog:
+    """
+    Return the process-wide catalog for a database, shared by every session pointing at it.
+
+    Args:
+        db (SQLDatabase): Database to describe.
+
+    Returns:
+        SchemaCatalog: Catalog for the database.
+    """
+    fingerprint = database_fingerprint(db._engine)
+    with _catalogs_lock:
+        for key in [key for key, catalog in _catalogs.items() if catalog.db is None]:
+            del _catalogs[key]
+        catalog = _catalogs.get(fingerprint)
+        if catalog is None or catalog.db is not db:
+            catalog = SchemaCatalog(
+                db,
+                refresh_interval=int(os.getenv("SCHEMA_REFRESH_INTERVAL", 300)),
+                sample_rows=int(os.getenv("SCHEMA_SAMPLE_ROWS", 3)),
+            )
+            _catalogs[fingerprint] = catalog
+        return catalog
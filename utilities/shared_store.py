@@ -0,0 +1,104 @@
+import datetime
+import functools
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class RedisStore:
+    """
+    JSON key-value store on Redis, shared by every worker process and host.
+
+    Args:
+        url (str): Redis URL, e.g. "redis://localhost:6379/0".
+        prefix (str): Prefix of every key written.
+    """
+
+    def __init__(self, url, prefix="querybot:"):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+
+class MongoStore:
+    """
+    Stand-in for `RedisStore` on the MongoDB the app already uses.
+
+    Keys are documents of a `shared_state` collection; a TTL index removes expired
+    ones, and reads skip documents that expired but were not removed yet.
+
+    Args:
+        mongo_db (pymongo.database.Database): Database holding the collection.
+    """
+
+    def __init__(self, mongo_db, collection="shared_state"):
+        self.collection = mongo_db[collection]
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @staticmethod
+    def _expiry(ttl):
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl) if ttl else None
+
+    @staticmethod
+    def _live():
+        return {"$or": [{"expires_at": None}, {"expires_at": {"$gt": datetime.datetime.utcnow()}}]}
+
+    def get(self, key):
+        document = self.collection.find_one({"$and": [{"_id": key}, self._live()]})
+        return json.loads(document["value"]) if document else None
+
+    def set(self, key, value, ttl=None):
+        self.collection.replace_one(
+            {"_id": key}, {"_id": key, "value": json.dumps(value), "expires_at": self._expiry(ttl)}, upsert=True
+        )
+
+
+class SafeStore:
+    """Wraps a store so an unreachable backend degrades to cache misses instead of failed requests."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        @functools.wraps(method)
+        def call(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                logger.warning(f"Shared store {name} failed: {e}")
+                return None
+        return call
+
+
+@functools.lru_cache(maxsize=None)
+def get_shared_store():
+    """
+    Process-wide store for state every chat worker must see, or None in single-worker mode.
+
+    SHARED_STATE_BACKEND selects "redis" (REDIS_URL) or "mongo" (MONGO_URI and MONGO_DB_NAME);
+    it defaults to "redis" when REDIS_URL is set.
+    """
+    backend = os.getenv("SHARED_STATE_BACKEND") or ("redis" if os.getenv("REDIS_URL") else "")
+    if not backend:
+        return None
+    try:
+        if backend == "redis":
+            return SafeStore(RedisStore(os.getenv("REDIS_URL", "redis://localhost:6379/0")))
+        if backend == "mongo":
+            from utilities.runtime import get_mongo_client
+            return SafeStore(MongoStore(get_mongo_client(os.getenv("MONGO_URI"))[os.getenv("MONGO_DB_NAME")]))
+    except Exception as e:
+        logger.warning(f"Shared state backend {backend} unavailable, running with local state only: {e}")
+        return None
+    raise ValueError(f"Unsupported shared state backend: {backend}")
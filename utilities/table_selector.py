@@ -0,0 +1,168 @@
+import logging
+import math
+import os
+import re
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "give", "how", "i", "in", "is", "it",
+    "list", "many", "me", "much", "of", "on", "or", "show", "the", "their", "there", "to", "was", "were",
+    "what", "when", "where", "which", "who", "with",
+}
+
+
+def estimate_tokens(text):
+    """Rough token count used for prompt budgeting (about four characters per token)."""
+    return math.ceil(len(text) / 4)
+
+
+def tokenize(text):
+    """
+    Split text into lowercase, lightly stemmed terms.
+
+    Splits on punctuation, underscores and camelCase boundaries, so `orderItems`,
+    `order_items` and "order items" all produce the same terms.
+    """
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text or "")
+    terms = []
+    for word in re.split(r"[^A-Za-z0-9]+", text.lower()):
+        if not word or word in STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+class TableSelector:
+    """
+    Rank catalog tables against a question and keep only the most relevant ones.
+
+    Each table is indexed as a BM25 document built from its name, column names and
+    comments, with the table name weighted higher. The top-k tables are kept together
+    with the tables they reference or are referenced by through foreign keys, so
+    join paths survive pruning.
+
+    Args:
+        catalog (SchemaCatalog): Catalog the tables and their rendering come from.
+        top_k (int): Number of tables to keep before adding foreign-key neighbors.
+            0 disables pruning.
+        include_neighbors (bool): Whether to add foreign-key neighbors of the kept tables.
+    """
+
+    TABLE_NAME_WEIGHT = 3
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, catalog, top_k=8, include_neighbors=True):
+        self.catalog = catalog
+        self.top_k = top_k
+        self.include_neighbors = include_neighbors
+        self._indexed_at = None
+
+    def _build_index(self):
+        tables = self.catalog.tables
+        self.documents = {}
+        self.neighbors = {name: set() for name in tables}
+        self.table_tokens = {}
+        for name, entry in tables.items():
+            terms = tokenize(name) * self.TABLE_NAME_WEIGHT + tokenize(entry.get("comment") or "")
+            for col in entry["columns"]:
+                terms += tokenize(col["name"]) + tokenize(col.get("comment") or "")
+            self.documents[name] = Counter(terms)
+            for fk in entry["foreign_keys"]:
+                if fk["referred_table"] in self.neighbors:
+                    self.neighbors[name].add(fk["referred_table"])
+                    self.neighbors[fk["referred_table"]].add(name)
+            self.table_tokens[name] = estimate_tokens(self.catalog.render([name]))
+
+        self.document_frequency = Counter()
+        for terms in self.documents.values():
+            self.document_frequency.update(terms.keys())
+        lengths = [sum(terms.values()) for terms in self.documents.values()]
+        self.average_length = sum(lengths) / len(lengths) if lengths else 0
+        self._indexed_at = self.catalog.refreshed_at
+
+    def rank(self, question):
+        """
+        Score every table against the question.
+
+        Args:
+            question (str): Natural-language question.
+
+        Returns:
+            list of tuple: (table name, score) pairs sorted by descending score.
+        """
+        self.catalog.ensure_fresh()
+        if self._indexed_at != self.catalog.refreshed_at:
+            self._build_index()
+
+        query_terms = set(tokenize(question))
+        total = len(self.documents)
+        scores = []
+        for name, terms in self.documents.items():
+            length = sum(terms.values())
+            score = 0.0
+            for term in query_terms:
+                frequency = terms.get(term, 0)
+                if not frequency:
+                    continue
+                df = self.document_frequency[term]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                norm = self.K1 * (1 - self.B + self.B * length / (self.average_length or 1))
+                score += idf * frequency * (self.K1 + 1) / (frequency + norm)
+            scores.append((name, score))
+        scores.sort(key=lambda item: (-item[1], item[0]))
+        return scores
+
+    def select(self, question, top_k=None):
+        """
+        Pick the tables to show the LLM for a question.
+
+        Args:
+            question (str): Natural-language question.
+            top_k (int or None): Overrides the selector's `top_k` for this call.
+
+        Returns:
+            dict: `tables` to include, their `prompt_tokens`, the `full_tokens` of the
+            unpruned schema and the `tokens_saved` by pruning.
+        """
+        top_k = self.top_k if top_k is None else top_k
+        ranked = self.rank(question)
+        all_tables = [name for name, _ in ranked]
+
+        if top_k <= 0 or len(all_tables) <= top_k or not ranked or ranked[0][1] <= 0:
+            # Nothing to prune, or no table matches the question well enough to judge
+            selected = sorted(all_tables)
+        else:
+            selected = {name for name, score in ranked[:top_k] if score > 0}
+            if self.include_neighbors:
+                for name in list(selected):
+                    selected |= self.neighbors[name]
+            selected = sorted(selected)
+
+        full_tokens = sum(self.table_tokens.values())
+        prompt_tokens = sum(self.table_tokens[name] for name in selected)
+        selection = {
+            "tables": selected,
+            "prompt_tokens": prompt_tokens,
+            "full_tokens": full_tokens,
+            "tokens_saved": full_tokens - prompt_tokens,
+        }
+        logger.info(
+            f"Selected {len(selected)} of {len(all_tables)} tables, "
+            f"saving ~{selection['tokens_saved']} of {full_tokens} schema tokens"
+        )
+        return selection
+
+
+def get_table_selector(catalog) -> TableSelector:
+    return TableSelector(
+        catalog,
+        top_k=int(os.getenv("SQL_TOP_K_TABLES", 8)),
+        include_neighbors=os.getenv("SQL_INCLUDE_FK_NEIGHBORS", "true").lower() == "true",
+    )
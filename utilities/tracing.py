@@ -0,0 +1,185 @@
+import contextvars
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(".cache", "metrics"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+# Snapshots of processes that stopped writing this long ago are left out of /metrics
+METRICS_STALE_AFTER = float(os.getenv("METRICS_STALE_AFTER", 3600))
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_trace = contextvars.ContextVar("querybot_trace", default=None)
+
+
+class MetricsRegistry:
+    """
+    Per-process aggregate of span durations, numeric span tags and errors.
+
+    Streamlit and Flask run in separate processes, so every process periodically
+    writes its snapshot to `METRICS_DIR` and the `/metrics` endpoint merges them.
+    """
+
+    def __init__(self, metrics_dir=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self.path = os.path.join(metrics_dir, f"{socket.gethostname()}-{os.getpid()}.json")
+        self.histograms = {}
+        self.tag_totals = {}
+        self.errors = {}
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, tags=None, error=False):
+        with self._lock:
+            histogram = self.histograms.setdefault(stage, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+            for tag, value in (tags or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    key = f"{stage}|{tag}"
+                    self.tag_totals[key] = self.tag_totals.get(key, 0) + value
+            if error:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+        self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps({
+                "histograms": self.histograms, "tag_totals": self.tag_totals, "errors": self.errors,
+            }))
+
+    def flush(self, force=False):
+        """Write this process's snapshot for other processes to merge, at most every `flush_interval` seconds."""
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        try:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot {self.path}: {e}")
+
+
+metrics = MetricsRegistry()
+
+
+class Trace:
+    """Spans recorded during one request, in completion order."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def breakdown(self):
+        """
+        Returns:
+            list of dict: `stage`, `ms` and the span's tags, plus a final `total` entry.
+        """
+        rows = [dict(span["tags"], stage=span["name"], ms=round(span["seconds"] * 1000, 1)) for span in self.spans]
+        rows.append({"stage": "total", "ms": round((time.perf_counter() - self.started) * 1000, 1)})
+        return rows
+
+
+def start_trace():
+    """Start collecting spans for the current request and return the trace."""
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+@contextmanager
+def span(name, **tags):
+    """
+    Time a stage of the request.
+
+    Yields the span's tag dict so row counts, prompt sizes and similar can be added
+    while the stage runs. Numeric tags are also summed into the process metrics.
+    """
+    started = time.perf_counter()
+    error = False
+    try:
+        yield tags
+    except BaseException:
+        error = True
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        metrics.observe(name, seconds, tags, error=error)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append({"name": name, "seconds": seconds, "tags": tags})
+
+
+def record(name, seconds, **tags):
+    """Record a stage whose duration was measured by the caller, e.g. across generator resumptions."""
+    metrics.observe(name, seconds, tags)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append({"name": name, "seconds": seconds, "tags": tags})
+
+
+def collect_snapshots(metrics_dir=METRICS_DIR):
+    """Merge the snapshots of every live process, including this one."""
+    metrics.flush(force=True)
+    merged = {"histograms": {}, "tag_totals": {}, "errors": {}}
+    now = time.time()
+    for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+        try:
+            if now - os.path.getmtime(path) > METRICS_STALE_AFTER:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for stage, histogram in snapshot["histograms"].items():
+            target = merged["histograms"].setdefault(stage, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+            target["buckets"] = [a + b for a, b in zip(target["buckets"], histogram["buckets"])]
+            target["sum"] += histogram["sum"]
+            target["count"] += histogram["count"]
+        for key in ("tag_totals", "errors"):
+            for name, value in snapshot[key].items():
+                merged[key][name] = merged[key].get(name, 0) + value
+    return merged
+
+
+def render_prometheus(snapshot):
+    """Render a merged snapshot in the Prometheus text exposition format."""
+    lines = [
+        "# HELP querybot_stage_seconds Duration of pipeline stages.",
+        "# TYPE querybot_stage_seconds histogram",
+    ]
+    for stage, histogram in sorted(snapshot["histograms"].items()):
+        for bound, count in zip(BUCKETS, histogram["buckets"]):
+            lines.append(f'querybot_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'querybot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'querybot_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+        lines.append(f'querybot_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+    lines += [
+        "# HELP querybot_stage_tag_total Sum of numeric span tags such as rows and prompt tokens.",
+        "# TYPE querybot_stage_tag_total counter",
+    ]
+    for key, value in sorted(snapshot["tag_totals"].items()):
+        stage, tag = key.split("|", 1)
+        lines.append(f'querybot_stage_tag_total{{stage="{stage}",tag="{tag}"}} {value}')
+    lines += [
+        "# HELP querybot_stage_errors_total Stages that raised.",
+        "# TYPE querybot_stage_errors_total counter",
+    ]
+    for stage, value in sorted(snapshot["errors"].items()):
+        lines.append(f'querybot_stage_errors_total{{stage="{stage}"}} {value}')
+    return "\n".join(lines) + "\n"
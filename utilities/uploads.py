@@ -0,0 +1,44 @@
+import hashlib
+
+BLOCK_SIZE = 1 << 20
+
+
+def file_label(file):
+    """Name of a file path or an uploaded file, used in logs and as its frame label."""
+    return file if isinstance(file, str) else getattr(file, "name", str(file))
+
+
+def rewind(file):
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+
+def read_bytes(file):
+    """Whole contents of a file path or an uploaded file, leaving the upload rewound."""
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            return f.read()
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    rewind(file)
+    data = file.read()
+    rewind(file)
+    return data
+
+
+def file_digest(file):
+    """SHA-256 of a file's contents, read in `BLOCK_SIZE` blocks rather than all at once."""
+    digest = hashlib.sha256()
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                digest.update(block)
+    elif hasattr(file, "getbuffer"):
+        # Uploaded files are already in memory; hash them without a copy
+        digest.update(file.getbuffer())
+    else:
+        rewind(file)
+        for block in iter(lambda: file.read(BLOCK_SIZE), b""):
+            digest.update(block)
+        rewind(file)
+    return digest.hexdigest()
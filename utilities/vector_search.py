@@ -0,0 +1,219 @@
+import logging
+import math
+import weakref
+
+import numpy as np
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores import FAISS
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+
+# Store -> (index_to_docstore_id it was built from, its length, docstore id -> position)
+_positions_cache = weakref.WeakKeyDictionary()
+
+
+def load_faiss_index(path, embeddings):
+    """Load a FAISS store written by `save_local`."""
+    try:
+        return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    except TypeError:
+        # langchain releases before the pickle opt-in flag
+        return FAISS.load_local(path, embeddings)
+
+
+def build_faiss_index(documents, embeddings, index_type="flat", hnsw_neighbors=32, ivf_lists=None):
+    """
+    Embed documents into a FAISS store with a flat, HNSW or IVF index.
+
+    Flat search is exact and fine up to a few hundred thousand chunks; HNSW and IVF
+    trade a little recall for sub-linear search on larger corpora.
+
+    Args:
+        documents (list of Document): Chunks to index.
+        embeddings (Embeddings): Embedding model.
+        index_type (str): "flat", "hnsw" or "ivf".
+        hnsw_neighbors (int): Graph degree of the HNSW index.
+        ivf_lists (int or None): IVF cells. Defaults to about 4 * sqrt(number of chunks).
+
+    Returns:
+        FAISS: LangChain vector store.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index type: {index_type}")
+    if index_type == "flat":
+        return FAISS.from_documents(documents, embeddings)
+
+    import faiss
+
+    vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in documents]), dtype="float32")
+    dimensions = vectors.shape[1]
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimensions, hnsw_neighbors)
+    else:
+        lists = ivf_lists or max(1, int(4 * math.sqrt(len(vectors))))
+        # Training needs at least one vector per cell
+        lists = min(lists, len(vectors))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dimensions), dimensions, lists)
+        index.train(vectors)
+    index.add(vectors)
+    if index_type == "ivf":
+        # Lets MMR reconstruct candidate vectors
+        index.make_direct_map()
+
+    ids = [str(i) for i in range(len(documents))]
+    return FAISS(
+        embeddings,
+        index,
+        InMemoryDocstore(dict(zip(ids, documents))),
+        dict(enumerate(ids)),
+    )
+
+
+def _matches(metadata, filter):
+    if filter is None:
+        return True
+    if callable(filter):
+        return filter(metadata)
+    for key, expected in filter.items():
+        value = metadata.get(key)
+        if isinstance(expected, (list, tuple, set, frozenset)):
+            if value not in expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+def _docstore_positions(store):
+    """Docstore id -> index position, rebuilt when the store's mapping is replaced or grows."""
+    mapping = store.index_to_docstore_id
+    cached = _positions_cache.get(store)
+    # FAISS.delete replaces the mapping; add_documents extends it in place
+    if cached is None or cached[0] is not mapping or cached[1] != len(mapping):
+        cached = (mapping, len(mapping), {doc_id: position for position, doc_id in mapping.items()})
+        _positions_cache[store] = cached
+    return cached[2]
+
+
+def _allowed_positions(store, filter, ids):
+    """Sorted index positions of the chunks in `ids` (all when None) whose metadata matches `filter`."""
+    if ids is not None:
+        positions = _docstore_positions(store)
+        candidates = {positions[doc_id]: doc_id for doc_id in ids if doc_id in positions}
+    else:
+        candidates = store.index_to_docstore_id
+    if filter is not None:
+        candidates = {
+            position: doc_id for position, doc_id in candidates.items()
+            if _matches(store.docstore.search(doc_id).metadata, filter)
+        }
+    return np.asarray(sorted(candidates), dtype="int64")
+
+
+def _search_parameters(index, allowed):
+    """FAISS search parameters that only visit the vectors at `allowed` positions."""
+    import faiss
+
+    selector = faiss.IDSelectorBatch(len(allowed), faiss.swig_ptr(allowed))
+    # Passed to the constructor, not assigned: only constructor kwargs keep the Python
+    # object (and so the C++ selector) alive as long as the parameters
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _mmr(query_vector, candidate_vectors, k, lambda_mult):
+    """Indexes of `k` candidates picked by maximal marginal relevance."""
+    candidates = candidate_vectors / (np.linalg.norm(candidate_vectors, axis=1, keepdims=True) + 1e-12)
+    query = query_vector / (np.linalg.norm(query_vector) + 1e-12)
+    relevance = candidates @ query
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(candidates)):
+        redundancy = (candidates @ candidates[selected].T).max(axis=1)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+
+def _reconstruct(index, positions):
+    try:
+        return np.asarray([index.reconstruct(int(position)) for position in positions], dtype="float32")
+    except RuntimeError:
+        # IVF indexes loaded from disk may lack the id -> vector map
+        index.make_direct_map()
+        return np.asarray([index.reconstruct(int(position)) for position in positions], dtype="float32")
+
+
+def search(store, queries, k=4, score_threshold=None, filter=None, ids=None, fetch_k=20, mmr=False, lambda_mult=0.5,
+           nprobe=None):
+    """
+    Search a FAISS store with one or more queries in a single batched index call.
+
+    `filter` and `ids` restrict the index search itself to the matching vectors, so
+    a small subset of a large store is not crowded out of the candidates by others.
+
+    Args:
+        store (FAISS): LangChain FAISS store.
+        queries (str or list of str): Query text(s).
+        k (int): Results per query.
+        score_threshold (float or None): Minimum relevance score, in [0, 1] for normalized
+            embeddings; higher is more similar.
+        filter (dict or callable or None): Metadata filter. Dict values match exactly, list,
+            tuple or set values match any member, e.g. {"source": "manual.pdf", "page": [3, 4]}.
+            Checks the metadata of every chunk, so prefer `ids` on large stores.
+        ids (list of str or None): Docstore ids of the chunks to search among.
+        fetch_k (int): Candidates fetched per query before the score threshold and MMR.
+        mmr (bool): Re-rank candidates by maximal marginal relevance for diverse results.
+        lambda_mult (float): MMR trade-off between relevance (1) and diversity (0).
+        nprobe (int or None): IVF cells visited per query.
+
+    Returns:
+        list of (Document, float), or a list of such lists when `queries` is a list.
+    """
+    single = isinstance(queries, str)
+    queries = [queries] if single else list(queries)
+    if not queries or store.index.ntotal == 0:
+        return [] if single or not queries else [[] for _ in queries]
+    if nprobe is not None and hasattr(store.index, "nprobe"):
+        store.index.nprobe = nprobe
+
+    parameters, searchable = None, store.index.ntotal
+    if filter is not None or ids is not None:
+        allowed = _allowed_positions(store, filter, ids)
+        if len(allowed) == 0:
+            return [] if single else [[] for _ in queries]
+        if len(allowed) < searchable:
+            parameters, searchable = _search_parameters(store.index, allowed), len(allowed)
+
+    embedding = store.embedding_function
+    embed_query = embedding.embed_query if hasattr(embedding, "embed_query") else embedding
+    query_vectors = np.asarray([embed_query(query) for query in queries], dtype="float32")
+    fetch = max(k, fetch_k) if (mmr or score_threshold is not None) else k
+    if parameters is None:
+        distances, positions = store.index.search(query_vectors, min(fetch, searchable))
+    else:
+        distances, positions = store.index.search(query_vectors, min(fetch, searchable), params=parameters)
+
+    results = []
+    for query_vector, row_distances, row_positions in zip(query_vectors, distances, positions):
+        candidates = []
+        for distance, position in zip(row_distances, row_positions):
+            if position == -1:
+                continue
+            document = store.docstore.search(store.index_to_docstore_id[position])
+            # Squared L2 distance between unit vectors is in [0, 4]
+            score = 1.0 - math.sqrt(max(float(distance), 0.0)) / 2
+            if score_threshold is not None and score < score_threshold:
+                continue
+            candidates.append((document, score, position))
+
+        if mmr and len(candidates) > 1:
+            vectors = _reconstruct(store.index, [position for _, _, position in candidates])
+            candidates = [candidates[i] for i in _mmr(query_vector, vectors, k, lambda_mult)]
+        results.append([(document, score) for document, score, _ in candidates[:k]])
+    return results[0] if single else results
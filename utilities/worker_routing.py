@@ -0,0 +1,75 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def rendezvous_order(key, urls):
+    """
+    Order workers by rendezvous (highest random weight) hashing.
+
+    Every key prefers the same worker as long as it is up, and adding or removing
+    a worker only moves the keys that preferred it.
+    """
+    return sorted(urls, key=lambda url: hashlib.sha256(f"{url}|{key}".encode("utf-8")).digest(), reverse=True)
+
+
+class WorkerRouter:
+    """
+    Route conversations to chat workers, skipping workers that fail their health check.
+
+    Args:
+        urls (list of str): Base URLs of the Streamlit chat workers.
+        health_path (str): Health endpoint of a worker.
+        health_ttl (float): Seconds a health check result is reused.
+        timeout (float): Seconds a health check may take.
+    """
+
+    def __init__(self, urls, health_path="/_stcore/health", health_ttl=10, timeout=0.5):
+        self.urls = [url.rstrip("/") for url in urls]
+        self.health_path = health_path
+        self.health_ttl = health_ttl
+        self.timeout = timeout
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def healthy(self, url):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._health.get(url)
+        if cached and now - cached[1] < self.health_ttl:
+            return cached[0]
+        import requests
+        try:
+            ok = requests.get(url + self.health_path, timeout=self.timeout).ok
+        except requests.RequestException:
+            ok = False
+        if not ok:
+            logger.warning(f"Chat worker {url} failed its health check")
+        with self._lock:
+            self._health[url] = (ok, now)
+        return ok
+
+    def route(self, conversation_id):
+        """Base URL of the worker that should serve a conversation."""
+        order = rendezvous_order(str(conversation_id), self.urls)
+        if len(order) == 1:
+            return order[0]
+        for url in order:
+            if self.healthy(url):
+                return url
+        # Nothing answered; the preferred worker is as good a guess as any
+        return order[0]
+
+
+def get_worker_router():
+    """Router over the comma-separated CHAT_WORKER_URLS, defaulting to a single local worker."""
+    urls = [url.strip() for url in os.getenv("CHAT_WORKER_URLS", "http://localhost:8501").split(",") if url.strip()]
+    return WorkerRouter(
+        urls,
+        health_ttl=float(os.getenv("CHAT_WORKER_HEALTH_TTL", 10)),
+        timeout=float(os.getenv("CHAT_WORKER_HEALTH_TIMEOUT", 0.5)),
+    )